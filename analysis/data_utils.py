@@ -3,9 +3,15 @@ import csv
 import os
 import sys
 import numpy as np
+import scipy.sparse
 import logging as log
 import dill
 
+# dataset files written by the preprocessing scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'preprocess'))
+import dataset
+import sequences
+
 
 # set to True to enable debugging information
 DEBUG_ON = False
@@ -69,11 +75,17 @@ The design of this is that the logger object should be imported and used by all
 class WebsiteData(object):
     """
     Object-wrapper to conveniently manage dataset
+
+    Sparse feature matrices are held in CSC format, as features are accessed column by column.
     """
     def __init__(self, directory, **kwargs):
         self._X, self._Y = load_data(directory, **kwargs)
+        if scipy.sparse.issparse(self._X):
+            self._X = self._X.tocsc()
+            self._X.eliminate_zeros()
         self.features = list(range(self._X.shape[1]))
         self.sites = list(range(len(np.unique(self._Y))))
+        self._nonzero = None
 
     def __len__(self):
         return self._X.shape[0]
@@ -108,7 +120,7 @@ class WebsiteData(object):
         """
         f = [True if y == label else False for y in self._Y]
         if feature is not None:
-            return self._X[f, feature]
+            return self._column(feature, f)
         return self._X[f, :]
 
     def get_feature(self, feature, site=None):
@@ -130,8 +142,40 @@ class WebsiteData(object):
         """
         if site is not None:
             f = [True if y == site else False for y in self._Y]
-            return self._X[f, feature]
-        return self._X[:, feature]
+            return self._column(feature, f)
+        return self._column(feature)
+
+    def _column(self, feature, rows=None):
+        """
+        Return one feature for all or the selected rows as a dense vector.
+        """
+        if scipy.sparse.issparse(self._X):
+            column = self._X[:, feature].toarray().ravel()
+            return column if rows is None else column[np.asarray(rows, dtype=bool)]
+        if rows is None:
+            return self._X[:, feature]
+        return self._X[rows, feature]
+
+    def nonzero_fraction(self, feature):
+        """
+        Return the fraction of instances for which a feature is not zero.
+
+        Parameters
+        ----------
+        feature : int
+            The feature to check.
+
+        Returns
+        -------
+        float
+
+        """
+        if self._nonzero is None:
+            if scipy.sparse.issparse(self._X):
+                self._nonzero = np.diff(self._X.indptr)
+            else:
+                self._nonzero = np.count_nonzero(self._X, axis=0)
+        return self._nonzero[feature] / float(self._X.shape[0])
 
 
 def load_data(directory, extension='.features', delimiter=' ', split_at='-',
@@ -162,15 +206,23 @@ def load_data(directory, extension='.features', delimiter=' ', split_at='-',
         Determines whether or not ascii feature files should be packed into a condensed pickle file.
         If True, the function will attempt to load from the packed feature file as well.
         The packed feature file is saved in the root of the same directory as the feature files.
+        Ignored when the directory holds a feature matrix or sequence tensor (see ``load_matrix``).
 
     Returns
     -------
-    ndarray
+    ndarray or scipy.sparse.csr_matrix
         Numpy array of Nxf containing site visit feature instances.
+        A sparse feature matrix (``extract.py --sparse``) is returned in CSR format.
     ndarray
         Numpy array of Nx1 containing the labels for site visits.
 
     """
+    # load the feature matrix written by extract.py --matrix or the sequences of sequences.py if they exist
+    if any(os.path.exists(os.path.join(directory, name))
+           for name in ("features.npy", "features.npz", sequences.SEQUENCES_FILE)):
+        return load_matrix(directory, max_classes=max_classes,
+                           min_instances=min_instances, max_instances=max_instances)
+
     # load pickle file if it exist
     feat_pkl = os.path.join(directory, "features.pkl")
     if os.path.exists(feat_pkl) and pack_dataset:
@@ -258,3 +310,66 @@ def load_data(directory, extension='.features', delimiter=' ', split_at='-',
     # return X and Y as numpy arrays
     return X, Y
 
+
+def load_matrix(directory, max_classes=99999, min_instances=100, max_instances=500):
+    """
+    Load the feature matrix written by ``extract.py --matrix``.
+
+    The same class and instance limits as ``load_data`` are applied,
+    without parsing any ascii feature files.
+    A sparse matrix (``features.npz``, written with ``--sparse``) is kept in CSR format.
+    Without a feature matrix, the packet sequence tensor ``sequences.npy`` written by ``sequences.py``
+    is loaded instead, one row per trace: (N, L, 2) direction and timing sequences are flattened to
+    (N, 2L), with the direction and timestamp of each packet side by side.
+
+    Parameters
+    ----------
+    directory : str
+        System file path to a directory containing ``features.npy`` (or ``features.npz``, or ``sequences.npy``)
+        and ``sites.npy``.
+    max_classes : int
+        Maximum number of classes to load.
+    min_instances : int
+        Minimum number of instances acceptable per class.
+    max_instances : int
+        Maximum number of instances to load per class.
+
+    Returns
+    -------
+    ndarray or scipy.sparse.csr_matrix
+        Numpy array of Nxf containing site visit feature instances.
+    ndarray
+        Numpy array of Nx1 containing the labels for site visits.
+
+    """
+    if os.path.exists(os.path.join(directory, "features.npz")):
+        X = scipy.sparse.load_npz(os.path.join(directory, "features.npz")).tocsr()
+        sites = np.load(os.path.join(directory, "sites.npy"))
+    elif os.path.exists(os.path.join(directory, "features.npy")):
+        X = np.load(os.path.join(directory, "features.npy"), mmap_mode='r')
+        sites = np.load(os.path.join(directory, "sites.npy"))
+    else:
+        X, sites, _ = sequences.load_sequences(directory, flat=True)
+
+    # a dataset grown by ``extract.py --watch`` records its complete rows in progress.json
+    rows = dataset.committed_rows(directory)
+    X, sites = X[:rows], sites[:rows]
+
+    # rank of each row within its class, in row order
+    order = np.argsort(sites, kind='stable')
+    _, starts, counts = np.unique(sites[order], return_index=True, return_counts=True)
+    rank = np.empty(len(sites), dtype=np.int64)
+    rank[order] = np.arange(len(sites)) - np.repeat(starts, counts)
+
+    # drop classes above the maximum and instances above the per-class maximum
+    keep = (sites < max_classes) & (rank < max_instances)
+
+    # drop classes with too few instances
+    labels, counts = np.unique(sites[keep], return_counts=True)
+    keep &= np.isin(sites, labels[counts >= min_instances])
+
+    # adjust labels such that they are assigned a number from 0..N
+    _, Y = np.unique(sites[keep], return_inverse=True)
+    if scipy.sparse.issparse(X):
+        return X[keep], Y
+    return np.asarray(X[keep]), Y
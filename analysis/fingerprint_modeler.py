@@ -8,7 +8,7 @@ import numpy as np
 
 class WebsiteFingerprintModeler(object):
 
-    def __init__(self, data, pool=None, web_priors=None, discrete_threshold=10000):
+    def __init__(self, data, pool=None, web_priors=None, discrete_threshold=10000, sparse_threshold=0.0):
         """
         Instantiate a fingerprint modeler.
 
@@ -16,6 +16,11 @@ class WebsiteFingerprintModeler(object):
         ----------
         data : WebsiteData
             Website trace data object
+        sparse_threshold : float
+            Features which are non-zero for at most this fraction of instances are modeled
+            by their per-site value frequencies instead of AKDEs (see ``_sparse_predictions``).
+            By default only features which are zero everywhere are, which leak nothing either way.
+            Use a negative value to model every feature with AKDEs.
 
         """
         self.sample_size = 1000
@@ -23,6 +28,7 @@ class WebsiteFingerprintModeler(object):
         self.website_priors = web_priors if web_priors else [1/float(len(self.data.sites)) for _ in self.data.sites]
         self._pool = pool
         self.discrete_threshold = discrete_threshold
+        self.sparse_threshold = sparse_threshold
 
     def _make_kde(self, features, site=None):
         """
@@ -103,6 +109,48 @@ class WebsiteFingerprintModeler(object):
 
         return samples
 
+    def _sparse_predictions(self, feature):
+        """
+        Produce the site x prediction matrix for a feature which is almost always zero.
+
+        The few distinct values of such a feature are modeled as a discrete distribution per site,
+        estimated from their frequencies, which is what the AKDEs of a feature dominated by one
+        repeated value approach. Samples are drawn per site as in ``_sample``.
+        A feature which is zero everywhere predicts the same for every site, and so leaks nothing.
+
+        Parameters
+        ----------
+        feature : int
+            Feature to be modeled.
+
+        Returns
+        -------
+        ndarray
+            Numpy array of dimensions (n_sites, n_samples) containing
+            the probability predictions for samples of each site.
+
+        """
+        columns = [self.data.get_site(site, feature) for site in self.data.sites]
+        values, inverse = np.unique(np.concatenate(columns), return_inverse=True)
+
+        # pdf(f|c) -- frequency of every value for each site
+        freqs = np.zeros((len(columns), len(values)))
+        start = 0
+        for site, column in enumerate(columns):
+            freqs[site] = np.bincount(inverse[start:start + len(column)], minlength=len(values)) / len(column)
+            start += len(column)
+
+        # sample values, n = k * pr(c[i]) per site, as _sample does
+        samples = []
+        for site in self.data.sites:
+            num = int(self.sample_size * self.website_priors[site])
+            if num > 0:
+                samples.extend(np.random.choice(len(values), size=num, p=freqs[site]))
+
+        # scale predictions so that the largest is one, as _do_predictions does
+        probs = freqs[:, samples]
+        return probs / np.amax(probs)
+
     def _do_predictions(self, cluster):
         """
         Produce the site x prediction matrix for a cluster.
@@ -119,6 +167,10 @@ class WebsiteFingerprintModeler(object):
             the probability predictions for samples of each site.
 
         """
+        # fast path for features which are almost always zero
+        if len(cluster) == 1 and self.data.nonzero_fraction(cluster[0]) <= self.sparse_threshold:
+            return self._sparse_predictions(cluster[0])
+
         mkdes = [self._make_kde(cluster, site) for site in self.data.sites]
 
         # performing sampling for monte-carlo evaluation of H(C|f)
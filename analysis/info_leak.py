@@ -72,6 +72,12 @@ def parse_args():
                         type=int,
                         default=100000,
                         help="The threshold to use for identifying discrete data samples.")
+    parser.add_argument("--sparse_threshold",
+                        type=float,
+                        default=0.0,
+                        help="Features which are non-zero for at most this fraction of instances are modeled "
+                             "from their value frequencies instead of AKDEs (by default only all-zero features). "
+                             "Use a negative value to disable.")
     return parser.parse_args()
 
 
@@ -141,7 +147,8 @@ def _individual_measure(modeler, pool, checkpoint):
     return leakage_indiv
 
 
-def main(features_path, output_path, n_procs=0, n_samples=5000, topn=100, nmi_threshold=0.9, discrete_threshold=100000):
+def main(features_path, output_path, n_procs=0, n_samples=5000, topn=100, nmi_threshold=0.9, discrete_threshold=100000,
+         sparse_threshold=0.0):
     """
     Run the full information leakage analysis on a processed dataset.
 
@@ -160,6 +167,8 @@ def main(features_path, output_path, n_procs=0, n_samples=5000, topn=100, nmi_th
         Top number of features to analyze during joint analysis.
     nmi_threshold : float
         Cut-off value for determining redundant features. Should be a percentage value.
+    sparse_threshold : float
+        Largest fraction of non-zero instances for which a feature is modeled from its value frequencies.
 
     Returns
     -------
@@ -186,7 +195,8 @@ def main(features_path, output_path, n_procs=0, n_samples=5000, topn=100, nmi_th
         os.makedirs(outdir)
 
     # initialize fingerprint modeler
-    modeler = WebsiteFingerprintModeler(feature_data, discrete_threshold=discrete_threshold)
+    modeler = WebsiteFingerprintModeler(feature_data, discrete_threshold=discrete_threshold,
+                                        sparse_threshold=sparse_threshold)
 
     # load previous leakage measurements if possible
     indiv_path = os.path.join(outdir, 'indiv.pkl')
@@ -275,7 +285,8 @@ if __name__ == "__main__":
              n_samples=args.n_samples,
              topn=args.topn,
              nmi_threshold=args.nmi_threshold,
-             discrete_threshold=args.discrete_threshold)
+             discrete_threshold=args.discrete_threshold,
+             sparse_threshold=args.sparse_threshold)
     except KeyboardInterrupt:
         sys.exit(-1)
 
@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.sparse
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import cross_val_score
 import json
@@ -6,17 +7,52 @@ import sys
 import os
 import csv
 
+# dataset files written by the preprocessing scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'preprocess'))
+import dataset
+import sequences
+
 #### Parameters ####
 num_Trees = 1000
 SEED = 1
 
 
+def kept_columns(width):
+    """
+    Indices of the columns of a feature vector of the given width left once the time features are removed
+    """
+    columns = np.arange(width)
+    return np.concatenate((columns[:13], columns[37:2813], columns[2939:]))
+
+
 def load_data(directory, extension='.features', delimiter=' '):
     """
     Load feature files from feature directory
-    :return X - numpy array of data instances w/ shape (n,f)
+    :return X - numpy array of data instances w/ shape (n,f), or a CSR matrix for sparse datasets
     :return Y - numpy array of data labels w/ shape (n,1)
     """
+    # sparse feature matrix written by extract.py --matrix --sparse; random forests train on it as it is
+    if os.path.exists(os.path.join(directory, "features.npz")):
+        X = scipy.sparse.load_npz(os.path.join(directory, "features.npz")).tocsr()
+        Y = np.load(os.path.join(directory, "sites.npy"))
+        rows = dataset.committed_rows(directory)
+        X, Y = X[:rows], Y[:rows]
+        return X[:, kept_columns(X.shape[1])], Y  # remove time features
+
+    # dense feature matrix written by extract.py --matrix
+    if os.path.exists(os.path.join(directory, "features.npy")):
+        X = np.load(os.path.join(directory, "features.npy"), mmap_mode='r')
+        Y = np.load(os.path.join(directory, "sites.npy"))
+        # rows appended by a running extract.py --watch may not be complete yet
+        rows = dataset.committed_rows(directory)
+        X, Y = X[:rows], Y[:rows]
+        return X[:, kept_columns(X.shape[1])], Y  # remove time features
+
+    # packet sequences written by preprocess/sequences.py, (N, L, 2) flattened to (N, 2L)
+    if os.path.exists(os.path.join(directory, sequences.SEQUENCES_FILE)):
+        X, Y, _ = sequences.load_sequences(directory, flat=True)
+        return X, Y
+
     X = []  # feature instances
     Y = []  # site labels
     for root, dirs, files in os.walk(directory):
@@ -29,7 +65,7 @@ def load_data(directory, extension='.features', delimiter=' '):
             cls, ins = file.split("-")
             with open(os.path.join(root, file), "r") as csvFile:
                 features = [float(f) for f in list(csv.reader(csvFile, delimiter=delimiter))[0] if f]
-                features = features[:13] + features[37:2813] + features[2939:]  # remove time features
+                features = [features[i] for i in kept_columns(len(features))]  # remove time features
                 X.append(features)
                 Y.append(int(cls))
 
@@ -31,7 +31,8 @@ FEATURE_CATEGORIES = [
     ('CUMUL', (2940, 3043))
 ]
 
-# 5000-input DF features
+# 5000-input DF features (raw direction sequences are built by preprocess/sequences.py
+# and loaded by analysis/data_utils.load_data as one column per packet)
 #FEATURE_CATEGORIES = [
 #    ('DF Features', (1, 5120))
 #]
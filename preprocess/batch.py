@@ -0,0 +1,182 @@
+# batched feature extraction over ragged arrays
+# a batch of traces is given as concatenated times and sizes arrays plus offsets,
+# trace i spanning [offsets[i], offsets[i + 1]) (the layout of a trace store, see trace_store.py,
+# so a run of store traces is a batch without copying).
+# feature blocks listed in BATCH_BLOCKS are computed for all traces of a batch at once with
+# segment operations; their parts which have no batch kernel run trace by trace (see extract.extract_batch)
+import numpy as np
+
+import util
+from features import Burst
+from features.common import X
+from features.derived import lazy
+
+
+class Batch(object):
+    """
+    Ragged view of a batch of traces
+    """
+    def __init__(self, times, sizes, offsets):
+        offsets = np.asarray(offsets, dtype=np.int64)
+        start, end = offsets[0], offsets[-1]
+        self.offsets = offsets - start
+        self.times = np.asarray(times[start:end])
+        self.sizes = np.asarray(sizes[start:end])
+        if np.issubdtype(self.sizes.dtype, np.integer):
+            # packed stores keep int16 sizes, which would overflow in sums
+            self.sizes = self.sizes.astype(np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @lazy
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @lazy
+    def ids(self):
+        """
+        trace index of every packet
+        """
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    @lazy
+    def ranks(self):
+        """
+        position of every packet within its trace
+        """
+        return np.arange(self.offsets[-1]) - np.repeat(self.offsets[:-1], self.lengths)
+
+    @lazy
+    def outgoing(self):
+        return self.sizes > 0
+
+    def traces(self):
+        """
+        yield the (times, sizes) lists of every trace, as read from a trace file
+        """
+        for a, b in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.times[a:b].tolist(), self.sizes[a:b].tolist()
+
+
+class per_trace(object):
+    """
+    Part of a batched block computed trace by trace with a per-trace feature block
+    """
+    def __init__(self, block):
+        self.block = block
+
+
+def _round_arbitrary(x, base):
+    # PktNum.roundArbitrary; numpy and python both round halves to even
+    return base * np.round(x / base)
+
+
+def packet_number(batch):
+    """
+    batched PktNum.PacketNumFeature
+    """
+    total = batch.lengths
+    if not total.all():
+        raise ZeroDivisionError("float division by zero")
+    count = np.bincount(batch.ids, weights=batch.outgoing, minlength=len(batch)).astype(np.int64)
+    out_total = count / total * 100
+    in_total = (total - count) / total * 100
+    return np.column_stack([total, count, total - count, out_total, in_total,
+                            _round_arbitrary(total, 15), _round_arbitrary(count, 15),
+                            _round_arbitrary(total - count, 15),
+                            _round_arbitrary(out_total, 5), _round_arbitrary(in_total, 5),
+                            total * 512, count * 512, (total - count) * 512])
+
+
+def unique_packet_length(batch):
+    """
+    batched PktLen.PktLenFeature
+    """
+    sizes = batch.sizes
+    present = np.zeros((len(batch), 3001))
+    known = (sizes >= -1500) & (sizes <= 1500) & (sizes == np.floor(sizes))
+    present[batch.ids[known], (sizes[known] + 1500).astype(np.int64)] = 1
+    return present
+
+
+def first20(batch):
+    """
+    batched HeadTail.First20
+    """
+    head = np.full((len(batch), 20), X, dtype=np.float64)
+    sel = batch.ranks < 20
+    head[batch.ids[sel], batch.ranks[sel]] = batch.sizes[sel] + 1500
+    return head
+
+
+def interval_knn(batch):
+    """
+    batched Interval.IntervalFeature(..., 'KNN')
+    """
+    intervals = np.full((len(batch), 600), X, dtype=np.float64)
+    for column, mask in ((0, batch.sizes > 0), (300, batch.sizes < 0)):
+        idx = np.flatnonzero(mask)
+        trace = batch.ids[idx]
+        position = batch.ranks[idx]
+        first = np.ones(len(idx), dtype=bool)
+        first[1:] = trace[1:] != trace[:-1]
+        # the first interval of a trace counts from position 0
+        previous = np.zeros(len(idx), dtype=np.int64)
+        previous[1:] = position[:-1]
+        previous[first] = 0
+        nth = np.arange(len(idx)) - np.maximum.accumulate(np.where(first, np.arange(len(idx)), 0))
+        sel = nth < 300
+        intervals[trace[sel], column + nth[sel]] = (position - previous)[sel]
+    return intervals
+
+
+def pkt_distribution(batch):
+    """
+    batched PktDistribution.PktDistFeature
+    """
+    n = len(batch)
+    # outgoing packets per complete 30-packet window of the first 6000 packets
+    windows = np.minimum(batch.lengths, 6000) // 30
+    sel = batch.ranks < (windows * 30)[batch.ids]
+    temp = np.bincount(batch.ids[sel] * 200 + batch.ranks[sel] // 30, weights=batch.outgoing[sel],
+                       minlength=n * 200).astype(np.int64).reshape(n, 200)
+    bucket = temp.reshape(n, 20, 10).sum(axis=2)
+    # row-wise reductions give the values of the per-trace reductions
+    return np.column_stack([temp, np.std(temp, axis=1), np.mean(temp, axis=1), np.median(temp, axis=1),
+                            np.max(temp, axis=1), bucket, bucket.sum(axis=1)])
+
+
+def ngram(batch):
+    """
+    batched Ngram.NgramFeature(..., util.NGRAM)
+    """
+    grams = sorted([util.NGRAM] if isinstance(util.NGRAM, int) else util.NGRAM)
+    n_traces = len(batch)
+    bits = batch.outgoing.astype(np.int64)
+    # packets left in their trace after each packet
+    remaining = batch.lengths[batch.ids] - batch.ranks
+    codes, n = bits, 1
+    counts = []
+    for Ng in grams:
+        while n < Ng:
+            # windows running past the end of their trace are masked out below
+            codes = (codes[:-1] << 1) | bits[n:]
+            n += 1
+        valid = remaining[:len(codes)] >= Ng
+        counts.append(np.bincount(batch.ids[:len(codes)][valid] * 2 ** Ng + codes[valid],
+                                  minlength=n_traces * 2 ** Ng).reshape(n_traces, 2 ** Ng))
+    return np.hstack(counts)
+
+
+# feature blocks with a batch implementation: the parts making up the block, in output order
+BATCH_BLOCKS = {
+    'PACKET_NUMBER': [packet_number],
+    'UNIQUE_PACKET_LENGTH': [unique_packet_length],
+    'INTERVAL_KNN': [interval_knn],
+    'PKT_DISTRIBUTION': [pkt_distribution],
+    'FIRST20': [first20],
+    'NGRAM': [ngram],
+    'KNN_ATTACK': [first20, per_trace(Burst.BurstFeature), pkt_distribution, interval_knn],
+    'DF_ATTACK': [packet_number, unique_packet_length],
+}
@@ -0,0 +1,78 @@
+# per-feature-block column cache for extract.py --matrix
+# each feature block is stored as its own column group under <output>/blocks/<BLOCK>-<param hash>/,
+# a dense dataset (see dataset.py) plus the state of the trace each row was extracted from.
+# a group is keyed by the block name and the util.py parameters it depends on,
+# so changing one block's settings or enabling a new block only computes that block
+import os
+import json
+import hashlib
+
+import numpy as np
+
+import dataset
+
+BLOCKS_DIR = 'blocks'
+SIGNATURES_FILE = 'signatures.npy'
+PARAMS_FILE = 'params.json'
+
+
+def trace_signature(entry):
+    """
+    compact description of a trace's state, from its manifest entry
+    """
+    return '{}:{}:{}'.format(entry['size'], entry['mtime'], entry.get('hash', ''))
+
+
+class BlockGroup(object):
+    """
+    Cached columns of one feature block
+    """
+    def __init__(self, out_path, name, params):
+        self.name = name
+        key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+        self.path = os.path.join(out_path, BLOCKS_DIR, '{}-{}'.format(name, key))
+        self.params = params
+
+        # rows cached by a previous run
+        self._X, self._rows, self._signatures = None, {}, []
+        if dataset.is_dataset(self.path):
+            self._X, sites, instances = dataset.load_dataset(self.path)
+            self._signatures = np.load(os.path.join(self.path, SIGNATURES_FILE)).tolist()
+            self._rows = {label: row for row, label in enumerate(zip(sites.tolist(), instances.tolist()))}
+        self._writer = None
+        self._new_signatures = []
+
+    def find(self, label, signature):
+        """
+        cached row index of a (site, instance) trace, or None if missing or outdated
+        """
+        row = self._rows.get(label)
+        if row is None or self._signatures[row] != signature:
+            return None
+        return row
+
+    def __getitem__(self, row):
+        return self._X[row]
+
+    def open(self):
+        """
+        start rewriting the group
+        """
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._writer = dataset.MatrixWriter(self.path)
+        self._new_signatures = []
+
+    def write(self, features, label, signature):
+        self._writer.write(features, label[0], label[1])
+        self._new_signatures.append(signature)
+
+    def close(self):
+        order = self._writer.close()
+        self._writer = None
+        if order is None:
+            return
+        signatures = np.array(self._new_signatures, dtype=str)[order]
+        np.save(os.path.join(self.path, SIGNATURES_FILE), signatures)
+        with open(os.path.join(self.path, PARAMS_FILE), 'w') as fd:
+            json.dump(self.params, fd)
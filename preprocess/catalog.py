@@ -0,0 +1,170 @@
+# persistent trace catalog
+# an sqlite index of the traces under a directory root: (site, instance, path, packet count,
+# byte size, duration), built once with a parallel os.scandir walk and refreshed incrementally,
+# so that large or network-mounted trace directories do not have to be walked and parsed on every run
+import os
+import sqlite3
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import Pool
+
+from traces import read_trace, trace_pattern
+
+TraceRecord = namedtuple('TraceRecord', ['site', 'instance', 'path', 'packets', 'bytes', 'duration',
+                                         'file_size', 'mtime'])
+
+
+def _scan_dir(path, pattern):
+    """
+    list the matching trace files and the subdirectories of one directory
+    """
+    files, dirs = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+            else:
+                match = pattern.fullmatch(entry.name)
+                if match:
+                    stat = entry.stat()
+                    files.append((int(match.group(1)), int(match.group(2)), entry.path,
+                                  stat.st_size, stat.st_mtime_ns))
+    return files, dirs
+
+
+def scan(root, splitter='-', extension='', workers=16):
+    """
+    recursively list trace files under root, scanning directories in parallel
+    returns (site, instance, path, file size, mtime) tuples
+    """
+    pattern = trace_pattern(splitter, extension)
+    found = []
+    with ThreadPoolExecutor(workers) as executor:
+        pending = {executor.submit(_scan_dir, root, pattern)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                found.extend(files)
+                pending.update(executor.submit(_scan_dir, d, pattern) for d in dirs)
+    return found
+
+
+def trace_summary(path):
+    """
+    packet count, byte size and duration of a trace file
+    """
+    try:
+        times, sizes = read_trace(path)
+    except (ValueError, IndexError):
+        return 0, 0, 0.0
+    if not times:
+        return 0, 0, 0.0
+    return len(times), sum(abs(size) for size in sizes), max(times) - min(times)
+
+
+class Catalog(object):
+    """
+    Persistent index of the traces of a directory
+    """
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS traces ('
+                         'path TEXT PRIMARY KEY, site INTEGER, instance INTEGER, packets INTEGER, '
+                         'bytes INTEGER, duration REAL, file_size INTEGER, mtime INTEGER)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS traces_label ON traces (site, instance)')
+        self._db.commit()
+
+    def refresh(self, root, extension='', processes=None):
+        """
+        bring the catalog up to date with the trace files under root
+        only new or modified files are parsed; entries of removed files are dropped
+        returns the number of (added or updated, removed) traces
+        """
+        found = scan(os.path.abspath(root), extension=extension)
+        known = dict(((path, (file_size, mtime)) for path, file_size, mtime in
+                      self._db.execute('SELECT path, file_size, mtime FROM traces')))
+
+        changed = [record for record in found if known.get(record[2]) != (record[3], record[4])]
+        removed = set(known) - set(record[2] for record in found)
+
+        if changed:
+            pool = Pool(processes)
+            summaries = pool.imap(trace_summary, [record[2] for record in changed], chunksize=64)
+            self._db.executemany('INSERT OR REPLACE INTO traces VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                 ((path, site, instance, packets, size, duration, file_size, mtime)
+                                  for (site, instance, path, file_size, mtime), (packets, size, duration)
+                                  in zip(changed, summaries)))
+            pool.close()
+            pool.join()
+        self._db.executemany('DELETE FROM traces WHERE path = ?', ((path,) for path in removed))
+        self._db.commit()
+        return len(changed), len(removed)
+
+    def query(self, sites=None, instances=None):
+        """
+        list the catalogued traces ordered by (site, instance)
+        sites and instances optionally restrict the result to a half-open [start, stop) range
+        """
+        sql = 'SELECT site, instance, path, packets, bytes, duration, file_size, mtime FROM traces'
+        conditions, args = [], []
+        for column, bounds in (('site', sites), ('instance', instances)):
+            if bounds is not None:
+                conditions.append('{0} >= ? AND {0} < ?'.format(column))
+                args.extend(bounds)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY site, instance'
+        return [TraceRecord(*row) for row in self._db.execute(sql, args)]
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM traces').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+def open_catalog(path, root, extension=''):
+    """
+    open the catalog at path and refresh it with the trace files under root
+    """
+    catalog = Catalog(path)
+    catalog.refresh(root, extension=extension)
+    return catalog
+
+
+def parse_range(text):
+    """
+    parse a 'start:stop' command line range
+    """
+    if text is None:
+        return None
+    start, stop = text.split(':')
+    return int(start), int(stop)
+
+
+def parse_args():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser("Build or refresh the catalog of a trace directory.")
+    parser.add_argument("-t", "--traces", required=True)
+    parser.add_argument("-c", "--catalog", required=True)
+    parser.add_argument("-e", "--extension", default='.cell')
+    parser.add_argument("--sites", default=None, help="List only sites in a 'start:stop' range.")
+    parser.add_argument("--instances", default=None, help="List only instances in a 'start:stop' range.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    catalog = Catalog(args.catalog)
+    updated, removed = catalog.refresh(args.traces, extension=args.extension)
+    print("{} traces catalogued ({} added or updated, {} removed)".format(len(catalog), updated, removed))
+    if args.sites or args.instances:
+        for record in catalog.query(sites=parse_range(args.sites), instances=parse_range(args.instances)):
+            print("{}-{}\t{}\t{}\t{}\t{}".format(record.site, record.instance, record.packets, record.bytes,
+                                                  record.duration, record.path))
+    catalog.close()
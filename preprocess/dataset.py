@@ -0,0 +1,310 @@
+# dense feature dataset written by extract.py --matrix
+#   features.npy  -- N x F float32 feature matrix, one row per trace
+#                    (or features.npz, the same matrix in scipy CSR format, with extract.py --sparse)
+#   sites.npy     -- N site labels
+#   instances.npy -- N instance numbers
+# rows are ordered by (site, instance); FeaturePositions.json describes the column blocks
+# datasets grown by extract.py --watch keep their rows in arrival order instead,
+# and record the number of complete rows in progress.json (see DatasetAppender)
+import os
+import json
+
+import numpy as np
+import scipy.sparse
+
+FEATURES_FILE = 'features.npy'
+SPARSE_FEATURES_FILE = 'features.npz'
+SITES_FILE = 'sites.npy'
+INSTANCES_FILE = 'instances.npy'
+PROGRESS_FILE = 'progress.json'
+
+
+def is_dataset(path):
+    """
+    check whether a directory holds a feature dataset
+    """
+    return (os.path.isfile(os.path.join(path, FEATURES_FILE)) or
+            os.path.isfile(os.path.join(path, SPARSE_FEATURES_FILE)))
+
+
+def _drop_stale(out_path, sparse):
+    """
+    remove the feature matrix of the other format left by an earlier run
+    """
+    stale = os.path.join(out_path, FEATURES_FILE if sparse else SPARSE_FEATURES_FILE)
+    if os.path.exists(stale):
+        os.remove(stale)
+
+
+def _save_sparse(out_path, X):
+    """
+    save a sparse feature matrix to features.npz in CSR format
+    """
+    tmp = os.path.join(out_path, 'features.tmp.npz')
+    scipy.sparse.save_npz(tmp, X.tocsr(), compressed=False)
+    os.replace(tmp, os.path.join(out_path, SPARSE_FEATURES_FILE))
+    _drop_stale(out_path, True)
+
+
+class MatrixWriter(object):
+    """
+    Collect feature rows, in any order, into a float32 matrix on disk
+
+    Rows are buffered and appended to a scratch file in large sequential writes.
+    On close they are sorted by (site, instance) into features.npy,
+    which replaces any previous matrix only once it is complete.
+    If sparse is set, every buffer of rows is kept as a CSR block instead,
+    and the matrix is saved in CSR format to features.npz.
+    """
+    def __init__(self, out_path, buffer_rows=1024, sparse=False):
+        self.out_path = out_path
+        self.sparse = sparse
+        self._blocks = []
+        self.sites = []
+        self.instances = []
+        self.width = None
+        self._buffer = []
+        self._buffer_rows = buffer_rows
+        self._scratch = os.path.join(out_path, 'features.rows.tmp')
+        self._fd = None
+
+    def write(self, features, site, instance):
+        """
+        add the feature row of one trace
+        """
+        if self.width is None:
+            # the row width is only known once the first trace has been extracted
+            self.width = len(features)
+            if not self.sparse:
+                self._fd = open(self._scratch, 'wb')
+        elif len(features) != self.width:
+            raise ValueError("trace {}-{} has {} features, expected {}"
+                             .format(site, instance, len(features), self.width))
+        self._buffer.append(np.asarray(features, dtype=np.float32))
+        self.sites.append(site)
+        self.instances.append(instance)
+        if len(self._buffer) >= self._buffer_rows:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            if self.sparse:
+                self._blocks.append(scipy.sparse.csr_matrix(np.stack(self._buffer)))
+            else:
+                self._fd.write(np.stack(self._buffer).tobytes())
+            self._buffer = []
+
+    def close(self):
+        """
+        sort the rows into features.npy and save the label arrays
+        returns the order in which the written rows were stored, or None if no row was written
+        """
+        if self.width is None:
+            return None
+        self._flush()
+
+        sites = np.array(self.sites, dtype=np.int32)
+        instances = np.array(self.instances, dtype=np.int32)
+        order = np.lexsort((instances, sites))
+        if self.sparse:
+            _save_sparse(self.out_path, scipy.sparse.vstack(self._blocks, format='csr')[order])
+            self._blocks = []
+            np.save(os.path.join(self.out_path, SITES_FILE), sites[order])
+            np.save(os.path.join(self.out_path, INSTANCES_FILE), instances[order])
+            return order
+
+        self._fd.close()
+        rows = np.memmap(self._scratch, dtype=np.float32, mode='r', shape=(len(order), self.width))
+        tmp = os.path.join(self.out_path, 'features.tmp.npy')
+        X = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=rows.shape)
+        for start in range(0, len(order), self._buffer_rows):
+            X[start:start + self._buffer_rows] = rows[order[start:start + self._buffer_rows]]
+        X.flush()
+        del X, rows
+        os.remove(self._scratch)
+        os.replace(tmp, os.path.join(self.out_path, FEATURES_FILE))
+        _drop_stale(self.out_path, False)
+
+        np.save(os.path.join(self.out_path, SITES_FILE), sites[order])
+        np.save(os.path.join(self.out_path, INSTANCES_FILE), instances[order])
+        return order
+
+
+def committed_rows(path):
+    """
+    number of complete rows of a dataset being appended to (see DatasetAppender), None for other datasets
+    """
+    progress = os.path.join(path, PROGRESS_FILE)
+    if not os.path.exists(progress):
+        return None
+    with open(progress) as fd:
+        return json.load(fd)['rows']
+
+
+def load_dataset(path, mmap_mode='r'):
+    """
+    load the feature matrix and label arrays of a dataset
+    sparse matrices are loaded in CSR format
+    """
+    if os.path.isfile(os.path.join(path, SPARSE_FEATURES_FILE)):
+        X = scipy.sparse.load_npz(os.path.join(path, SPARSE_FEATURES_FILE)).tocsr()
+    else:
+        X = np.load(os.path.join(path, FEATURES_FILE), mmap_mode=mmap_mode)
+    sites = np.load(os.path.join(path, SITES_FILE))
+    instances = np.load(os.path.join(path, INSTANCES_FILE))
+    rows = committed_rows(path)
+    if rows is not None:
+        # rows past the progress marker are still being appended
+        X, sites, instances = X[:rows], sites[:rows], instances[:rows]
+    return X, sites, instances
+
+
+def _array_header(fd):
+    """
+    read the header of an open .npy file
+    returns its version, shape, dtype and the offset of the data
+    """
+    version = np.lib.format.read_magic(fd)
+    if version == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(fd)
+    else:
+        shape, _, dtype = np.lib.format.read_array_header_2_0(fd)
+    return version, shape, dtype, fd.tell()
+
+
+class DatasetAppender(object):
+    """
+    Append feature rows, in arrival order, to a dataset which can be read while it grows
+
+    Rows are written to the end of features.npy, sites.npy and instances.npy, whose headers are then
+    updated in place, and the number of complete rows is recorded in progress.json together with
+    the caller's state. Rows written after the last recorded count (by a process stopped mid-append)
+    are dropped on reopening. An existing dataset without progress.json is adopted as it is.
+    """
+    def __init__(self, out_path):
+        self.out_path = out_path
+        self.rows = 0
+        self.width = None
+        self.state = {}
+        progress = os.path.join(out_path, PROGRESS_FILE)
+        if os.path.exists(progress):
+            with open(progress) as fd:
+                progress = json.load(fd)
+            self.rows, self.width, self.state = progress['rows'], progress['width'], progress['state']
+        elif is_dataset(out_path):
+            X, sites, _ = load_dataset(out_path)
+            if scipy.sparse.issparse(X):
+                raise ValueError("rows cannot be appended to the sparse dataset in {}".format(out_path))
+            self.rows, self.width = len(sites), X.shape[1]
+        if self.width is not None:
+            for name in (FEATURES_FILE, SITES_FILE, INSTANCES_FILE):
+                self._resize(name, self.rows)
+
+    def labels(self):
+        """
+        site and instance arrays of the complete rows
+        """
+        if self.width is None:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        _, sites, instances = load_dataset(self.out_path)
+        return sites[:self.rows], instances[:self.rows]
+
+    def _resize(self, name, rows, data=b''):
+        """
+        append data after the first rows of an array and set its length in the header
+        """
+        with open(os.path.join(self.out_path, name), 'r+b') as fd:
+            version, shape, dtype, offset = _array_header(fd)
+            row_size = dtype.itemsize * int(np.prod(shape[1:]))
+            fd.seek(offset + self.rows * row_size)
+            fd.write(data)
+            fd.truncate(offset + rows * row_size)
+            fd.flush()
+            os.fsync(fd.fileno())
+            # numpy reserves room in the header for the first dimension to grow
+            fd.seek(0)
+            header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                      'shape': (rows,) + tuple(shape[1:])}
+            if version == (1, 0):
+                np.lib.format.write_array_header_1_0(fd, header)
+            else:
+                np.lib.format.write_array_header_2_0(fd, header)
+            if fd.tell() != offset:
+                raise ValueError("the header of {} cannot be updated in place".format(name))
+
+    def append(self, features, sites, instances, state=None):
+        """
+        append rows of features with their labels, then record the new row count and state
+        """
+        features = np.asarray(features, dtype=np.float32)
+        if self.width is None:
+            self.width = features.shape[1]
+            np.save(os.path.join(self.out_path, FEATURES_FILE), np.empty((0, self.width), dtype=np.float32))
+            np.save(os.path.join(self.out_path, SITES_FILE), np.empty(0, dtype=np.int32))
+            np.save(os.path.join(self.out_path, INSTANCES_FILE), np.empty(0, dtype=np.int32))
+        elif features.shape[1] != self.width:
+            raise ValueError("rows have {} features, expected {}".format(features.shape[1], self.width))
+        rows = self.rows + len(features)
+        self._resize(FEATURES_FILE, rows, features.tobytes())
+        self._resize(SITES_FILE, rows, np.asarray(sites, dtype=np.int32).tobytes())
+        self._resize(INSTANCES_FILE, rows, np.asarray(instances, dtype=np.int32).tobytes())
+        self.rows = rows
+        if state is not None:
+            self.state = state
+
+        tmp = os.path.join(self.out_path, PROGRESS_FILE + '.tmp')
+        with open(tmp, 'w') as fd:
+            json.dump({'rows': self.rows, 'width': self.width, 'state': self.state}, fd)
+        os.replace(tmp, os.path.join(self.out_path, PROGRESS_FILE))
+
+
+def merge_datasets(paths, out_path, buffer_rows=1024):
+    """
+    combine datasets of disjoint sets of traces (e.g. extraction shards) into one dataset at out_path,
+    with rows ordered by (site, instance) as if all traces had been extracted together
+    directories without a dataset (shards which got no traces) are skipped
+    returns the number of rows
+    """
+    parts = [load_dataset(path) for path in paths if is_dataset(path)]
+    if not parts:
+        return 0
+    width = parts[0][0].shape[1]
+    for X, _, _ in parts:
+        if X.shape[1] != width:
+            raise ValueError("datasets have {} and {} features".format(width, X.shape[1]))
+
+    sites = np.concatenate([part[1] for part in parts])
+    instances = np.concatenate([part[2] for part in parts])
+    order = np.lexsort((instances, sites))
+    duplicate = (sites[order][1:] == sites[order][:-1]) & (instances[order][1:] == instances[order][:-1])
+    if duplicate.any():
+        first = order[np.flatnonzero(duplicate)[0]]
+        raise ValueError("trace {}-{} is in more than one dataset".format(sites[first], instances[first]))
+    if any(scipy.sparse.issparse(part[0]) for part in parts):
+        merged = scipy.sparse.vstack([scipy.sparse.csr_matrix(part[0]) for part in parts], format='csr')
+        _save_sparse(out_path, merged[order])
+        np.save(os.path.join(out_path, SITES_FILE), sites[order])
+        np.save(os.path.join(out_path, INSTANCES_FILE), instances[order])
+        return len(order)
+
+    # dataset and row within it of every concatenated row
+    lengths = [len(part[1]) for part in parts]
+    part_of = np.repeat(np.arange(len(parts)), lengths)
+    row_of = np.concatenate([np.arange(length) for length in lengths])
+
+    tmp = os.path.join(out_path, 'features.tmp.npy')
+    merged = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(len(order), width))
+    for start in range(0, len(order), buffer_rows):
+        chunk = order[start:start + buffer_rows]
+        for i, (X, _, _) in enumerate(parts):
+            sel = np.flatnonzero(part_of[chunk] == i)
+            if len(sel):
+                merged[start + sel] = X[row_of[chunk[sel]]]
+    merged.flush()
+    del merged, parts
+    os.replace(tmp, os.path.join(out_path, FEATURES_FILE))
+    _drop_stale(out_path, False)
+
+    np.save(os.path.join(out_path, SITES_FILE), sites[order])
+    np.save(os.path.join(out_path, INSTANCES_FILE), instances[order])
+    return len(order)
@@ -0,0 +1,220 @@
+# in-memory defense simulation between trace loading and feature extraction
+# util.DEFENSES lists (name, {parameter: value}) steps applied in order to every trace after normalization:
+#   constant_rate  -- BuFLO-style constant-rate padding: each direction sends one packet every interval
+#                     seconds from the start of the trace until its real packets are sent and at least
+#                     min_duration seconds have passed; real packets take the next free slot
+#   dummy          -- dummy packets injected at rate_out / rate_in packets per second over the trace
+#   jitter         -- every packet delayed by an exponential delay of mean scale seconds
+#   burst_molding  -- every burst (run of packets in one direction) padded to a multiple of quantum packets
+# the steps work on ragged batches of traces (see batch.py) with numpy segment operations.
+# their random draws are hashes of (DEFENSE_SEED, step, trace label, draw index), so a trace is defended
+# the same way whichever batch, worker or run it is processed in.
+# further defenses can be registered in DEFENSES: a step takes a batch.Batch, its Draws and its parameters
+# and returns the defended batch
+import numpy as np
+
+import util
+import batch
+
+
+def _mix(x):
+    # splitmix64 finalizer
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def trace_key(site, instance):
+    """
+    integer key of a (site, instance) trace label for the random draws
+    """
+    return (int(site) << 32) + int(instance)
+
+
+class Draws(object):
+    """
+    Reproducible random draws of one defense step for the traces of a batch
+    """
+    def __init__(self, seed, step, keys):
+        with np.errstate(over='ignore'):
+            self.base = _mix(np.uint64(seed & 0xffffffff) << np.uint64(32) | np.uint64(step))
+        self.keys = np.asarray(keys, dtype=np.uint64)
+
+    def uniform(self, stream, ids, counters):
+        """
+        uniform draws in [0, 1), one per (trace index, counter) pair of the given stream
+        """
+        with np.errstate(over='ignore'):
+            x = _mix(self.base ^ np.uint64(stream))
+            x = _mix(x ^ self.keys[np.asarray(ids, dtype=np.int64)])
+            x = _mix(x ^ np.asarray(counters).astype(np.uint64))
+        return (x >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+def _rebuild(ids, times, sizes, n_traces, ties=None):
+    """
+    batch of the packets given by trace index, time and size, sorted by time within every trace
+    (packets at the same time keep their given order, or the order of ties)
+    """
+    keys = (np.arange(len(ids)), times, ids) if ties is None else (np.arange(len(ids)), ties, times, ids)
+    order = np.lexsort(keys)
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(ids, minlength=n_traces))))
+    return batch.Batch(times[order], sizes[order], offsets)
+
+
+def _starts(data):
+    """
+    time of the first packet of every (non-empty) trace
+    """
+    return data.times[np.minimum(data.offsets[:-1], max(len(data.times) - 1, 0))]
+
+
+def _ends(data):
+    """
+    time of the last packet of every (non-empty) trace
+    """
+    return data.times[np.maximum(data.offsets[1:] - 1, 0)]
+
+
+def _packet_size(data, size):
+    """
+    size of the padding packets of every trace: size, or the trace's largest packet if None
+    """
+    if size is not None:
+        return np.full(len(data), size)
+    largest = np.zeros(len(data), dtype=np.abs(data.sizes).dtype)
+    np.maximum.at(largest, data.ids, np.abs(data.sizes))
+    return largest
+
+
+def constant_rate(data, draws, interval=0.01, interval_out=None, interval_in=None, min_duration=0.0, size=None):
+    """
+    BuFLO-style constant-rate padding; interval_out and interval_in default to interval
+    """
+    n = len(data)
+    intervals = np.array([interval if interval_out is None else interval_out,
+                          interval if interval_in is None else interval_in], dtype=np.float64)
+    # one sending schedule per (trace, direction) group, outgoing first
+    incoming = (~data.outgoing).astype(np.int64)
+    groups = data.ids * 2 + incoming
+    order = np.lexsort((data.times, groups))
+    groups = groups[order]
+    group_counts = np.bincount(groups, minlength=2 * n)
+    group_starts = np.cumsum(group_counts) - group_counts
+    rank = np.arange(len(groups)) - group_starts[groups]
+
+    # the k-th real packet of a group takes slot max(earliest slot of the packet, slot of packet k-1 + 1),
+    # i.e. k + the running maximum of (earliest slot - rank) within the group
+    start = _starts(data)
+    step = intervals[groups % 2]
+    earliest = np.ceil((data.times[order] - start[groups // 2]) / step - 1e-9).astype(np.int64)
+    value = earliest - rank
+    if len(value):
+        shift = value.max() - value.min() + 1
+        # offset every group above the previous ones, so that the running maximum restarts per group
+        slot = np.maximum.accumulate(value + groups * shift) - groups * shift + rank
+    else:
+        slot = value
+    slots = np.zeros(2 * n, dtype=np.int64)
+    np.maximum.at(slots, groups, slot + 1)
+    slots = np.maximum(slots, np.ceil(min_duration / intervals - 1e-9).astype(np.int64)[np.arange(2 * n) % 2])
+
+    # every slot of every group carries one padded packet
+    out_groups = np.repeat(np.arange(2 * n), slots)
+    out_rank = np.arange(len(out_groups)) - np.repeat(np.cumsum(slots) - slots, slots)
+    ids = out_groups // 2
+    times = start[ids] + out_rank * intervals[out_groups % 2]
+    sizes = np.where(out_groups % 2 == 0, 1, -1) * _packet_size(data, size)[ids]
+    return _rebuild(ids, times, sizes, n, ties=out_groups % 2)
+
+
+def dummy(data, draws, rate_out=0.0, rate_in=0.0, size=None):
+    """
+    inject dummy packets at rate_out / rate_in packets per second, spread uniformly over the trace
+    the number of dummies of a trace is rate * duration, rounded up or down at random
+    """
+    n = len(data)
+    start, duration = _starts(data), _ends(data) - _starts(data)
+    padding = _packet_size(data, size)
+    ids, times, sizes = [data.ids], [data.times], [data.sizes]
+    for stream, (rate, sign) in enumerate(((rate_out, 1), (rate_in, -1))):
+        if rate <= 0:
+            continue
+        expected = rate * duration
+        counts = np.floor(expected + draws.uniform(2 * stream, np.arange(n), np.zeros(n))).astype(np.int64)
+        dummy_ids = np.repeat(np.arange(n), counts)
+        index = np.arange(len(dummy_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+        u = draws.uniform(2 * stream + 1, dummy_ids, index)
+        ids.append(dummy_ids)
+        times.append(start[dummy_ids] + u * duration[dummy_ids])
+        sizes.append(sign * padding[dummy_ids])
+    return _rebuild(np.concatenate(ids), np.concatenate(times),
+                    np.concatenate(sizes).astype(np.result_type(*sizes)), n)
+
+
+def jitter(data, draws, scale=0.001):
+    """
+    delay every packet by an exponentially distributed time of mean scale seconds
+    """
+    u = draws.uniform(0, data.ids, data.ranks)
+    return _rebuild(data.ids, data.times - scale * np.log1p(-u), data.sizes, len(data))
+
+
+def burst_molding(data, draws, quantum=4, size=None):
+    """
+    pad every burst to a multiple of quantum packets with copies of its last packet (sized size if given)
+    """
+    direction = np.sign(data.sizes)
+    last = np.ones(len(direction), dtype=bool)
+    # a burst ends where the next packet belongs to another trace or goes the other way
+    last[:-1] = (data.ids[1:] != data.ids[:-1]) | (direction[1:] != direction[:-1])
+    ends = np.flatnonzero(last)
+    lengths = np.diff(np.concatenate(([-1], ends)))
+    reps = np.ones(len(direction), dtype=np.int64)
+    reps[ends] += -lengths % quantum
+    times = np.repeat(data.times, reps)
+    sizes = np.repeat(data.sizes, reps)
+    if size is not None:
+        # the copies follow the last packet of their burst
+        copies = np.ones(len(times), dtype=bool)
+        copies[np.cumsum(reps) - reps] = False
+        sizes[copies] = np.sign(sizes[copies]) * size
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(data.ids, weights=reps, minlength=len(data)).astype(np.int64))))
+    return batch.Batch(times, sizes, offsets)
+
+
+DEFENSES = {
+    'constant_rate': constant_rate,
+    'dummy': dummy,
+    'jitter': jitter,
+    'burst_molding': burst_molding,
+}
+
+
+def defend(times, sizes, offsets, keys, steps=None, seed=None):
+    """
+    apply defense steps (util.DEFENSES if None) to a batch of traces, trace i spanning
+    [offsets[i], offsets[i + 1]) of times and sizes and drawing its randomness from keys[i] (see trace_key)
+    seed is util.DEFENSE_SEED if None
+    returns the times, sizes and offsets of the defended traces
+    """
+    if steps is None:
+        steps = util.DEFENSES
+    if seed is None:
+        seed = util.DEFENSE_SEED
+    data = batch.Batch(times, sizes, offsets)
+    for step, (name, params) in enumerate(steps):
+        if name not in DEFENSES:
+            raise ValueError("unknown defense {}, expected one of {}".format(name, ', '.join(sorted(DEFENSES))))
+        data = DEFENSES[name](data, Draws(seed, step, keys), **params)
+    return data.times, data.sizes, data.offsets
+
+
+def defend_trace(times, sizes, label, steps=None, seed=None):
+    """
+    apply defense steps to one trace with a (site, instance) label
+    returns the defended times and sizes as lists
+    """
+    times, sizes, _ = defend(np.asarray(times, dtype=np.float64), np.asarray(sizes), [0, len(times)],
+                             [trace_key(*label)], steps, seed)
+    return times.tolist(), sizes.tolist()
@@ -3,128 +3,196 @@
 from __future__ import division
 import os
 import argparse
+import heapq
+import signal
 import sys
-import itertools
 import json
+import threading
+import time
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from multiprocessing import Pool
-from collections import OrderedDict
-import re
+from collections import OrderedDict, deque
+import numpy as np
 
 import util
+import batch
+import block_cache
+import catalog
+import dataset
+import defenses
+import filters
+import manifest
+import profiler
+import trace_store
+from traces import ArchiveMember, bounded, enumerate_files, is_archive, iter_archive, parse_name, read_member, read_trace
 from features import *
-from util import FEATURE_EXT, NORMALIZE_TRAFFIC, PACKET_NUMBER, PKT_TIME, UNIQUE_PACKET_LENGTH, \
-    PACKET_DISTRIBUTION, BURSTS, FIRST20, CUMUL, INTERVAL_KNN, TRAFFIC_STATS, featureCount, howlong, \
-    KFINGERPRINT, KNN_ATTACK, CUMUL_ATTACK, DF_ATTACK, TIKTOK_TIMING_ONLY, TIKTOK_DIRECTION_TIMING, DFTOK_ATTACK, RF_ATTACK
+from features import derived
+from util import FEATURE_EXT, NORMALIZE_TRAFFIC
 
+# maximum number of traces handed to the pool ahead of the results being consumed
+MAX_PENDING = 1024
+# maximum number of traces a worker extracts per task
+BATCH_SIZE = 256
+# tasks per worker the estimated work is split into, so that the last tasks are short
+CHUNKS_PER_WORKER = 4
+# pipelined mode: reader threads, and trace files read into the page cache ahead of the workers
+READERS = 4
+READ_AHEAD = 1024
+# watch mode: seconds between polls of the trace directory, seconds a trace file must have been left
+# unmodified before it is read (so that traces still being written are not taken),
+# and maximum number of traces extracted per appended batch
+WATCH_INTERVAL = 2.0
+SETTLE_TIME = 1.0
+WATCH_BATCH = 32
+WATCH_CATALOG = 'catalog.db'
 
-def enumerate_files(dir, splitter='-', extension=''):
-    """
-    recursively enumerate files in a directory root
-    """
-    file_list = []
-    for dirname, dirnames, filenames in os.walk(dir):
-        # filter out invalid file names
-        filenames = [filename for filename in filenames
-                     if re.fullmatch('\\d+{}\\d+{}'.format(splitter, extension), filename)]
-        for filename in filenames:
-            file_list.append(os.path.join(dirname, filename))
-    return file_list
 
+def _interval_knn(times, sizes, features):
+    Interval.IntervalFeature(times, sizes, features, 'KNN')
 
-def extract(times, sizes, debug_path="./", store_feature_pos=False):
-    """
-    extract features from a parsed website trace
-    """
-    feature_pos = OrderedDict()
-    features = []
 
-    # Transmission size features
-    if PACKET_NUMBER:
-        PktNum.PacketNumFeature(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['PACKET_NUMBER'] = len(features)
+def _cumul(times, sizes, features):
+    features.extend(Cumul.CumulFeatures(sizes, util.featureCount))
 
-    # inter packet time + transmission time feature
-    if PKT_TIME:
-        Time.TimeFeature(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['PKT_TIME'] = len(features)
 
-    # Unique packet lengths
-    if UNIQUE_PACKET_LENGTH:
-        PktLen.PktLenFeature(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['UNIQUE_PACKET_LENGTH'] = len(features)
+def _traffic_stats(times, sizes, features):
+    features.extend(TrafficStats.TrafficStatsFeatures(times, sizes))
 
-    if INTERVAL_KNN:
-        Interval.IntervalFeature(times, sizes, features, 'KNN')
-        if store_feature_pos:
-            feature_pos['INTERVAL_KNN'] = len(features)
 
-    # Packet distributions
-    if PACKET_DISTRIBUTION:
-        PktDistribution.PktDistFeature(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['PKT_DISTRIBUTION'] = len(features)
+def _ngram(times, sizes, features):
+    Ngram.NgramFeature(times, sizes, features, util.NGRAM)
 
-    # Bursts (knn)
-    if BURSTS:
-        Burst.BurstFeature(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['BURST'] = len(features)
 
-    # first 20 packets (knn)
-    if FIRST20:
-        HeadTail.First20(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['FIRST20'] = len(features)
+def _kfingerprint(times, sizes, features):
+    KFingerprint.KFingerprintFeature(times, sizes, features, util.howlong)
 
-    # CUMUL features
-    if CUMUL:
-        features.extend(Cumul.CumulFeatures(sizes, featureCount))
-        if store_feature_pos:
-            feature_pos['CUMUL'] = len(features)
 
+# feature blocks in output order:
+# (feature position name, util.py flag, extraction function, util.py parameters used by the block)
+FEATURE_BLOCKS = [
+    # Transmission size features
+    ('PACKET_NUMBER', 'PACKET_NUMBER', PktNum.PacketNumFeature, ()),
+    # inter packet time + transmission time feature
+    ('PKT_TIME', 'PKT_TIME', Time.TimeFeature, ()),
+    # Unique packet lengths
+    ('UNIQUE_PACKET_LENGTH', 'UNIQUE_PACKET_LENGTH', PktLen.PktLenFeature, ()),
+    ('INTERVAL_KNN', 'INTERVAL_KNN', _interval_knn, ()),
+    # Packet distributions
+    ('PKT_DISTRIBUTION', 'PACKET_DISTRIBUTION', PktDistribution.PktDistFeature, ()),
+    # Bursts (knn)
+    ('BURST', 'BURSTS', Burst.BurstFeature, ()),
+    # first 20 packets (knn)
+    ('FIRST20', 'FIRST20', HeadTail.First20, ()),
+    # CUMUL features
+    ('CUMUL', 'CUMUL', _cumul, ('featureCount',)),
     # Traffic stats + packet length bins (traff_stats + pkt_len)
-    if TRAFFIC_STATS:
-        features.extend(TrafficStats.TrafficStatsFeatures(times, sizes))
-        if store_feature_pos:
-            feature_pos['TRAFFIC_STATS'] = len(features)
+    ('TRAFFIC_STATS', 'TRAFFIC_STATS', _traffic_stats, ()),
+    # n-gram counts of the direction sequence
+    ('NGRAM', 'NGRAM_ENABLE', _ngram, ('NGRAM',)),
 
     # --- Attack-specific feature blocks (table order: run outputs these only) ---
-    if KFINGERPRINT:
-        KFingerprint.KFingerprintFeature(times, sizes, features, howlong)
-        if store_feature_pos:
-            feature_pos['KFINGERPRINT'] = len(features)
-    if KNN_ATTACK:
-        KNN.KNNFeature(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['KNN_ATTACK'] = len(features)
-    if CUMUL_ATTACK:
-        features.extend(Cumul.CumulFeatures(sizes, featureCount))
-        if store_feature_pos:
-            feature_pos['CUMUL_ATTACK'] = len(features)
-    if DF_ATTACK:
-        DF.DFFeature(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['DF_ATTACK'] = len(features)
-    if TIKTOK_TIMING_ONLY:
-        TikTokTimingOnly.TikTokTimingOnlyFeature(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['TIKTOK_TIMING_ONLY'] = len(features)
-    if TIKTOK_DIRECTION_TIMING:
-        TikTokDirectionTiming.TikTokDirectionTimingFeature(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['TIKTOK_DIRECTION_TIMING'] = len(features)
-    if DFTOK_ATTACK:
-        DFTok.DFTokFeature(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['DFTOK_ATTACK'] = len(features)
-    if RF_ATTACK:
-        RF.RFFeature(times, sizes, features)
-        if store_feature_pos:
-            feature_pos['RF_ATTACK'] = len(features)
+    ('KFINGERPRINT', 'KFINGERPRINT', _kfingerprint, ('howlong',)),
+    ('KNN_ATTACK', 'KNN_ATTACK', KNN.KNNFeature, ()),
+    ('CUMUL_ATTACK', 'CUMUL_ATTACK', _cumul, ('featureCount',)),
+    ('DF_ATTACK', 'DF_ATTACK', DF.DFFeature, ()),
+    ('TIKTOK_TIMING_ONLY', 'TIKTOK_TIMING_ONLY', TikTokTimingOnly.TikTokTimingOnlyFeature, ()),
+    ('TIKTOK_DIRECTION_TIMING', 'TIKTOK_DIRECTION_TIMING', TikTokDirectionTiming.TikTokDirectionTimingFeature, ()),
+    ('DFTOK_ATTACK', 'DFTOK_ATTACK', DFTok.DFTokFeature, ()),
+    ('RF_ATTACK', 'RF_ATTACK', RF.RFFeature, ()),
+]
+
+
+def enabled_blocks():
+    """
+    names of the feature blocks turned on in util.py, in output order
+    """
+    return [name for name, flag, _, _ in FEATURE_BLOCKS if getattr(util, flag)]
+
+
+def block_params(name):
+    """
+    util.py settings which determine the values of a feature block
+    """
+    for block, _, _, params in FEATURE_BLOCKS:
+        if block == name:
+            params = dict((param, getattr(util, param)) for param in params)
+            params['NORMALIZE_TRAFFIC'] = util.NORMALIZE_TRAFFIC
+            if util.DEFENSES:
+                params['DEFENSES'] = util.DEFENSES
+                params['DEFENSE_SEED'] = util.DEFENSE_SEED
+            return params
+    raise KeyError(name)
+
+
+def extract_blocks(times, sizes, blocks=None, trace=None):
+    """
+    extract the given feature blocks (all enabled blocks if None) from a parsed website trace
+    the blocks share the derived quantities of trace (see features/derived.py), derived afresh if None
+    returns an ordered mapping of block name to its feature list
+    """
+    if blocks is None:
+        blocks = enabled_blocks()
+    if trace is None:
+        trace = derived.Trace(times, sizes)
+    block_features = OrderedDict()
+    with derived.shared(trace):
+        for name, _, handler, _ in FEATURE_BLOCKS:
+            if name in blocks:
+                block_features[name] = []
+                with profiler.timed(name, len(times)):
+                    handler(times, sizes, block_features[name])
+    return block_features
+
+
+def prefix_lengths(times, cutoffs, unit='time'):
+    """
+    packet counts of the trace prefixes ending at each cutoff
+    a time cutoff keeps the leading packets sent up to that time (in seconds), a packet cutoff that many packets
+    """
+    if unit == 'packets':
+        return [min(int(cutoff), len(times)) for cutoff in cutoffs]
+    if unit != 'time':
+        raise ValueError("unknown prefix unit: {}".format(unit))
+    # first packet beyond each cutoff
+    late = np.asarray(times) > np.asarray(cutoffs, dtype=np.float64)[:, None]
+    return [int(np.argmax(row)) if row.any() else len(times) for row in late]
+
+
+def extract_prefixes(times, sizes, cutoffs, unit='time', blocks=None):
+    """
+    extract the given feature blocks (all enabled blocks if None) from the prefixes of a parsed website trace
+    ending at each cutoff (see prefix_lengths)
+    the prefixes share the cumulative quantities of the whole trace (see features/derived.py)
+    returns one ordered mapping of block name to its feature list per cutoff,
+    or None for prefixes the feature blocks cannot handle (e.g. empty ones)
+    """
+    whole = derived.Trace(times, sizes)
+    results = []
+    for k in prefix_lengths(times, cutoffs, unit):
+        prefix = whole.prefix(k, times[:k], sizes[:k])
+        try:
+            results.append(extract_blocks(prefix.source[0], prefix.source[1], blocks, trace=prefix))
+        except (ValueError, IndexError, ZeroDivisionError):
+            results.append(None)
+    return results
+
+
+def extract(times, sizes, debug_path="./", store_feature_pos=False, prefixes=None, unit='time'):
+    """
+    extract features from a parsed website trace
+    if prefixes lists time (or packet, see prefix_lengths) cutoffs, returns the features of the trace prefix
+    ending at each cutoff instead, None for prefixes which cannot be extracted
+    """
+    if prefixes is not None:
+        return [None if blocks is None else [x for block in blocks.values() for x in block]
+                for blocks in extract_prefixes(times, sizes, prefixes, unit)]
+    feature_pos = OrderedDict()
+    features = []
+    for name, block in extract_blocks(times, sizes).items():
+        features.extend(block)
+        feature_pos[name] = len(features)
 
     if store_feature_pos:
         # output FeaturePos
@@ -134,58 +202,848 @@ def extract(times, sizes, debug_path="./", store_feature_pos=False):
     return features
 
 
-def task_handler(args):
+def extract_batch(times, sizes, offsets, blocks=None, out=None):
     """
-    handle feature extraction for each trace instance assigned to batch
+    extract the given feature blocks (all enabled blocks if None) from a batch of traces
+    given as concatenated times and sizes plus offsets (see batch.py)
+    returns the (batch, features) matrix, written into out if given, and the feature positions
     """
-    filepath, out_path = args
+    if blocks is None:
+        blocks = enabled_blocks()
+    data = batch.Batch(times, sizes, offsets)
+    names = [name for name, _, _, _ in FEATURE_BLOCKS if name in blocks]
+    handlers = dict((name, handler) for name, _, handler, _ in FEATURE_BLOCKS)
+    parts = [batch.BATCH_BLOCKS.get(name, [batch.per_trace(handlers[name])]) for name in names]
+
+    # parts without a batch kernel run trace by trace, all of them on one trace before the next
+    # so that they share its derived quantities (see features/derived.py)
+    rows = dict((id(part), []) for block in parts for part in block if isinstance(part, batch.per_trace))
+    # with the profiler on, time spent on every block per trace; batch kernels are split by packet count
+    elapsed = dict((name, np.zeros(len(data))) for name in names) if profiler.enabled else None
+    if rows:
+        for i, (trace_times, trace_sizes) in enumerate(data.traces()):
+            with derived.shared(derived.Trace(trace_times, trace_sizes)):
+                for name, block in zip(names, parts):
+                    for part in block:
+                        if isinstance(part, batch.per_trace):
+                            features = []
+                            start = time.perf_counter()
+                            part.block(trace_times, trace_sizes, features)
+                            if elapsed is not None:
+                                elapsed[name][i] += time.perf_counter() - start
+                            rows[id(part)].append(features)
+    columns = []
+    for name, block in zip(names, parts):
+        for part in block:
+            if isinstance(part, batch.per_trace) and len(set(len(row) for row in rows[id(part)])) > 1:
+                raise ValueError("feature block {} has a different width for some traces of the batch".format(name))
+        block_columns = []
+        for part in block:
+            if isinstance(part, batch.per_trace):
+                block_columns.append(np.array(rows[id(part)], dtype=np.float64).reshape(len(data), -1))
+                continue
+            start = time.perf_counter()
+            block_columns.append(part(data))
+            if elapsed is not None:
+                elapsed[name] += (time.perf_counter() - start) * data.lengths / max(data.lengths.sum(), 1)
+        columns.append(block_columns)
+    if elapsed is not None:
+        for name in names:
+            profiler.record(name, elapsed[name], data.lengths)
+
+    feature_pos = OrderedDict()
+    width = 0
+    for name, block in zip(names, columns):
+        width += sum(part.shape[1] for part in block)
+        feature_pos[name] = width
+    if out is None:
+        out = np.empty((len(data), width))
+    start = 0
+    for block in columns:
+        for part in block:
+            out[:, start:start + part.shape[1]] = part
+            start += part.shape[1]
+    return out, feature_pos
 
+
+def trace_name(source):
+    """
+    file name of a trace
+    source is a trace file path, a (store path, trace index) pair or an archive member
+    """
+    if isinstance(source, ArchiveMember):
+        return source.name
+    if isinstance(source, tuple):
+        return str(trace_store.open_store(source[0]).names[source[1]])
+    return os.path.basename(source)
+
+
+def load_trace(source):
+    """
+    load the name, times and sizes of a trace
+    """
+    if isinstance(source, ArchiveMember):
+        times, sizes = read_member(source)
+    elif isinstance(source, tuple):
+        times, sizes = trace_store.open_store(source[0])[source[1]]
+        # the feature blocks work on python numbers (int16 sizes would overflow in sums)
+        times, sizes = times.tolist(), sizes.tolist()
+    else:
+        times, sizes = read_trace(source)
+    return trace_name(source), times, sizes
+
+
+def prepare_trace(source, defend=True):
+    """
+    load a trace and apply the configured normalization and, if defend is set, defenses (see defenses.py)
+    returns the trace name, times and sizes, or None if the trace could not be read
+    """
     # load trace file
-    times = []
-    sizes = []
-    with open(filepath, "r") as f:
-        try:
-            for x in f:
-                x = x.split("\t")
-                times.append(float(x[0]))
-                sizes.append(int(x[1]))
-        except KeyboardInterrupt:
-            sys.exit(-1)
-        except:
-            return
+    start = time.perf_counter()
+    try:
+        name, times, sizes = load_trace(source)
+    except KeyboardInterrupt:
+        sys.exit(-1)
+    except:
+        return None
+    # drop empty and too short traces (see filters.py)
+    if filters.short_traces(len(times)):
+        return None
 
     # whether normalize traffic
     if NORMALIZE_TRAFFIC == 1:
         times, sizes = util.normalize_traffic(times, sizes)
+    profiler.record('parse', time.perf_counter() - start, len(times))
+
+    # simulate the configured defenses on the trace
+    if defend and util.DEFENSES:
+        with profiler.timed('defense', len(times)):
+            times, sizes = defenses.defend_trace(times, sizes, parse_name(name))
+    return name, times, sizes
+
+
+def compute_features(source, out_path, store_feature_pos=False):
+    """
+    load a trace and extract its features
+    returns the trace name and feature list, or None if the trace could not be read
+    """
+    trace = prepare_trace(source)
+    if trace is None:
+        return None
+    name, times, sizes = trace
 
-    # extract features (saving feature positions only for the first trace)
     features = extract(times, sizes,
                        debug_path=out_path,
-                       store_feature_pos=os.path.basename(filepath) == '0-0')
+                       store_feature_pos=store_feature_pos)
+    return name, features
+
+
+def task_handler(args):
+    """
+    handle feature extraction for each trace instance assigned to batch
+    returns the manifest entry of the trace, or None if it could not be read
+    """
+    source, out_path, store_feature_pos, entry = args
+    result = compute_features(source, out_path, store_feature_pos)
+    if result is None:
+        return None
+    name, features = result
 
     # save features to file
-    dest = os.path.join(out_path, os.path.basename(filepath) + FEATURE_EXT)
-    with open(dest, "w") as fout:
-        for x in features:
-            if isinstance(x, str):
-                if '\n' in x:
-                    fout.write(x)
-                else:
-                    fout.write(x + " ")
+    dest = os.path.join(out_path, name + FEATURE_EXT)
+    with profiler.timed('write'):
+        with open(dest, "w") as fout:
+            fout.write(format_features(features))
+    return entry
+
+
+def format_features(features):
+    """
+    text of a feature file
+    """
+    parts = []
+    for x in features:
+        if isinstance(x, str):
+            if '\n' in x:
+                parts.append(x)
             else:
-                fout.write(repr(x) + " ")
+                parts.append(x + " ")
+        else:
+            # str() rather than repr(): numpy>=2 scalars repr as 'np.float64(...)'
+            parts.append(str(x) + " ")
+    return ''.join(parts)
 
 
-def main(trace_path, out_path):
+def compute_handler(chunk):
     """
-    start batches to handle feature extraction
+    pipelined mode: load and extract the features of a chunk of traces, leaving the writing to the writer stage
+    returns the (manifest entry, trace name, feature file text) of every trace, None for traces which could not be read
+    """
+    results = []
+    for source, out_path, store_feature_pos, entry in chunk:
+        result = compute_features(source, out_path, store_feature_pos)
+        results.append(None if result is None else (entry, result[0], format_features(result[1])))
+    return results
+
+
+def prefix_handler(args):
+    """
+    handle extraction of the prefixes of a trace (see extract_prefixes)
+    returns the trace's label and a {block: float32 row} mapping per cutoff (None for prefixes which cannot
+    be extracted), or None in place of the list if the trace could not be read
+    """
+    source, cutoffs, unit, label = args
+    trace = prepare_trace(source)
+    if trace is None:
+        return label, None
+    name, times, sizes = trace
+    return label, [None if blocks is None else
+                   dict((block, np.asarray(features, dtype=np.float32)) for block, features in blocks.items())
+                   for blocks in extract_prefixes(times, sizes, cutoffs, unit)]
+
+
+def batch_handler(chunk):
+    """
+    handle extraction of the requested feature blocks of a chunk of traces
+    traces needing the same blocks are extracted together as one batch (see extract_batch)
+    returns, per (source, blocks, meta) item of the chunk, the trace's bookkeeping tuple meta and a
+    float32 feature row per requested block, or None in place of the rows if the trace could not be read
+    """
+    results = [None] * len(chunk)
+    groups = OrderedDict()
+    for i, (source, blocks, meta) in enumerate(chunk):
+        if not blocks:
+            results[i] = meta, {}
+            continue
+        # defenses are simulated on the whole batch below
+        trace = prepare_trace(source, defend=False)
+        if trace is None:
+            results[i] = meta, None
+            continue
+        groups.setdefault(tuple(blocks), []).append((i, trace[1], trace[2], parse_name(trace[0])))
+
+    for blocks, traces in groups.items():
+        offsets = np.cumsum([0] + [len(trace[1]) for trace in traces])
+        times = np.concatenate([trace[1] for trace in traces])
+        sizes = np.concatenate([trace[2] for trace in traces])
+        if util.DEFENSES:
+            start = time.perf_counter()
+            lengths = np.diff(offsets)
+            times, sizes, offsets = defenses.defend(times, sizes, offsets,
+                                                    [defenses.trace_key(*trace[3]) for trace in traces])
+            # the batch time is split over its traces by packet count
+            profiler.record('defense', (time.perf_counter() - start) * lengths / max(lengths.sum(), 1), lengths)
+        matrix, feature_pos = extract_batch(times, sizes, offsets, blocks)
+        matrix = matrix.astype(np.float32)
+        bounds = [0] + list(feature_pos.values())
+        for row, (i, _, _, _) in enumerate(traces):
+            results[i] = chunk[i][2], dict((block, matrix[row, start:end])
+                                           for block, start, end in zip(feature_pos, bounds, bounds[1:]))
+    return results
+
+
+def weighted_chunks(tasks, budget=None, limit=BATCH_SIZE):
+    """
+    group (task, cost) pairs into lists of tasks costing about budget in total (unbounded if None),
+    with at most limit tasks each
+    """
+    chunk, cost = [], 0
+    for task, task_cost in tasks:
+        chunk.append(task)
+        cost += task_cost
+        if len(chunk) == limit or (budget is not None and cost >= budget):
+            yield chunk
+            chunk, cost = [], 0
+    if chunk:
+        yield chunk
+
+
+def files_handler(chunk):
+    """
+    handle feature extraction of a chunk of traces into feature files (see task_handler)
     """
-    file_list = enumerate_files(trace_path, extension='.cell')
+    return [task_handler(task) for task in chunk]
 
-    # start BATCH_NUM processes for computation
-    pool = Pool()
-    for _ in tqdm(pool.imap(task_handler, zip(file_list, itertools.repeat(out_path))), total=len(file_list)):
+
+def list_traces(trace_path):
+    """
+    list the traces to process, ordered by (site, instance)
+    """
+    if trace_store.is_store(trace_path):
+        # packed trace store: workers slice traces out of the memory-mapped store
+        store = trace_store.open_store(trace_path)
+        return [(trace_path, i) for i in range(len(store))]
+    return sorted(enumerate_files(trace_path, extension='.cell'), key=parse_name)
+
+
+def collect_sources(trace_path, catalog_path=None, content_hash=False):
+    """
+    gather the traces to process together with their manifest entries (see manifest.py)
+    returns a list of (source, entry) pairs, or a generator of them for tar archives,
+    whose members are streamed in archive order
+    """
+    if is_archive(trace_path):
+        return ((member, manifest.trace_entry(member, content_hash))
+                for member in iter_archive(trace_path, extension='.cell'))
+    if catalog_path is not None:
+        trace_catalog = catalog.open_catalog(catalog_path, trace_path, extension='.cell')
+        catalogued = trace_catalog.query()
+        trace_catalog.close()
+        return [(record.path, manifest.trace_entry(record.path, content_hash, stat=(record.file_size, record.mtime)))
+                for record in catalogued]
+    return [(source, manifest.trace_entry(source, content_hash)) for source in list_traces(trace_path)]
+
+
+def trace_length(source):
+    """
+    packet count of a trace, 0 if it could not be read
+    """
+    try:
+        return len(load_trace(source)[1])
+    except KeyboardInterrupt:
+        sys.exit(-1)
+    except:
+        return 0
+
+
+def packet_counts(pool, sources, trace_path, catalog_path=None):
+    """
+    packet counts of a list of (source, entry) pairs, taken from the trace store or catalog when there is one
+    otherwise the traces are only read for them when outlier removal needs them (see filters.py)
+    returns None if the counts are not known
+    """
+    if not isinstance(sources, list):
+        return None
+    if trace_store.is_store(trace_path):
+        lengths = np.diff(trace_store.open_store(trace_path).offsets)
+        return [int(lengths[source[1]]) for source, _ in sources]
+    if catalog_path is not None:
+        trace_catalog = catalog.Catalog(catalog_path)
+        packets = dict((record.path, record.packets) for record in trace_catalog.query())
+        trace_catalog.close()
+        return [packets[source] for source, _ in sources]
+    if util.REMOVE_OUTLIERS:
+        return pool.map(trace_length, [source for source, _ in sources], chunksize=BATCH_SIZE)
+    return None
+
+
+def filter_sources(sources, counts=None):
+    """
+    drop the traces rejected by the trace filters (see filters.py) from a list of (source, entry) pairs
+    with known packet counts; returns the kept pairs and their counts
+    without counts, and for archive generators, short traces are dropped by the workers instead
+    """
+    if counts is None:
+        return sources, counts
+    sites = [parse_name(trace_name(source))[0] for source, _ in sources]
+    keep = filters.keep_traces(sites, counts)
+    if not keep.all():
+        print("{} of {} traces were dropped by the trace filters".format(len(keep) - keep.sum(), len(keep)))
+    return ([pair for pair, kept in zip(sources, keep) if kept],
+            [count for count, kept in zip(counts, keep) if kept])
+
+
+def schedule_sources(sources, counts=None):
+    """
+    pair every (source, entry) pair with its estimated cost: its packet count if known,
+    otherwise the size of the trace recorded in its manifest entry
+    lists are ordered longest first, so that the largest traces do not end up last and leave the other
+    workers idle; archive generators keep their order
+    """
+    if not isinstance(sources, list):
+        return ((pair, pair[1]['size']) for pair in sources)
+    costs = counts if counts is not None else [entry['size'] for _, entry in sources]
+    order = sorted(range(len(sources)), key=lambda i: costs[i], reverse=True)
+    return [(sources[i], costs[i]) for i in order]
+
+
+def chunk_budget(work, workers):
+    """
+    estimated cost of a task when splitting a scheduled work list into CHUNKS_PER_WORKER tasks per worker
+    None (no budget) for archive generators
+    """
+    if not isinstance(work, list):
+        return None
+    return max(sum(cost for _, cost in work) / (workers * CHUNKS_PER_WORKER), 1)
+
+
+def shard_work(work, shard, shards):
+    """
+    the part of a scheduled work list (see schedule_sources) which falls to shard number shard (0-based)
+    of shards: traces are dealt longest first to the shard with the least work so far,
+    ties going by trace name and shard number, so that every shard process computes
+    the same size-balanced partition of the traces
+    """
+    if not isinstance(work, list):
+        raise ValueError("sharding needs the whole work list: use a trace directory, store or catalog, "
+                         "not an archive")
+    order = sorted(range(len(work)), key=lambda i: (-work[i][1], trace_name(work[i][0][0])))
+    loads = [(0, i) for i in range(shards)]
+    part = []
+    for i in order:
+        load, owner = heapq.heappop(loads)
+        if owner == shard:
+            part.append(work[i])
+        heapq.heappush(loads, (load + work[i][1], owner))
+    return part
+
+
+def shard_path(out_path, shard, shards):
+    """
+    dataset directory of one extraction shard
+    """
+    return os.path.join(out_path, 'shard-{}-of-{}'.format(shard, shards))
+
+
+def merge_shards(out_path, shards):
+    """
+    combine the datasets of all shards of an extraction under out_path into one dataset at out_path,
+    with rows in the order of an unsharded extraction (see dataset.merge_datasets)
+    """
+    paths = [shard_path(out_path, shard, shards) for shard in range(shards)]
+    missing = [path for path in paths if not os.path.isdir(path)]
+    if missing:
+        raise ValueError("shards have not been extracted: {}".format(', '.join(missing)))
+    feature_pos = None
+    for path in paths:
+        if not dataset.is_dataset(path):
+            continue
+        with open(os.path.join(path, 'FeaturePositions.json')) as fd:
+            positions = json.load(fd, object_pairs_hook=OrderedDict)
+        if feature_pos is not None and positions != feature_pos:
+            raise ValueError("shard {} was extracted with different feature blocks".format(path))
+        feature_pos = positions
+    rows = dataset.merge_datasets(paths, out_path)
+    if feature_pos is not None:
+        with open(os.path.join(out_path, 'FeaturePositions.json'), 'w') as fd:
+            fd.write(json.dumps(feature_pos))
+    print("{} traces merged from {} shards".format(rows, shards))
+
+
+def extract_files(pool, work, out_path, records, force=False, budget=None, workers=1):
+    """
+    extract new or changed traces into one feature file per trace
+    work lists ((source, entry), cost) pairs (see schedule_sources); workers receive chunks of traces
+    of about budget cost each
+    returns the manifest entries of all traces seen
+    """
+    entries = []
+
+    def stale_tasks():
+        store_feature_pos = True
+        for (source, entry), cost in work:
+            entries.append(entry)
+            # skip traces which are unchanged since the last run (see manifest.py)
+            if not force and records.is_current(entry) and \
+                    os.path.exists(os.path.join(out_path, trace_name(source) + FEATURE_EXT)):
+                continue
+            # feature positions are saved while extracting the first trace
+            yield (source, out_path, store_feature_pos, entry), cost
+            store_feature_pos = False
+
+    tasks, total = stale_tasks(), None
+    if isinstance(work, list):
+        tasks = list(tasks)
+        total = len(tasks)
+        print("{} of {} traces are new or changed".format(total, len(work)))
+
+    # two chunks in flight per worker
+    semaphore = threading.Semaphore(2 * workers)
+    progress = tqdm(total=total)
+    for results in pool.imap(files_handler, bounded(weighted_chunks(tasks, budget), semaphore)):
+        semaphore.release()
+        progress.update(len(results))
+        for entry in results:
+            if entry is not None:
+                records.update(entry)
+    progress.close()
+    return entries
+
+
+def prefetch(source):
+    """
+    read a trace file once, so that the worker loading it finds it in the page cache
+    (store traces are memory-mapped and archive members already in memory)
+    """
+    if isinstance(source, str):
+        try:
+            with open(source, 'rb') as fd:
+                while fd.read(2 ** 20):
+                    pass
+        except OSError:
+            # the worker reports unreadable traces
+            pass
+
+
+def read_ahead(tasks, readers=READERS, depth=READ_AHEAD):
+    """
+    pipelined mode reader stage: prefetch the trace files of (task, cost) pairs in reader threads,
+    at most depth traces ahead of the consumer
+    yields the (task, cost) pairs in order, once their files have been read
+    """
+    pending = deque()
+    with ThreadPoolExecutor(readers) as executor:
+        for task, cost in tasks:
+            pending.append((task, executor.submit(prefetch, task[0]), cost))
+            if len(pending) >= depth:
+                task, future, cost = pending.popleft()
+                future.result()
+                yield task, cost
+        for task, future, cost in pending:
+            future.result()
+            yield task, cost
+
+
+def write_stage(results, records, errors):
+    """
+    pipelined mode writer stage: write the feature files of (entry, path, text) results taken from a queue
+    until a None result, recording each trace once its file is written
+    a failed write is appended to errors, and the remaining results are drained without writing them
+    """
+    while True:
+        result = results.get()
+        if result is None:
+            break
+        if errors:
+            continue
+        entry, path, text = result
+        try:
+            with profiler.timed('write'):
+                with open(path, "w") as fout:
+                    fout.write(text)
+        except Exception as e:
+            errors.append(e)
+            continue
+        records.update(entry)
+
+
+def extract_files_pipelined(pool, work, out_path, records, force=False, budget=None, workers=1):
+    """
+    extract new or changed traces into one feature file per trace, overlapping I/O with computation:
+    reader threads read the trace files into the page cache ahead of the workers (see read_ahead),
+    the workers load and extract the traces, and a writer thread writes the feature files (see write_stage);
+    the stages are connected by bounded queues
+    returns the manifest entries of all traces seen
+    """
+    entries = []
+
+    def stale_tasks():
+        store_feature_pos = True
+        for (source, entry), cost in work:
+            entries.append(entry)
+            # skip traces which are unchanged since the last run (see manifest.py)
+            if not force and records.is_current(entry) and \
+                    os.path.exists(os.path.join(out_path, trace_name(source) + FEATURE_EXT)):
+                continue
+            # feature positions are saved while extracting the first trace
+            yield (source, out_path, store_feature_pos, entry), cost
+            store_feature_pos = False
+
+    tasks, total = stale_tasks(), None
+    if isinstance(work, list):
+        tasks = list(tasks)
+        total = len(tasks)
+        print("{} of {} traces are new or changed".format(total, len(work)))
+
+    results = Queue(maxsize=2 * workers)
+    errors = []
+    writer = threading.Thread(target=write_stage, args=(results, records, errors))
+    writer.start()
+    # two chunks in flight per worker
+    semaphore = threading.Semaphore(2 * workers)
+    progress = tqdm(total=total)
+    try:
+        for chunk in pool.imap(compute_handler, bounded(weighted_chunks(read_ahead(tasks), budget), semaphore)):
+            semaphore.release()
+            progress.update(len(chunk))
+            for entry, name, text in filter(None, chunk):
+                results.put((entry, os.path.join(out_path, name + FEATURE_EXT), text))
+    finally:
+        results.put(None)
+        writer.join()
+    progress.close()
+    if errors:
+        raise errors[0]
+    return entries
+
+
+def extract_matrix(pool, work, out_path, records, force=False, budget=None, workers=1, sparse=False):
+    """
+    extract traces into one dense dataset (see dataset.py)
+    every feature block is cached as its own column group (see block_cache.py),
+    so only blocks which are new, changed or missing for a trace are computed
+    work lists ((source, entry), cost) pairs (see schedule_sources); workers receive batches of traces
+    of about budget cost each
+    if sparse is set, the matrix is saved in CSR format (see dataset.MatrixWriter)
+    returns the manifest entries of all traces seen
+    """
+    blocks = enabled_blocks()
+    if not blocks:
+        raise ValueError("no feature blocks are enabled in util.py")
+    groups = [block_cache.BlockGroup(out_path, block, block_params(block)) for block in blocks]
+    entries = []
+
+    def tasks():
+        for (source, entry), cost in work:
+            entries.append(entry)
+            label = parse_name(trace_name(source))
+            signature = block_cache.trace_signature(entry)
+            # blocks which have to be (re)computed for this trace
+            needed = [group.name for group in groups if force or group.find(label, signature) is None]
+            yield ((source if needed else None), needed, (entry, label, signature)), (cost if needed else 0)
+
+    # assemble the matrix from freshly computed and cached column groups
+    writer = dataset.MatrixWriter(out_path, sparse=sparse)
+    for group in groups:
+        group.open()
+    feature_pos = None
+    computed = 0
+    # two batches in flight per worker
+    semaphore = threading.Semaphore(2 * workers)
+    progress = tqdm(total=len(work) if isinstance(work, list) else None)
+    for results in pool.imap(batch_handler, bounded(weighted_chunks(tasks(), budget), semaphore)):
+        semaphore.release()
+        progress.update(len(results))
+        for (entry, label, signature), fresh in results:
+            if fresh is None:
+                continue
+            computed += 1 if fresh else 0
+            rows = []
+            with profiler.timed('write'):
+                for group in groups:
+                    row = fresh[group.name] if group.name in fresh else group[group.find(label, signature)]
+                    group.write(row, label, signature)
+                    rows.append(row)
+                writer.write(np.concatenate(rows), label[0], label[1])
+            records.update(entry)
+            if feature_pos is None:
+                feature_pos = OrderedDict(zip(blocks, np.cumsum([len(row) for row in rows]).tolist()))
+    progress.close()
+    for group in groups:
+        group.close()
+    writer.close()
+    print("{} of {} traces had new or changed feature blocks".format(computed, len(entries)))
+
+    # output FeaturePos
+    if feature_pos is not None:
+        with open(os.path.join(out_path, 'FeaturePositions.json'), 'w') as fd:
+            fd.write(json.dumps(feature_pos))
+    return entries
+
+
+def prefix_path(out_path, cutoff, unit='time'):
+    """
+    dataset directory of the trace prefixes ending at a cutoff
+    """
+    return os.path.join(out_path, '{}-{:g}'.format(unit, cutoff))
+
+
+def extract_prefix_matrices(pool, sources, out_path, cutoffs, unit='time', sparse=False):
+    """
+    extract the prefixes of every trace ending at each cutoff (see extract_prefixes)
+    into one dense dataset per cutoff, stored under out_path (see prefix_path)
+    every trace is read and scanned once for all of its prefixes
+    if sparse is set, the datasets are saved in CSR format (see dataset.MatrixWriter)
+    """
+    blocks = enabled_blocks()
+    writers = []
+    for cutoff in cutoffs:
+        if not os.path.exists(prefix_path(out_path, cutoff, unit)):
+            os.makedirs(prefix_path(out_path, cutoff, unit))
+        writers.append(dataset.MatrixWriter(prefix_path(out_path, cutoff, unit), sparse=sparse))
+    feature_pos = [None] * len(cutoffs)
+
+    def tasks():
+        for source, entry in sources:
+            yield source, cutoffs, unit, parse_name(trace_name(source))
+
+    semaphore = threading.Semaphore(MAX_PENDING)
+    chunksize = max(1, min(BATCH_SIZE, MAX_PENDING // (4 * (os.cpu_count() or 1))))
+    total = len(sources) if isinstance(sources, list) else None
+    for label, prefixes in tqdm(pool.imap(prefix_handler, bounded(tasks(), semaphore), chunksize=chunksize),
+                                total=total):
+        semaphore.release()
+        if prefixes is None:
+            continue
+        for i, rows in enumerate(prefixes):
+            if rows is None:
+                continue
+            rows = [rows[block] for block in blocks]
+            with profiler.timed('write'):
+                writers[i].write(np.concatenate(rows), label[0], label[1])
+            if feature_pos[i] is None:
+                feature_pos[i] = OrderedDict(zip(blocks, np.cumsum([len(row) for row in rows]).tolist()))
+    for writer in writers:
+        writer.close()
+
+    # output FeaturePos
+    for cutoff, positions in zip(cutoffs, feature_pos):
+        if positions is not None:
+            with open(os.path.join(prefix_path(out_path, cutoff, unit), 'FeaturePositions.json'), 'w') as fd:
+                fd.write(json.dumps(positions))
+
+
+def ignore_interrupts():
+    """
+    pool initializer leaving interrupts to the main process
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def watch_traces(pool, trace_path, out_path, catalog_path, interval=WATCH_INTERVAL):
+    """
+    keep extracting the traces landing in a trace directory, appending their rows to the dataset
+    at out_path in arrival order (see dataset.DatasetAppender) until interrupted
+    the directory is polled through its trace catalog (see catalog.py); traces already in the dataset,
+    traces still being written and traces which could not be extracted before are left out
+    the dataset's progress marker records which rows are complete and the traces skipped,
+    so a restarted watch carries on where the last one stopped
+    """
+    blocks = enabled_blocks()
+    if not blocks:
+        raise ValueError("no feature blocks are enabled in util.py")
+    appender = dataset.DatasetAppender(out_path)
+    config = manifest.config_hash()
+    if appender.state.get('config', config) != config:
+        raise ValueError("{} was extracted with other feature settings".format(out_path))
+    sites, instances = appender.labels()
+    done = set(zip(sites.tolist(), instances.tolist()))
+    # (size, mtime) of the trace files which could not be extracted, by path; retried once they change
+    skipped = appender.state.get('skipped', {})
+    feature_pos = os.path.join(out_path, 'FeaturePositions.json')
+
+    trace_catalog = catalog.Catalog(catalog_path)
+    try:
+        while True:
+            trace_catalog.refresh(trace_path, extension='.cell')
+            settled = (time.time() - SETTLE_TIME) * 1e9
+            new = [record for record in trace_catalog.query()
+                   if (record.site, record.instance) not in done and record.mtime <= settled
+                   and skipped.get(record.path) != [record.file_size, record.mtime]]
+            tasks, rows_before = [], appender.rows
+            for record in new:
+                if filters.short_traces(record.packets):
+                    skipped[record.path] = [record.file_size, record.mtime]
+                else:
+                    tasks.append(((record.path, blocks, record), record.packets))
+            for results in pool.imap(batch_handler, weighted_chunks(tasks, limit=WATCH_BATCH)):
+                rows, labels = [], []
+                for record, fresh in results:
+                    if fresh is None:
+                        skipped[record.path] = [record.file_size, record.mtime]
+                        continue
+                    rows.append(np.concatenate([fresh[block] for block in blocks]))
+                    labels.append((record.site, record.instance))
+                    if not os.path.exists(feature_pos):
+                        with open(feature_pos, 'w') as fd:
+                            fd.write(json.dumps(OrderedDict(zip(blocks, np.cumsum(
+                                [len(fresh[block]) for block in blocks]).tolist()))))
+                appender.append(np.array(rows, dtype=np.float32).reshape(len(rows), -1),
+                                [site for site, _ in labels], [instance for _, instance in labels],
+                                {'config': config, 'skipped': skipped})
+                done.update(labels)
+            if appender.rows > rows_before:
+                print("{} traces appended, {} in the dataset".format(appender.rows - rows_before, appender.rows))
+            time.sleep(interval)
+    except KeyboardInterrupt:
         pass
+    finally:
+        trace_catalog.close()
+
+
+def main(trace_path, out_path, matrix=False, force=False, content_hash=False, catalog_path=None,
+         prefixes=None, unit='time', workers=None, pipeline=False, shard=None, watch=False, sparse=False,
+         profile=False):
+    """
+    start batches to handle feature extraction
+    trace_path is a trace directory, a packed trace store or a (compressed) tar archive of traces
+    if matrix is set, collect all features into one dense dataset (see dataset.py)
+    instead of writing a feature file per trace
+    traces already extracted with the active feature settings are skipped unless force is set
+    if catalog_path is set, the work list is taken from that trace catalog (see catalog.py)
+    empty, too short and (optionally) outlier traces are dropped before extraction (see filters.py)
+    if prefixes lists time (or packet) cutoffs, one dataset of the trace prefixes ending at each cutoff
+    is written instead (see extract_prefix_matrices); these are always extracted in full
+    workers is the number of worker processes (the number of CPUs if None); traces are handed to them
+    longest first, in chunks of about equal work (see schedule_sources)
+    if pipeline is set, feature files are extracted with reading, computation and writing overlapped
+    (see extract_files_pipelined)
+    if shard is an (index, count) pair, only that shard's part of the traces (see shard_work) is extracted,
+    into a dense dataset under out_path (see shard_path); merge_shards combines the shards afterwards
+    if watch is set, the trace directory is polled for new traces, which are appended to the dataset
+    at out_path until interrupted (see watch_traces); catalog_path defaults to a catalog in out_path
+    if sparse is set, dense datasets are saved as CSR matrices (features.npz) instead
+    if profile is set, the time of every feature block and of the parse and write phases is measured
+    in every process and reported in out_path/Profile.json (see profiler.py)
+    """
+    if watch:
+        workers = workers or os.cpu_count() or 1
+        pool = Pool(workers, initializer=ignore_interrupts)
+        watch_traces(pool, trace_path, out_path, catalog_path or os.path.join(out_path, WATCH_CATALOG))
+        # batches in flight when interrupted are dropped
+        pool.terminate()
+        return
+    if shard is not None:
+        out_path, matrix = shard_path(out_path, *shard), True
+        if not os.path.exists(out_path):
+            os.makedirs(out_path)
+    sources = collect_sources(trace_path, catalog_path, content_hash)
+    records = manifest.Manifest(out_path)
+
+    # start worker processes for computation
+    workers = workers or os.cpu_count() or 1
+    if profile:
+        start = time.perf_counter()
+        dump_dir = os.path.join(out_path, 'profile.tmp')
+        if not os.path.exists(dump_dir):
+            os.makedirs(dump_dir)
+        pool = Pool(workers, initializer=profiler.enable, initargs=(dump_dir,))
+        profiler.enable()
+    else:
+        pool = Pool(workers)
+    counts = packet_counts(pool, sources, trace_path, catalog_path)
+    sources, counts = filter_sources(sources, counts)
+    work = schedule_sources(sources, counts)
+    if shard is not None:
+        work = shard_work(work, *shard)
+    if prefixes:
+        pairs = [pair for pair, _ in work] if isinstance(work, list) else (pair for pair, _ in work)
+        extract_prefix_matrices(pool, pairs, out_path, prefixes, unit, sparse=sparse)
+    else:
+        budget = chunk_budget(work, workers)
+        if matrix:
+            entries = extract_matrix(pool, work, out_path, records, force=force, budget=budget, workers=workers,
+                                     sparse=sparse)
+        elif pipeline:
+            entries = extract_files_pipelined(pool, work, out_path, records, force=force, budget=budget,
+                                              workers=workers)
+        else:
+            entries = extract_files(pool, work, out_path, records, force=force, budget=budget, workers=workers)
+        records.retain(entries)
+        records.save()
+    pool.close()
+
+    if profile:
+        # the workers save their statistics as they exit
+        pool.join()
+        profiler.write_report(out_path, dump_dir, time.perf_counter() - start)
+
+
+def parse_defense(spec):
+    """
+    parse a name:parameter=value,... defense step of the command line
+    """
+    name, _, params = spec.partition(':')
+    if name not in defenses.DEFENSES:
+        raise ValueError("unknown defense {}, expected one of {}".format(name, ', '.join(sorted(defenses.DEFENSES))))
+    step = {}
+    for param in filter(None, params.split(',')):
+        key, _, value = param.partition('=')
+        try:
+            step[key] = int(value)
+        except ValueError:
+            step[key] = float(value)
+    return name, step
 
 
 def parse_args():
@@ -193,19 +1051,84 @@ def parse_args():
     parse command line arguments
     """
     parser = argparse.ArgumentParser("Process traces into features lists.")
-    parser.add_argument("-t", "--traces", required=True)
+    parser.add_argument("-t", "--traces", required=False)
     parser.add_argument("-o", "--output", required=True)
     parser.add_argument("-e", "--extension", required=False)
-    return parser.parse_args()
+    parser.add_argument("-m", "--matrix", action="store_true",
+                        help="Write a dense features.npy matrix instead of one feature file per trace.")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-extract all traces, including those unchanged since the last run.")
+    parser.add_argument("--content_hash", action="store_true",
+                        help="Detect changed traces by content hash instead of size and mtime.")
+    parser.add_argument("-c", "--catalog", default=None,
+                        help="Trace catalog to take the work list from; built or refreshed before extraction.")
+    parser.add_argument("--prefixes", default=None,
+                        help="Comma-separated cutoffs: write one dense dataset of the trace prefixes ending at "
+                             "each cutoff, e.g. '1,2,5,10'.")
+    parser.add_argument("--prefix_unit", default='time', choices=['time', 'packets'],
+                        help="Whether the prefix cutoffs are times in seconds or packet counts.")
+    parser.add_argument("-w", "--workers", default=None, type=int,
+                        help="Number of worker processes (default: the number of CPUs).")
+    parser.add_argument("-p", "--pipeline", action="store_true",
+                        help="Overlap reading, feature computation and writing of feature files.")
+    parser.add_argument("--shard", default=None,
+                        help="Extract only shard i of N (0-based), given as 'i/N', into <output>/shard-i-of-N.")
+    parser.add_argument("--merge", default=None, type=int,
+                        help="Merge the N extracted shards under the output directory into one dataset.")
+    parser.add_argument("--sparse", action="store_true",
+                        help="Save dense datasets (--matrix, --shard, --prefixes) as CSR matrices in features.npz.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time every feature block and the parse and write phases, and write a report "
+                             "to Profile.json in the output directory.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep polling the trace directory and append the features of new traces "
+                             "to the dataset in the output directory.")
+    parser.add_argument("--defense", action="append", default=[],
+                        help="Simulate a defense on every trace before extraction, as name:parameter=value,... "
+                             "(e.g. dummy:rate_out=20,rate_in=50); repeat to apply several in order. "
+                             "Defenses: " + ', '.join(sorted(defenses.DEFENSES)) + ".")
+    parser.add_argument("--defense_seed", default=None, type=int,
+                        help="Seed of the defenses' random draws (default: util.DEFENSE_SEED).")
+    args = parser.parse_args()
+    try:
+        args.defense = [parse_defense(spec) for spec in args.defense]
+    except ValueError as e:
+        parser.error("--defense: {}".format(e))
+    if args.traces is None and args.merge is None:
+        parser.error("the following arguments are required: -t/--traces")
+    if args.shard is not None:
+        try:
+            args.shard = tuple(int(part) for part in args.shard.split('/'))
+            index, count = args.shard
+        except ValueError:
+            parser.error("--shard takes the form i/N")
+        if not 0 <= index < count:
+            parser.error("--shard index must lie in [0, N)")
+        if args.prefixes:
+            parser.error("--shard does not apply to --prefixes")
+    return args
 
 
 if __name__ == "__main__":
     args = parse_args()
     if args.extension:
         FEATURE_EXT = args.extension
-    if args.output:
+    prefixes = [float(cutoff) for cutoff in args.prefixes.split(',')] if args.prefixes else None
+    if args.defense:
+        util.DEFENSES = args.defense
+    if args.defense_seed is not None:
+        util.DEFENSE_SEED = args.defense_seed
+    if args.merge is not None:
+        merge_shards(args.output, args.merge)
+    elif args.output:
         if not os.path.exists(args.output):
             os.makedirs(args.output)
-        main(args.traces, args.output)
+        main(args.traces, args.output, matrix=args.matrix, force=args.force, content_hash=args.content_hash,
+             catalog_path=args.catalog, prefixes=prefixes, unit=args.prefix_unit, workers=args.workers,
+             pipeline=args.pipeline, shard=args.shard, watch=args.watch, sparse=args.sparse,
+             profile=args.profile)
     else:
-        main(args.traces, args.traces)
+        main(args.traces, args.traces, matrix=args.matrix, force=args.force, content_hash=args.content_hash,
+             catalog_path=args.catalog, prefixes=prefixes, unit=args.prefix_unit, workers=args.workers,
+             pipeline=args.pipeline, shard=args.shard, watch=args.watch, sparse=args.sparse,
+             profile=args.profile)
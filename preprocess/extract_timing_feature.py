@@ -1,170 +1,163 @@
+# timing feature extraction: k-FP timing features plus binned burst timing statistics (Tik-Tok)
+# runs in two passes over the traces, both in a process pool:
+# pass 1 computes the burst timing statistics of every trace and merges them into one quantile sketch
+# per statistic (see sketch.py), whose percentiles are the global bin edges;
+# pass 2 recomputes the statistics of every trace, bins them and writes the trace's feature file.
+# no per-trace statistics are kept between the passes, so memory stays bounded on large datasets
 from util import howlong
 from features import Time, PktSec
+from features.derived import trace_of, segment_stats
+from trace_store import is_store, open_store
+from catalog import open_catalog
+from sketch import QuantileSketch
+from multiprocessing import Pool
+from collections import OrderedDict
+from tqdm import tqdm
 import os
 import numpy as np
 
+# burst timing statistics, in output order
+BURST_FEATURES = ["medians", "ibdff", "ibdiff", "ibdlf", "ibdoff", "interval", "inter_inramd", "ibdbvar"]
+# number of traces a worker handles per task
+CHUNK_SIZE = 64
 
-def extract_bursts(trace):
-    bursts = []
-    direction_counts = []
-    direction = trace[0][1]
-    burst = []
-    count = 1
-    for i, packet in enumerate(trace):
-        if packet[1] != direction:
-            bursts.append(burst)
-            burst = [packet]
-            direction_counts.append(count)
-            direction = packet[1]
-            count = 1
-        else:
-            burst.append(packet)
-            count += 1
-    bursts.append(burst)
-    return bursts, direction_counts
 
-
-def direction_counts(trace):
-    counts = []
-    direction = trace[0][1]
-    count = 1
-    for packet in trace:
-        if packet[1] != direction:
-            counts.append(count)
-            direction = packet[1]
-            count = 1
-        else:
-            count += 1
-    return counts
-
-
-def get_bin_sizes(feature_values, bin_input):
-    bin_raw = []
-    for v in feature_values.values():
-        bin_raw.extend(v)
-    bin_s = np.sort(bin_raw)
-    bins = np.arange(0, 100 + 1, 100.0 / bin_input)
-
-    final_bin = [np.percentile(bin_s, e) for e in bins]
-    return final_bin
-
-
-def slice_by_binsize(feature_values, bin_input):
-    bin_for_all_instances = np.array(get_bin_sizes(feature_values, bin_input))
-    d_new = {}
-    for name, v in feature_values.iteritems():
-        d_new[name] = [[] for _ in range(bin_input)]
-
-        bin_indices = np.digitize(np.array(v),
-                                  bin_for_all_instances[:bin_input],
-                                  right=True)
-        for i in range(bin_indices.size):
-            if bin_indices[i] > bin_input:
-                d_new[name][-1].append(v[i])
-            elif bin_indices[i] == 0:
-                d_new[name][0].append(v[i])
-            else:
-                d_new[name][bin_indices[i] - 1].append(v[i])
-    return d_new
-
-
-def get_statistics(feature_values, bin_input):
-    sliced_dic = slice_by_binsize(feature_values, bin_input)
-    bin_length = {
-        key: [len(value) for value in values] for key, values in
-        sliced_dic.iteritems()
-    }
-    return bin_length
-
-
-def normalize_data(feature_values, bin_input):
-    to_be_norm = get_statistics(feature_values, bin_input)
-    normed = {
-        key: [float(value) / sum(values) for value in values]
-        if sum(values) > 0 else values
-        for key, values in to_be_norm.iteritems()
-    }
-    return normed
-
-
-def final_format_by_class(feature_values, bin_input):
-    # norm_data = normalized_data(traces, bin_input)
-    norm_data = get_statistics(feature_values, bin_input)
-    final = {}
-    for k in norm_data:
-        c = k.split('-')[0]
-        if c not in final:
-            final[c] = [norm_data[k]]
-        else:
-            final[c].append(norm_data[k])
-    return final
-
-
-def padding_neural(feature_values):
-    directed_neural = feature_values
-    max_length = max(len(elements) for elements in directed_neural.values())
-    print("Maximum Length", max_length)
-    for key, value in directed_neural.iteritems():
-        if len(value) < max_length:
-            zeroes_needed = max_length - len(value)
-            value += [0] * zeroes_needed
-
-    return directed_neural
-
-def intraBD_med(bursts):
-    intra_burst_delays = []
-    for burst in bursts:
-        timestamps = [packet[0] for packet in burst]
-        intra_burst_delays.append(np.median(timestamps))
-    return intra_burst_delays
-
-
-def inter_inramd(bursts):
-    primary = intraBD_med(bursts)
-    processed = [q-p for p, q in zip(primary[:-1], primary[1:])]
-
-    return processed
-
-
-def intra_burst_delay_var(bursts):
-    intra_burst_delays = []
-    for burst in bursts:
-        timestamps = [packet[0] for packet in burst]
-        intra_burst_delays.append(np.var(timestamps))
-    return intra_burst_delays
-
-
-def inter_burst_delay_first_first(bursts):
-    timestamps = [float(burst[0][0]) for burst in bursts]
-
-    return np.diff(timestamps).tolist()
+def load_trace(data_path, site, label, path):
+    """
+    load the times and directions (+1 outgoing, -1 otherwise) of a trace
+    path is None for traces of a packed trace store
+    """
+    if path is None:
+        # slice the trace out of the packed trace store
+        store = open_store(data_path)
+        times, raw_sizes = store[store.find(site, label)]
+        return times.tolist(), [1 if size > 0 else -1 for size in raw_sizes.tolist()]
+    # Directory of the raw data
+    times = []
+    sizes = []
+    with open(path, "r") as file_pt:
+        for line in file_pt:
+            x = line.strip().split('\t')
+            times.append(float(x[0]))
+            sizes.append(1 if float(x[1]) > 0 else -1)
+    return times, sizes
+
+
+def burst_statistics(times, sizes):
+    """
+    burst timing statistics of a trace, bursts being runs of packets in the same direction
+    returns a mapping of every BURST_FEATURES name to its values (one per burst or pair of bursts)
+    """
+    trace = trace_of(times, sizes)
+    stamps = trace.times
+    starts = trace.burst_starts
+    ends = trace.burst_ends
+    outgoing = trace.outgoing[starts]
+    # median and variance of the timestamps of each burst
+    medians, variances = segment_stats(stamps, starts, ends - starts)
+    durations = stamps[ends - 1] - stamps[starts]
+    stats = OrderedDict()
+    stats["medians"] = medians
+    stats["ibdff"] = np.diff(stamps[starts])
+    stats["ibdiff"] = np.diff(stamps[starts[~outgoing]])
+    stats["ibdlf"] = durations
+    stats["ibdoff"] = np.diff(stamps[starts[outgoing]])
+    stats["interval"] = durations
+    stats["inter_inramd"] = np.diff(medians)
+    stats["ibdbvar"] = variances
+    return stats
+
+
+def trace_statistics(item):
+    """
+    load a work list item and compute its burst timing statistics
+    returns the times, directions and statistics of the trace, or None if it could not be read or is empty
+    """
+    data_path, site, label, path = item
+    try:
+        times, sizes = load_trace(data_path, site, label, path)
+    except (IOError, KeyError, ValueError, IndexError):
+        return None
+    if not times:
+        return None
+    return times, sizes, burst_statistics(times, sizes)
 
 
-def inter_burst_delay_incoming_first_first(bursts):
-    incoming_bursts = [burst for burst in bursts if burst[0][1] == -1]
-    timestamps = [float(burst[0][0]) for burst in incoming_bursts]
-    return np.diff(timestamps).tolist()
+def bin_edges(sketch, bin_input):
+    """
+    global bin edges of a statistic: its percentiles at 0, 100 / bin_input, ..., 100
+    """
+    if len(sketch) == 0:
+        return np.zeros(bin_input + 1)
+    return sketch.percentile(np.arange(0, 100 + 1, 100.0 / bin_input))
 
 
-def inter_burst_delay_last_first(bursts):
-    timestamps_first = [float(burst[0][0]) for burst in bursts]
-    timestamps_last = [float(burst[-1][0]) for burst in bursts]
-    inter_burst_delays = [i-j for i, j in zip(timestamps_last,
-                                              timestamps_first)]
-    return inter_burst_delays
+def bin_fractions(values, edges, bin_input):
+    """
+    fraction of the values of a trace falling into each bin (counts of zero if there are no values)
+    bin i holds the values in (edges[i], edges[i + 1]], the first bin also those up to edges[0]
+    """
+    indices = np.digitize(values, edges[:bin_input], right=True)
+    counts = np.bincount(np.maximum(indices - 1, 0), minlength=bin_input)
+    if counts.sum() == 0:
+        return counts.tolist()
+    return (counts / counts.sum()).tolist()
 
 
-def inter_burst_delay_outgoing_first_first(bursts):
-    outgoing_bursts = [burst for burst in bursts if burst[0][1] == 1]
-    timestamps = [float(burst[0][0]) for burst in outgoing_bursts]
-    return np.diff(timestamps).tolist()
+def sketch_chunk(args):
+    """
+    pass 1: merge the burst timing statistics of a chunk of traces into one quantile sketch per statistic
+    """
+    items, capacity = args
+    sketches = OrderedDict((feature, QuantileSketch(capacity)) for feature in BURST_FEATURES)
+    for item in items:
+        result = trace_statistics(item)
+        if result is None:
+            continue
+        for feature, values in result[2].items():
+            sketches[feature].update(values)
+    return sketches
+
+
+def write_chunk(args):
+    """
+    pass 2: bin the burst timing statistics of a chunk of traces and write their feature files
+    returns the feature positions and the number of traces which could not be read
+    """
+    items, edges, bin_size, output_dir = args
+    feature_pos = None
+    failed = 0
+    for item in items:
+        result = trace_statistics(item)
+        if result is None:
+            failed += 1
+            continue
+        times, sizes, stats = result
+        _, site, label, _ = item
+
+        # calculate k-FP timing features for the instance
+        positions = OrderedDict()
+        data = []
+        Time.TimeFeature(times, sizes, data)
+        positions['PKT_TIME'] = len(data)
+        PktSec.PktSecFeature(times, sizes, data, howlong)
+        positions['PKT_PER_SEC'] = len(data)
+        # binned burst timing statistics
+        for feature in BURST_FEATURES:
+            data.extend(bin_fractions(stats[feature], edges[feature], bin_size))
+            positions[feature.upper()] = len(data)
+
+        with open(os.path.join(output_dir, "{}-{}.features".format(site, label)), "w") as out:
+            out.write(' '.join([str(item) for item in data]))
+        feature_pos = positions
+    return feature_pos, failed
 
 
-def intra_interval(bursts):
-    timestamps_first = [float(burst[0][0]) for burst in bursts]
-    timestamps_last = [float(burst[-1][0]) for burst in bursts]
-    interval = [i-j for i, j in zip(timestamps_last, timestamps_first)]
-    return interval
+def chunks(work_list, size=CHUNK_SIZE):
+    """
+    split a work list into chunks of up to size traces
+    """
+    return [work_list[i:i + size] for i in range(0, len(work_list), size)]
 
 
 def parse_args():
@@ -175,23 +168,18 @@ def parse_args():
     parser = argparse.ArgumentParser("Process traces into features lists.")
     parser.add_argument("-t", "--traces", required=True)
     parser.add_argument("-o", "--output", required=True)
-    parser.add_argument("-b", "--bin_size", default=20)
-    parser.add_argument("-i", "--instances", default=1000)
-    parser.add_argument("-s", "--sites", default=95)
+    parser.add_argument("-b", "--bin_size", default=20, type=int)
+    parser.add_argument("-i", "--instances", default=1000, type=int)
+    parser.add_argument("-s", "--sites", default=95, type=int)
+    parser.add_argument("-c", "--catalog", default=None)
+    parser.add_argument("--sketch_size", default=16384, type=int,
+                        help="Values kept per level of the quantile sketches used for the bin edges. "
+                             "Edges are exact only while no statistic has more values than this; the default "
+                             "gives approximate edges on real datasets (features may shift to adjacent bins). "
+                             "Use a size above the total packet count for exact output.")
     return parser.parse_args()
 
 def main():
-    features = {
-        "medians": {},
-        "ibdff": {},
-        "ibdiff": {},
-        "ibdlf": {},
-        "ibdoff": {},
-        "interval": {},
-        "inter_inramd": {},
-        "ibdbvar": {},
-    }
-
     args = parse_args()
 
     data_path = args.traces
@@ -199,85 +187,51 @@ def main():
     num_instances = args.instances
     bin_size = args.bin_size
 
-    labels_instances = []
-    old_timing_features = dict()
-    feature_pos = dict()
-
-    for site in range(0, num_sites):
-        for label in range(0, num_instances):
-            file_name = str(site) + "-" + str(label)
-            # Directory of the raw data
-            with open(os.path.join(data_path, file_name), "r") as file_pt:
-                # load trace
-                trace = []
-                times = []
-                sizes = []
-                for line in file_pt:
-                    x = line.strip().split('\t')
-                    time = float(x[0])
-                    size = 1 if float(x[1]) > 0 else -1
-                    times.append(time)
-                    sizes.append(size)
-                    trace.append((time, size))
-
-                # calculate and save k-FP timing features for the instance
-                old_timing_features[file_name] = []
-                Time.TimeFeature(times, sizes, old_timing_features[file_name])
-                feature_pos['PKT_TIME'] = len(old_timing_features[file_name])
-                PktSec.PktSecFeature(times, sizes, old_timing_features[file_name], howlong)
-                feature_pos['PKT_PER_SEC'] = len(old_timing_features[file_name])
-
-                # extract bursts and compute new timing statistics
-                bursts, direction_counts = extract_bursts(trace)
-                features["medians"][file_name] = intraBD_med(bursts)
-                features["ibdff"][file_name] = \
-                    inter_burst_delay_first_first(bursts)
-                features["ibdiff"][file_name] = \
-                    inter_burst_delay_incoming_first_first(bursts)
-                features["ibdlf"][file_name] = \
-                    inter_burst_delay_last_first(bursts)
-                features["ibdoff"][file_name] = \
-                    inter_burst_delay_outgoing_first_first(bursts)
-                features["interval"][file_name] = intra_interval(bursts)
-                features["inter_inramd"][file_name] = inter_inramd(bursts)
-                features["ibdbvar"][file_name] = intra_burst_delay_var(bursts)
-                labels_instances.append(file_name)
-        print ("Done with Site: ", site)
-
-    feature_bins = {
-        "medians": bin_size,
-        "ibdff": bin_size,
-        "ibdiff": bin_size,
-        "ibdlf": bin_size,
-        "ibdoff": bin_size,
-        "interval": bin_size,
-        "inter_inramd": bin_size,
-        "ibdbvar": bin_size
-    }
-
-    # Create bins for each feature, extract bin counts and normalize them
+    # take the list of existing traces from the store or the trace catalog if one is given (see catalog.py),
+    # otherwise assume every site-instance pair exists
+    if is_store(data_path):
+        store = open_store(data_path)
+        work_list = [(data_path, site, label, None) for site, label in
+                     zip(store.sites.tolist(), store.instances.tolist())
+                     if site < num_sites and label < num_instances]
+    elif args.catalog is not None:
+        trace_catalog = open_catalog(args.catalog, data_path)
+        work_list = [(data_path, record.site, record.instance, record.path) for record in
+                     trace_catalog.query(sites=(0, num_sites), instances=(0, num_instances))]
+        trace_catalog.close()
+    else:
+        work_list = [(data_path, site, label, os.path.join(data_path, str(site) + "-" + str(label)))
+                     for site in range(0, num_sites) for label in range(0, num_instances)]
+
+    pool = Pool()
+
+    # pass 1: global bin edges of every statistic from the merged sketches of all traces
+    print("Computing bin edges...")
+    sketches = OrderedDict((feature, QuantileSketch(args.sketch_size)) for feature in BURST_FEATURES)
+    for chunk_sketches in tqdm(pool.imap(sketch_chunk, [(chunk, args.sketch_size) for chunk in chunks(work_list)]),
+                               total=len(chunks(work_list))):
+        for feature, chunk_sketch in chunk_sketches.items():
+            sketches[feature].merge(chunk_sketch)
+    edges = dict((feature, bin_edges(sketch, bin_size)) for feature, sketch in sketches.items())
+
+    # pass 2: create bins for each feature, extract bin counts and normalize them
     print("Extracting Features...")
-
-    for feature in features:
-        features[feature] = normalize_data(features[feature], feature_bins[feature])
-
-    feature_names = features.keys()
-
     output_dir = args.output
-
-    print("Saving features...")
-    for label in labels_instances:
-        data = old_timing_features[label]
-        for feature in feature_names:
-            data.extend(features[feature][label])
-            feature_pos[feature.upper()] = len(data)
-        with open(os.path.join(output_dir, "{}.features".format(label)), "w") as out:
-            out.write(' '.join([str(item) for item in data]))
-
-    with open(os.path.join(output_dir, 'FeaturePos'), 'w') as fd:
-        newfp = sorted(feature_pos.items(), key=lambda i: i[1])
-        for each_key, pos in newfp:
-            fd.write(each_key + ':' + str(pos) + '\n')
+    feature_pos = None
+    failed = 0
+    tasks = [(chunk, edges, bin_size, output_dir) for chunk in chunks(work_list)]
+    for positions, chunk_failed in tqdm(pool.imap(write_chunk, tasks), total=len(tasks)):
+        feature_pos = feature_pos or positions
+        failed += chunk_failed
+    pool.close()
+    pool.join()
+    if failed:
+        print("{} of {} traces could not be read or were empty".format(failed, len(work_list)))
+
+    if feature_pos is not None:
+        with open(os.path.join(output_dir, 'FeaturePos'), 'w') as fd:
+            for each_key, pos in feature_pos.items():
+                fd.write(each_key + ':' + str(pos) + '\n')
 
     print("Done")
 
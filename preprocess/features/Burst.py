@@ -1,53 +1,48 @@
+import numpy
 from features.common import X
+from features.derived import trace_of, run_starts
+
 
 # knn feature (share similarity with interval)
 # the burst of inflow traffic
 def BurstFeature(times, sizes, features):
-    bursts = []
-    curburst = 0
-    stopped = 0
-    for x in sizes:
-        # find two bugs in original wang's
-        # two adjacent... should be nested "if"
-        # burst of outgoing packets, not incoming ones
+    # find two bugs in original wang's
+    # two adjacent... should be nested "if"
+    # burst of outgoing packets, not incoming ones
+    # a burst sums the outgoing packets up to two consecutive incoming ones
+    # (empty packets are ignored); the final, unterminated burst is dropped
+    trace = trace_of(times, sizes)
+    packets = trace.sizes[trace.sizes != 0] if trace.zero_count else trace.sizes
+    outgoing = packets > 0
+    starts = run_starts(outgoing)
+    lengths = numpy.diff(numpy.append(starts, len(packets)))
+    # the second packet of each incoming run of at least two packets ends the current burst
+    stops = (starts + 1)[~outgoing[starts] & (lengths >= 2)]
+    sent = numpy.cumsum(numpy.where(outgoing, packets, 0))
+    bursts = numpy.diff(sent[stops], prepend=0)
+    bursts = bursts[bursts != 0]
+    counts = [int(numpy.count_nonzero(bursts > 5)),
+              int(numpy.count_nonzero(bursts > 10)),
+              int(numpy.count_nonzero(bursts > 15))]
+    bursts = bursts.tolist()
+    BurstSummary(len(bursts), max(bursts) if bursts else 0, sum(bursts), counts, bursts[:5], features)
 
-        if x > 0:
-            stopped = 0
-            curburst += x
-        if x < 0 and stopped == 0:
-            stopped = 1
-        elif x < 0 and stopped == 1:
-            stopped = 0
-            if curburst != 0:
-                bursts.append(curburst)
-            curburst = 0  # corrected a bug: reset curburst!!
-        else:
-            pass
 
+def BurstSummary(count, largest, total, counts, head, features):
+    # burst features from the number, largest and total size of the bursts,
+    # the numbers of bursts larger than 5, 10 and 15, and the first 5 bursts
     # burst could be none
-    if len(bursts) != 0:
-        features.append(max(bursts))
-        features.append(sum(bursts) / len(bursts))
-        features.append(len(bursts))
+    if count != 0:
+        features.append(largest)
+        features.append(total / count)
+        features.append(count)
     else:
         features.append(0)
         features.append(0)
         features.append(0)
 
-    counts = [0, 0, 0]
-    for x in bursts:
-        if x > 5:
-            counts[0] += 1
-        if x > 10:
-            counts[1] += 1
-        if x > 15:
-            counts[2] += 1
-
     features.append(counts[0])
     features.append(counts[1])
     features.append(counts[2])
-    for i in range(0, 5):
-        try:
-            features.append(bursts[i])
-        except:
-            features.append(X)
+    features.extend(head)
+    features.extend([X] * (5 - len(head)))
@@ -2,64 +2,35 @@
 # input: a list of packet sizes
 
 
-import itertools
 import numpy
 
+from features.derived import trace_of
+
 
 def CumulFeatures(packets, featureCount):
-    separateClassifier = True
     # Calculate Features
 
-    features = []
-
-    total = []
-    cum = []
-    pos = []
-    neg = []
-    inSize = 0
-    outSize = 0
-    inCount = 0
-    outCount = 0
+    # CUMUL uses positive to denote incoming, negative to be outgoing,
+    # different from dataset
+    trace = trace_of(None, packets)
+    # cumulated packetsizes, over non-empty packets only
+    nonempty = trace.sizes != 0
+    total = trace.abs_cumsum[nonempty]
+    pos = trace.in_cumsum[nonempty]
+    neg = trace.out_cumsum[nonempty]
+    return CumulFromSums(total, pos, neg, trace.in_count, trace.out_count, featureCount)
 
-    # Process trace
-    for packetsize in itertools.islice(packets, None):
 
-        # CUMUL uses positive to denote incoming, negative to be outgoing,
-        # different from dataset
-        packetsize = - packetsize
-
-        # incoming packets
-        if packetsize > 0:
-            inSize += packetsize
-            inCount += 1
-            # cumulated packetsizes
-            if len(cum) == 0:
-                cum.append(packetsize)
-                total.append(packetsize)
-                pos.append(packetsize)
-                neg.append(0)
-            else:
-                cum.append(cum[-1] + packetsize)
-                total.append(total[-1] + abs(packetsize))
-                pos.append(pos[-1] + packetsize)
-                neg.append(neg[-1] + 0)
-
-        # outgoing packets
-        if packetsize < 0:
-            outSize += abs(packetsize)
-            outCount += 1
-            if len(cum) == 0:
-                cum.append(packetsize)
-                total.append(abs(packetsize))
-                pos.append(0)
-                neg.append(abs(packetsize))
-            else:
-                cum.append(cum[-1] + packetsize)
-                total.append(total[-1] + abs(packetsize))
-                pos.append(pos[-1] + 0)
-                neg.append(neg[-1] + abs(packetsize))
+def CumulFromSums(total, pos, neg, inCount, outCount, featureCount):
+    # CUMUL features from the cumulated total, incoming and outgoing sizes over the non-empty packets
+    # and the incoming and outgoing packet numbers
+    separateClassifier = True
+    features = []
+    cum = pos - neg
+    inSize = pos[-1]
+    outSize = neg[-1]
 
-    # Should already be removed by outlier Removal
+    # Should already be removed by outlier Removal (see filters.py)
     # if len(cum) < 2:
     # something must be wrong with this capture
     # continue
@@ -82,15 +53,12 @@ def CumulFeatures(packets, featureCount):
             numpy.linspace(total[0], total[-1], half), total, neg
         )
 
-        for el in itertools.islice(posFeatures, None):
-            features.append(el)
-        for el in itertools.islice(negFeatures, None):
-            features.append(el)
+        features.extend(posFeatures)
+        features.extend(negFeatures)
     else:
         # cumulative in one
         cumFeatures = numpy.interp(numpy.linspace(total[0], total[-1], featureCount + 1), total, cum)
-        for el in itertools.islice(cumFeatures, 1, None):
-            features.append(el)
+        features.extend(cumFeatures[1:])
 
     return features
     # fdout.write(str(features[0]) + ' '  + ' '.join(['%d:%s' % (i+1, el) for i,el in enumerate(features[1:])]) + ' # ' + str(instance.timestamp) + '\n')
@@ -1,38 +1,27 @@
 from features.common import X
+from features.derived import trace_of
 
 
 def First20(times, sizes, features):
-    for i in range(0, 20):
-        try:
-            features.append(sizes[i] + 1500)
-        except:
-            features.append(X)
+    head = [size + 1500 for size in sizes[:20]]
+    features.extend(head)
+    features.extend([X] * (20 - len(head)))
 
 
 def First30PktNum(times, sizes, features):
-    out_count = 0
-    in_count = 0
-    for i in range(0, 30):
-        # handle traces having less than 30 packets
-        if i < len(sizes):
-            if sizes[i] > 0:
-                out_count = out_count + 1
-            else:
-                in_count = in_count + 1
+    # handle traces having less than 30 packets
+    head = trace_of(times, sizes).outgoing[:30]
+    out_count = int(head.sum())
+    in_count = len(head) - out_count
 
     features.append(out_count)
     features.append(in_count)
 
 
 def Last30PktNum(times, sizes, features):
-    out_count = 0
-    in_count = 0
-    for i in range(1, 31):
-        # handle traces having less than 30 packets
-        if i <= len(sizes):
-            if sizes[-i] > 0:
-                out_count += 1
-            else:
-                in_count += 1
+    # handle traces having less than 30 packets
+    tail = trace_of(times, sizes).outgoing[-30:]
+    out_count = int(tail.sum())
+    in_count = len(tail) - out_count
     features.append(out_count)
     features.append(in_count)
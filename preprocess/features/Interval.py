@@ -1,64 +1,31 @@
 # inflow interval (icics, knn)
+import numpy
 from features.common import X
+from features.derived import trace_of
 
 
 def IntervalFeature(times, sizes, features, Category):
+    trace = trace_of(times, sizes)
     if Category == 'KNN':
         # a list of first 300 intervals (KNN)
         # incoming interval
-        count = 0
-        prevloc = 0
-        for i in range(0, len(sizes)):
-            if sizes[i] > 0:
-                count += 1
-                features.append(i - prevloc)
-                prevloc = i
-            if count == 300:
-                break
-        for i in range(count, 300):
-            features.append(X)
+        intervals = numpy.diff(trace.out_positions[:300], prepend=0).tolist()
+        features.extend(intervals)
+        features.extend([X] * (300 - len(intervals)))
 
         # outgoing interval
-        count = 0
-        prevloc = 0
-        for i in range(0, len(sizes)):
-            if sizes[i] < 0:
-                count += 1
-                features.append(i - prevloc)
-                prevloc = i
-            if count == 300:
-                break
-        for i in range(count, 300):
-            features.append(X)
+        intervals = numpy.diff(trace.in_positions[:300], prepend=0).tolist()
+        features.extend(intervals)
+        features.extend([X] * (300 - len(intervals)))
 
     if Category == "ICICS" or Category == "WPES11":
         MAX_INTERVAL = 300
         # Distribution of the intervals
         # incoming interval
-        count = 0
-        prevloc = 0
-        interval_freq_in = [0] * (MAX_INTERVAL + 1)
-        for i in range(0, len(sizes)):
-            if sizes[i] > 0:
-                inv = i - prevloc - 1
-                prevloc = i
-                # record the interval
-                if inv > MAX_INTERVAL:
-                    inv = MAX_INTERVAL
-                interval_freq_in[inv] += 1
+        interval_freq_in = _interval_freq(trace.out_positions, MAX_INTERVAL)
 
         # outgoing interval
-        count = 0
-        prevloc = 0
-        interval_freq_out = [0] * (MAX_INTERVAL + 1)
-        for i in range(0, len(sizes)):
-            if sizes[i] < 0:
-                inv = i - prevloc - 1
-                prevloc = i
-                # record the interval
-                if inv > MAX_INTERVAL:
-                    inv = MAX_INTERVAL
-                interval_freq_out[inv] += 1
+        interval_freq_out = _interval_freq(trace.in_positions, MAX_INTERVAL)
 
         # ICICS: no grouping
         if Category == "ICICS":
@@ -79,3 +46,13 @@ def IntervalFeature(times, sizes, features, Category):
             features.append(sum(interval_freq_out[6:9]))
             features.append(sum(interval_freq_out[9:14]))
             features.extend(interval_freq_out[14:])
+
+
+def _interval_freq(positions, max_interval):
+    # histogram of the number of packets between consecutive packets of one direction;
+    # the first interval is counted from position 0, so a packet at position 0
+    # gives an interval of -1, which (as a list index) lands in the last bucket
+    inv = numpy.diff(positions, prepend=0) - 1
+    inv = numpy.minimum(inv, max_interval)
+    inv[inv < 0] = max_interval
+    return numpy.bincount(inv, minlength=max_interval + 1).tolist()
@@ -5,23 +5,7 @@ import numpy
 from features.common import X
 
 from . import Time, PktSec
-
-
-def _extract_bursts(times, sizes):
-    """Return list of bursts; each burst is list of (t, s) for consecutive same-direction packets."""
-    if not sizes:
-        return []
-    bursts = []
-    current = [(times[0], sizes[0])]
-    for i in range(1, len(sizes)):
-        if (sizes[i] > 0) == (sizes[i - 1] > 0):
-            current.append((times[i], sizes[i]))
-        else:
-            bursts.append(current)
-            current = [(times[i], sizes[i])]
-    if current:
-        bursts.append(current)
-    return bursts
+from features.derived import trace_of, segment_stats
 
 
 def _safe_stats(vals, default=X):
@@ -38,70 +22,44 @@ def KFingerprintFeature(times, sizes, features, howlong):
     """
     Time.TimeFeature(times, sizes, features)
     PktSec.PktSecFeature(times, sizes, features, howlong)
-
-    bursts = _extract_bursts(times, sizes)
-
+    BurstTimingFeature(times, sizes, features)
+
+
+def BurstTimingFeature(times, sizes, features):
+    # bursts: runs of consecutive same-direction packets (see derived.py)
+    trace = trace_of(times, sizes)
+    starts = trace.burst_starts
+    ends = trace.burst_ends
+    delays = trace.inter_arrival
+    multi = ends - starts >= 2
+    medians, variances = segment_stats(delays, starts[multi], ends[multi] - starts[multi] - 1)
+    start_times = trace.times[starts]
+    BurstTimingStats(medians.tolist(), variances.tolist(),
+                     numpy.diff(start_times).tolist(),
+                     numpy.diff(start_times[trace.sizes[starts] < 0]).tolist(),
+                     numpy.diff(start_times[trace.sizes[starts] > 0]).tolist(),
+                     (trace.times[ends[multi] - 1] - trace.times[starts[multi]]).tolist(),
+                     features)
+
+
+def BurstTimingStats(medians, variances, first_first, in_first_first, out_first_first, durations, features):
+    """
+    burst timing features from the intra-burst delay medians and variances and the durations of the bursts
+    of two or more packets, and the delays between the starts of consecutive (incoming, outgoing) bursts
+    """
     # intra-burst delay medians (per burst)
-    medians = []
-    for burst in bursts:
-        ts = [p[0] for p in burst]
-        if len(ts) >= 2:
-            delays = [ts[i] - ts[i - 1] for i in range(1, len(ts))]
-            medians.append(numpy.median(delays))
     features.extend(_safe_stats(medians))
-
     # inter-burst delay first-first
-    if len(bursts) >= 2:
-        ts_first = [float(b[0][0]) for b in bursts]
-        ibdff = numpy.diff(ts_first).tolist()
-        features.extend(_safe_stats(ibdff))
-    else:
-        features.extend([X, X, X, X])
-
+    features.extend(_safe_stats(first_first))
     # inter-burst delay incoming first-first
-    in_bursts = [b for b in bursts if b[0][1] < 0]
-    if len(in_bursts) >= 2:
-        ts_first = [float(b[0][0]) for b in in_bursts]
-        ibdiff = numpy.diff(ts_first).tolist()
-        features.extend(_safe_stats(ibdiff))
-    else:
-        features.extend([X, X, X, X])
-
+    features.extend(_safe_stats(in_first_first))
     # inter-burst delay last-first (burst duration)
-    ibdlf = []
-    for b in bursts:
-        if len(b) >= 2:
-            ibdlf.append(float(b[-1][0]) - float(b[0][0]))
-    features.extend(_safe_stats(ibdlf))
-
+    features.extend(_safe_stats(durations))
     # inter-burst delay outgoing first-first
-    out_bursts = [b for b in bursts if b[0][1] > 0]
-    if len(out_bursts) >= 2:
-        ts_first = [float(b[0][0]) for b in out_bursts]
-        ibdoff = numpy.diff(ts_first).tolist()
-        features.extend(_safe_stats(ibdoff))
-    else:
-        features.extend([X, X, X, X])
-
+    features.extend(_safe_stats(out_first_first))
     # intra_interval (burst duration)
-    interval = []
-    for b in bursts:
-        if len(b) >= 2:
-            interval.append(float(b[-1][0]) - float(b[0][0]))
-    features.extend(_safe_stats(interval))
-
+    features.extend(_safe_stats(durations))
     # inter_inramd: differences of intraBD medians
-    if len(medians) >= 2:
-        inter_inramd = [medians[i] - medians[i - 1] for i in range(1, len(medians))]
-        features.extend(_safe_stats(inter_inramd))
-    else:
-        features.extend([X, X, X, X])
-
+    features.extend(_safe_stats([medians[i] - medians[i - 1] for i in range(1, len(medians))]))
     # intra_burst_delay variance (per burst)
-    ibdbvar = []
-    for burst in bursts:
-        ts = [p[0] for p in burst]
-        if len(ts) >= 2:
-            delays = [ts[i] - ts[i - 1] for i in range(1, len(ts))]
-            ibdbvar.append(numpy.var(delays))
-    features.extend(_safe_stats(ibdbvar))
+    features.extend(_safe_stats(variances))
@@ -1,21 +1,36 @@
-def NgramLocator(sample, Ng):
-    # locate which gram in NgramExtract
-    index = 0
-    for i in range(0, Ng):
-        if sample[i] == 1:
-            bit = 1
-        else:
-            bit = 0
-        index = index + bit * (2 ** (Ng - i - 1))
-    return index
+# n-gram features of the packet direction sequence
+# the directions of a window are packed into an integer (first packet in the highest bit) with a
+# rolling shift, so every n-gram of a trace is counted with one numpy.bincount,
+# and the counts of several n come out of one pass over the trace
+import numpy
+
+from features.derived import trace_of
+
+
+def NgramCounts(sizes, grams):
+    """
+    yield the 2 ** n bucket counts of every n in grams (ascending), outgoing packets being 1 bits
+    """
+    bits = trace_of(None, sizes).outgoing.astype(numpy.int64)
+    codes, n = bits, 1
+    for Ng in grams:
+        # extend every window by its next packet until it is Ng packets long
+        while n < Ng:
+            codes = (codes[:-1] << 1) | bits[n:]
+            n += 1
+        yield numpy.bincount(codes, minlength=2 ** Ng).tolist()
 
 
 def NgramExtract(sizes, NGRAM):
     # n-gram feature for ordering
-    counter = 0
-    buckets = [0] * (2 ** NGRAM)
-    for i in range(0, len(sizes) - NGRAM + 1):
-        index = NgramLocator(sizes[i:i + NGRAM], NGRAM)
-        buckets[index] = buckets[index] + 1
-        counter = counter + 1
-    return buckets
+    return next(NgramCounts(sizes, [NGRAM]))
+
+
+def NgramFeature(times, sizes, features, grams):
+    """
+    n-gram counts for each n in grams, in ascending order of n
+    """
+    if isinstance(grams, int):
+        grams = [grams]
+    for buckets in NgramCounts(sizes, sorted(grams)):
+        features.extend(buckets)
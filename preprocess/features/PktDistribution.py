@@ -1,19 +1,14 @@
 import numpy
+from features.derived import trace_of
 
 
 def PktDistFeature(times, sizes, features):
-    count = 0
-    temp = []
-    for i in range(0, min(len(sizes), 6000)):
-        if sizes[i] > 0:
-            count += 1
-        if i % 30 == 29:
-            features.append(count)
-            temp.append(count)
-            count = 0
-    for i in range(len(sizes) // 30, 200):
-        features.append(0)
-        temp.append(0)
+    # outgoing packets per 30-packet window, over the first 6000 packets
+    outgoing = trace_of(times, sizes).outgoing
+    windows = min(len(outgoing), 6000) // 30
+    temp = outgoing[:windows * 30].reshape(windows, 30).sum(axis=1).tolist()
+    temp.extend([0] * (200 - windows))
+    features.extend(temp)
     # std
     features.append(numpy.std(temp))
     # mean
@@ -26,9 +21,6 @@ def PktDistFeature(times, sizes, features):
     # alternative packet distribution list (k-anonymity)
     # could be considered packet distributions with larger intervals
     num_bucket = 20
-    bucket = [0] * num_bucket
-    for i in range(0, 200):
-        ib = i // (200 // num_bucket)
-        bucket[ib] = bucket[ib] + temp[i]
+    bucket = numpy.reshape(temp, (num_bucket, 200 // num_bucket)).sum(axis=1).tolist()
     features.extend(bucket)
     features.append(numpy.sum(bucket))
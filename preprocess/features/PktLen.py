@@ -1,6 +1,11 @@
+import numpy
+from features.derived import trace_of
+
+
 def PktLenFeature(times, sizes, features):
-    for i in range(-1500, 1501):
-        if i in sizes:
-            features.append(1)
-        else:
-            features.append(0)
+    # which packet lengths in [-1500, 1500] occur in the trace
+    values = trace_of(times, sizes).size_histogram[0]
+    values = values[(values >= -1500) & (values <= 1500) & (values == numpy.floor(values))]
+    present = numpy.zeros(3001, dtype=int)
+    present[(values + 1500).astype(int)] = 1
+    features.extend(present.tolist())
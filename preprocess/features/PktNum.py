@@ -1,17 +1,19 @@
+from features.derived import trace_of
+
+
 def roundArbitrary(x, base):
     return int(base * round(float(x) / base))
 
 
 # packet number features
 def PacketNumFeature(times, sizes, features):
-    total = len(times)
-    features.append(total)
-
     # count is outgoing pkt. number
-    count = 0
-    for x in sizes:
-        if x > 0:
-            count += 1
+    PacketNumCounts(len(times), trace_of(times, sizes).out_count, features)
+
+
+def PacketNumCounts(total, count, features):
+    # packet number features from the total and outgoing packet numbers
+    features.append(total)
     features.append(count)
     features.append(total - count)
 
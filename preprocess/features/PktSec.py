@@ -1,12 +1,21 @@
 import numpy
+from features.derived import trace_of
 
 
 def PktSecFeature(times, sizes, features, howlong):
-    count = [0] * howlong
-    for i in range(0, len(sizes)):
-        t = int(numpy.floor(times[i]))
-        if t < howlong:
-            count[t] = count[t] + 1
+    # packets per second, for the first howlong seconds
+    seconds = trace_of(times, sizes).seconds
+    seconds = seconds[seconds < howlong]
+    # (negative seconds count from the end, like list indices)
+    if len(seconds) and seconds.min() < -howlong:
+        raise IndexError("list index out of range")
+    seconds[seconds < 0] += howlong
+    PktSecCounts(numpy.bincount(seconds, minlength=howlong).tolist(), features)
+
+
+def PktSecCounts(count, features):
+    # packets per second features from the packet counts of the first seconds
+    howlong = len(count)
     features.extend(count)
 
     # mean, standard deviation, min, max, median
@@ -17,10 +26,8 @@ def PktSecFeature(times, sizes, features, howlong):
     features.append(numpy.median(count))
 
     # alternative: 20 buckets
+    # (howlong must be a multiple of the bucket number)
     bucket_num = 20
-    bucket = [0] * bucket_num
-    for i in range(0, howlong):
-        ib = i // (howlong // bucket_num)
-        bucket[ib] = bucket[ib] + count[i]
+    bucket = numpy.reshape(count, (bucket_num, howlong // bucket_num)).sum(axis=1).tolist()
     features.extend(bucket)
     features.append(numpy.sum(bucket))
@@ -3,12 +3,10 @@
 
 import numpy
 from features.common import X
+from features.derived import trace_of
 
 
-def interTimeStats(times):
-    res = []
-    for i in range(1, len(times)):
-        res.append(times[i] - times[i - 1])
+def interTimeStats(res):
     if len(res) == 0:
         return [X, X, X, X]
     return [numpy.max(res), numpy.mean(res), numpy.std(res), numpy.percentile(res, 75)]
@@ -23,5 +21,6 @@ def transTimeStats(times):
 
 def TikTokTimingOnlyFeature(times, sizes, features):
     """Timing only (no direction): total inter-packet time + transmission time stats."""
-    features.extend(interTimeStats(times))
-    features.extend(transTimeStats(times))
+    trace = trace_of(times, sizes)
+    features.extend(interTimeStats(trace.inter_arrival))
+    features.extend(transTimeStats(trace.times))
@@ -1,15 +1,11 @@
 import numpy
 from features.common import X
+from features.derived import trace_of
 
 
 # max, mean, std, quartile
-def interTimeStats(times):
-    res = []
-    for i in range(1, len(times)):
-        prev = times[i - 1]
-        cur = times[i]
-        res.append(cur - prev)
-
+# of the inter packet times of a trace (see derived.py)
+def interTimeStats(res):
     if len(res) == 0:
         return [X, X, X, X]
     else:
@@ -29,27 +25,19 @@ def transTimeStats(times):
 # inter packet time statistics for total, incoming, and outgoing
 # max, mean, std, third quartile
 def TimeFeature(times, sizes, features):
+    trace = trace_of(times, sizes)
     # inter packet time feature
     # total
-    features.extend(interTimeStats(times))
+    features.extend(interTimeStats(trace.inter_arrival))
     # outgoing
-    times_out = []
-    for i in range(0, len(sizes)):
-        if sizes[i] > 0:
-            times_out.append(times[i])
-    features.extend(interTimeStats(times_out))
-
+    features.extend(interTimeStats(trace.inter_arrival_out))
     # incoming
-    times_in = []
-    for i in range(0, len(sizes)):
-        if sizes[i] < 0:
-            times_in.append(times[i])
-    features.extend(interTimeStats(times_in))
+    features.extend(interTimeStats(trace.inter_arrival_in))
 
     # transmission time feature
     # total
-    features.extend(transTimeStats(times))
+    features.extend(transTimeStats(trace.times))
     # outgoing
-    features.extend(transTimeStats(times_out))
+    features.extend(transTimeStats(trace.times_out))
     # incoming
-    features.extend(transTimeStats(times_in))
+    features.extend(transTimeStats(trace.times_in))
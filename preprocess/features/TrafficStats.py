@@ -3,14 +3,36 @@
 # Input: times (list of timestamps), sizes (list of signed packet sizes)
 # Convention: positive = outgoing, negative = incoming (same as Time.py, Burst.py)
 
-import collections
 import numpy as np
 from scipy.stats import kurtosis, skew
 
+from features.derived import trace_of, run_starts, order_stats
+
 
 def _round_to_nearest(n, m):
     r = n % m
-    return n + m - r if r + r >= m else n - r
+    return np.where(r + r >= m, n + m - r, n - r)
+
+
+def _binned_lengths(trace, padded, bin_width):
+    """
+    packet length histograms (outgoing, incoming) with bin_width wide bins over [0, 2000),
+    followed by any non-empty bins above, in one bincount over the distinct packet sizes
+    """
+    values, counts = trace.size_histogram
+    lengths = np.abs(values)
+    if padded != 1:
+        lengths = -(-lengths // padded) * padded
+    bins = (_round_to_nearest(lengths, bin_width) // bin_width).astype(np.int64)
+    base = len(range(0, 2000, bin_width))
+    width = max(base, int(bins.max()) + 1 if len(bins) else 0)
+    # incoming packets are counted in the second half
+    hist = np.bincount(bins + width * (values < 0), weights=counts, minlength=2 * width).astype(np.int64)
+    histograms = []
+    for direction in (hist[:width], hist[width:]):
+        above = np.flatnonzero(direction[base:]) + base
+        histograms.append(direction[:base].tolist() + direction[above].tolist())
+    return histograms
 
 
 def TrafficStatsFeatures(times, sizes, padded=1, bin_width=5):
@@ -27,104 +49,42 @@ def TrafficStatsFeatures(times, sizes, padded=1, bin_width=5):
     Returns:
         list of feature values (stats features + packet length bins)
     """
-    # Split by direction: positive = outgoing, negative = incoming
-    packetSizes = []
-    packetSizesIn = []
-    packetSizesOut = []
-    packetTimes = []
-    packetTimesIn = []
-    packetTimesOut = []
-
-    bin_dict = {}
-    bin_dict2 = {}
-    for i in range(0, 2000, bin_width):
-        bin_dict[i] = 0
-        bin_dict2[i] = 0
-
-    # Burst tracking
-    out_bursts_packets = []
-    out_burst_sizes = []
-    out_burst_times = []
-    out_current_burst = 0
-    out_current_burst_start = 0
-    out_current_burst_size = 0
-
-    in_bursts_packets = []
-    in_burst_sizes = []
-    in_burst_times = []
-    in_current_burst = 0
-    in_current_burst_start = 0
-    in_current_burst_size = 0
-
-    totalPackets = 0
-    totalPacketsIn = 0
-    totalPacketsOut = 0
-    totalBytes = 0
-    totalBytesIn = 0
-    totalBytesOut = 0
-
-    prev_ts = 0
-    for idx, (ts, s) in enumerate(zip(times, sizes)):
-        pkt_size = abs(s)
-        remainder = pkt_size % padded
-        if_remainder = 0 if remainder == 0 else 1
-        pkt_size = (pkt_size // padded + if_remainder) * padded
-
-        # Incoming (negative in sizes)
-        if s < 0:
-            totalPacketsIn += 1
-            packetSizesIn.append(pkt_size)
-            binned = _round_to_nearest(pkt_size, bin_width)
-            bin_dict2[binned] = bin_dict2.get(binned, 0) + 1
-            if prev_ts != 0:
-                ts_difference = max(0, ts - prev_ts)
-                packetTimesIn.append(ts_difference * 1000)
-
-            if out_current_burst != 0:
-                if out_current_burst > 1:
-                    out_bursts_packets.append(out_current_burst)
-                    out_burst_sizes.append(out_current_burst_size)
-                    out_burst_times.append(ts - out_current_burst_start)
-                out_current_burst = 0
-                out_current_burst_size = 0
-                out_current_burst_start = 0
-            if in_current_burst == 0:
-                in_current_burst_start = ts
-            in_current_burst += 1
-            in_current_burst_size += pkt_size
-            totalBytesIn += pkt_size
-
-        # Outgoing (positive in sizes)
-        else:
-            totalPacketsOut += 1
-            packetSizesOut.append(pkt_size)
-            binned = _round_to_nearest(pkt_size, bin_width)
-            bin_dict[binned] = bin_dict.get(binned, 0) + 1
-            if prev_ts != 0:
-                ts_difference = max(0, ts - prev_ts)
-                packetTimesOut.append(ts_difference * 1000)
-            if out_current_burst == 0:
-                out_current_burst_start = ts
-            out_current_burst += 1
-            out_current_burst_size += pkt_size
-
-            if in_current_burst != 0:
-                if in_current_burst > 1:
-                    in_bursts_packets.append(in_current_burst)
-                    in_burst_sizes.append(in_current_burst_size)
-                    in_burst_times.append(ts - in_current_burst_start)
-                in_current_burst = 0
-                in_current_burst_size = 0
-                in_current_burst_start = 0
-            totalBytesOut += pkt_size
-
-        totalPackets += 1
-        totalBytes += pkt_size
-        packetSizes.append(pkt_size)
-        if prev_ts != 0:
-            ts_difference = max(0, ts - prev_ts)
-            packetTimes.append(ts_difference * 1000)
-        prev_ts = ts
+    # Split by direction: negative = incoming, everything else = outgoing
+    trace = trace_of(times, sizes)
+    incoming = trace.incoming
+    outgoing = ~incoming
+
+    # packet sizes, rounded up to the padding
+    packetSizes = trace.abs_sizes
+    if padded != 1:
+        packetSizes = -(-packetSizes // padded) * padded
+    packetSizesIn = packetSizes[incoming]
+    packetSizesOut = packetSizes[outgoing]
+
+    # binned packet lengths per direction, from the trace's size histogram
+    bin_list, bin_list2 = _binned_lengths(trace, padded, bin_width)
+
+    # inter packet times in ms, clipped at 0
+    # a packet following one sent at time 0 has no inter packet time
+    gaps = np.maximum(trace.inter_arrival, 0) * 1000
+    timed = trace.times[:-1] != 0
+    packetTimes = gaps[timed]
+    packetTimesIn = gaps[timed & incoming[1:]]
+    packetTimesOut = gaps[timed & outgoing[1:]]
+
+    # outgoing bursts of more than one packet, which ended with an incoming packet
+    starts = trace.burst_starts if trace.zero_count == 0 else run_starts(outgoing)
+    ends = np.append(starts[1:], len(packetSizes))[:len(starts)]
+    ended = (ends < len(packetSizes)) & outgoing[starts] & (ends - starts > 1)
+    out_bursts_packets = (ends - starts)[ended]
+    out_burst_sizes = np.add.reduceat(packetSizes, starts)[ended] if len(starts) else starts
+
+    totalPackets = len(packetSizes)
+    totalPacketsIn = trace.in_count
+    totalPacketsOut = totalPackets - totalPacketsIn
+    totalBytes = int(np.sum(packetSizes))
+    totalBytesIn = int(np.sum(packetSizesIn))
+    totalBytesOut = totalBytes - totalBytesIn
 
     def _safe_kurtosis(vals):
         if len(vals) < 4:
@@ -139,48 +99,27 @@ def TrafficStatsFeatures(times, sizes, padded=1, bin_width=5):
         return 0.0 if np.isnan(s) else s
 
     def _stats(vals, defaults):
-        if vals:
+        # order statistics all come from one sort (see derived.py)
+        if len(vals):
+            minimum, maximum, median, percentiles = order_stats(vals)
             return (
-                np.mean(vals), np.median(vals), np.std(vals), np.var(vals),
-                _safe_kurtosis(vals), _safe_skew(vals), np.amax(vals), np.amin(vals),
-                np.percentile(vals, 10), np.percentile(vals, 20),
-                np.percentile(vals, 30), np.percentile(vals, 40),
-                np.percentile(vals, 50), np.percentile(vals, 60),
-                np.percentile(vals, 70), np.percentile(vals, 80),
-                np.percentile(vals, 90)
-            )
+                np.mean(vals), median, np.std(vals), np.var(vals),
+                _safe_kurtosis(vals), _safe_skew(vals), maximum, minimum
+            ) + tuple(percentiles)
         return defaults
 
     def _burst_stats(packets, sizes):
-        if packets:
+        if len(packets):
+            minimum, maximum, median, percentiles = order_stats(packets)
             return (
-                len(packets), np.mean(packets), np.median(packets),
-                np.std(packets), np.var(packets), np.amax(packets),
-                _safe_kurtosis(packets), _safe_skew(packets),
-                np.percentile(packets, 10), np.percentile(packets, 20),
-                np.percentile(packets, 30), np.percentile(packets, 40),
-                np.percentile(packets, 50), np.percentile(packets, 60),
-                np.percentile(packets, 70), np.percentile(packets, 80),
-                np.percentile(packets, 90)
-            )
+                len(packets), np.mean(packets), median,
+                np.std(packets), np.var(packets), maximum,
+                _safe_kurtosis(packets), _safe_skew(packets)
+            ) + tuple(percentiles)
         return (0,) * 17
 
     out_burst_stats = _burst_stats(out_bursts_packets, out_burst_sizes)
-
-    def _burst_bytes_stats(sizes):
-        if sizes:
-            return (
-                np.mean(sizes), np.median(sizes), np.std(sizes), np.var(sizes),
-                _safe_kurtosis(sizes), _safe_skew(sizes), np.amax(sizes), np.amin(sizes),
-                np.percentile(sizes, 10), np.percentile(sizes, 20),
-                np.percentile(sizes, 30), np.percentile(sizes, 40),
-                np.percentile(sizes, 50), np.percentile(sizes, 60),
-                np.percentile(sizes, 70), np.percentile(sizes, 80),
-                np.percentile(sizes, 90)
-            )
-        return (0,) * 17
-
-    out_burst_bytes = _burst_bytes_stats(out_burst_sizes)
+    out_burst_bytes = _stats(out_burst_sizes, (0,) * 17)
 
     defaults = (0,) * 17
     (meanPacketSizes, medianPacketSizes, stdevPacketSizes, variancePacketSizes,
@@ -245,10 +184,6 @@ def TrafficStatsFeatures(times, sizes, padded=1, bin_width=5):
     features.extend(out_burst_bytes)
 
     # Packet length bins (pkt_len)
-    od_dict = collections.OrderedDict(sorted(bin_dict.items(), key=lambda t: float(t[0])))
-    bin_list = [od_dict[k] for k in od_dict]
-    od_dict2 = collections.OrderedDict(sorted(bin_dict2.items(), key=lambda t: float(t[0])))
-    bin_list2 = [od_dict2[k] for k in od_dict2]
     features.extend(bin_list)
     features.extend(bin_list2)
 
@@ -0,0 +1,262 @@
+# derived quantities of a trace shared by the feature blocks
+# direction masks, per-direction times, inter-arrival times, burst boundaries and cumulative sums
+# are computed on first use and then reused by every block extracting the same trace within one extraction
+# (see shared), including blocks nested in attack blocks (e.g. Time under RF, DF-Tok, Tik-Tok and k-FP).
+# histograms and order statistics come from one bincount / sort per array.
+# a prefix of a trace (Trace.prefix) slices its cumulative quantities out of those of the whole trace
+import threading
+from contextlib import contextmanager
+
+import numpy
+
+# percentiles reported by the statistics blocks
+PERCENTILES = [10, 20, 30, 40, 50, 60, 70, 80, 90]
+
+
+class lazy(object):
+    """
+    Attribute computed on first access and then stored on the instance
+    """
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.func.__name__] = self.func(obj)
+        return value
+
+
+def order_stats(values):
+    """
+    minimum, maximum, median and PERCENTILES of a non-empty array, all from one sort
+    the values equal those of numpy.amin, numpy.amax, numpy.median and numpy.percentile
+    """
+    ordered = numpy.sort(values)
+    mid = len(ordered) // 2
+    # numpy.median averages the middle element(s)
+    median = numpy.mean(ordered[mid - 1:mid + 1] if len(ordered) % 2 == 0 else ordered[mid:mid + 1])
+    return ordered[0], ordered[-1], median, numpy.percentile(ordered, PERCENTILES)
+
+
+def segment_stats(values, starts, lengths):
+    """
+    median and variance of the segments values[start:start + length] of an array
+    segments of equal length are reduced together, row by row, which gives the same values as
+    reducing each segment on its own
+    """
+    medians = numpy.empty(len(starts))
+    variances = numpy.empty(len(starts))
+    for length in numpy.unique(lengths):
+        group = numpy.flatnonzero(lengths == length)
+        rows = values[starts[group, None] + numpy.arange(length)]
+        medians[group] = numpy.median(rows, axis=1)
+        variances[group] = numpy.var(rows, axis=1)
+    return medians, variances
+
+
+def run_starts(mask):
+    """
+    start indices of the runs of equal values in a boolean array
+    """
+    if len(mask) == 0:
+        return numpy.zeros(0, dtype=numpy.intp)
+    return numpy.concatenate(([0], numpy.flatnonzero(mask[1:] != mask[:-1]) + 1))
+
+
+class Trace(object):
+    """
+    Lazily derived quantities of one trace
+    positive sizes are outgoing packets, negative sizes incoming ones
+    """
+    def __init__(self, times, sizes):
+        self.source = (times, sizes)
+
+    @lazy
+    def times(self):
+        return numpy.asarray(self.source[0])
+
+    @lazy
+    def sizes(self):
+        return numpy.asarray(self.source[1])
+
+    @lazy
+    def outgoing(self):
+        return self.sizes > 0
+
+    @lazy
+    def incoming(self):
+        return self.sizes < 0
+
+    @lazy
+    def out_count(self):
+        return int(numpy.count_nonzero(self.outgoing))
+
+    @lazy
+    def in_count(self):
+        return int(numpy.count_nonzero(self.incoming))
+
+    @lazy
+    def zero_count(self):
+        return len(self.sizes) - self.out_count - self.in_count
+
+    @lazy
+    def out_positions(self):
+        """
+        indices of the outgoing packets
+        """
+        return numpy.flatnonzero(self.outgoing)
+
+    @lazy
+    def in_positions(self):
+        """
+        indices of the incoming packets
+        """
+        return numpy.flatnonzero(self.incoming)
+
+    @lazy
+    def seconds(self):
+        """
+        second of every packet (floor of its time)
+        """
+        return numpy.floor(self.times).astype(numpy.int64)
+
+    @lazy
+    def times_out(self):
+        return self.times[self.outgoing]
+
+    @lazy
+    def times_in(self):
+        return self.times[self.incoming]
+
+    @lazy
+    def inter_arrival(self):
+        return numpy.diff(self.times)
+
+    @lazy
+    def inter_arrival_out(self):
+        return numpy.diff(self.times_out)
+
+    @lazy
+    def inter_arrival_in(self):
+        return numpy.diff(self.times_in)
+
+    @lazy
+    def size_histogram(self):
+        """
+        distinct packet sizes and their counts
+        """
+        sizes = self.sizes
+        if len(sizes) and numpy.issubdtype(sizes.dtype, numpy.integer):
+            low = sizes.min()
+            counts = numpy.bincount(sizes.astype(numpy.int64) - low)
+            values = numpy.flatnonzero(counts)
+            return values + low, counts[values]
+        return numpy.unique(sizes, return_counts=True)
+
+    @lazy
+    def burst_starts(self):
+        """
+        start indices of the bursts, i.e. runs of outgoing or non-outgoing packets
+        """
+        return run_starts(self.outgoing)
+
+    @lazy
+    def burst_ends(self):
+        """
+        end indices (exclusive) of the bursts
+        """
+        return numpy.append(self.burst_starts[1:], len(self.sizes))[:len(self.burst_starts)]
+
+    @lazy
+    def abs_sizes(self):
+        return numpy.abs(self.sizes)
+
+    @lazy
+    def abs_cumsum(self):
+        """
+        cumulative transmitted bytes
+        """
+        return numpy.cumsum(self.abs_sizes)
+
+    @lazy
+    def out_cumsum(self):
+        """
+        cumulative outgoing bytes
+        """
+        return numpy.cumsum(numpy.where(self.outgoing, self.sizes, 0))
+
+    @lazy
+    def in_cumsum(self):
+        """
+        cumulative incoming bytes
+        """
+        return numpy.cumsum(numpy.where(self.incoming, -self.sizes, 0))
+
+    @lazy
+    def out_seen(self):
+        """
+        number of outgoing packets up to and including every packet
+        """
+        return numpy.cumsum(self.outgoing)
+
+    @lazy
+    def in_seen(self):
+        """
+        number of incoming packets up to and including every packet
+        """
+        return numpy.cumsum(self.incoming)
+
+    def prefix(self, k, times, sizes):
+        """
+        derived quantities of the first k packets, given as times and sizes lists,
+        sliced out of the cumulative quantities of this trace
+        """
+        part = Trace(times, sizes)
+        state = part.__dict__
+        out_k = int(self.out_seen[k - 1]) if k else 0
+        in_k = int(self.in_seen[k - 1]) if k else 0
+        for name in ('outgoing', 'incoming', 'seconds', 'abs_sizes', 'abs_cumsum', 'out_cumsum', 'in_cumsum',
+                     'out_seen', 'in_seen'):
+            state[name] = getattr(self, name)[:k]
+        state['inter_arrival'] = self.inter_arrival[:max(k - 1, 0)]
+        state['out_count'], state['in_count'] = out_k, in_k
+        state['zero_count'] = k - out_k - in_k
+        state['out_positions'], state['times_out'] = self.out_positions[:out_k], self.times_out[:out_k]
+        state['in_positions'], state['times_in'] = self.in_positions[:in_k], self.times_in[:in_k]
+        state['inter_arrival_out'] = self.inter_arrival_out[:max(out_k - 1, 0)]
+        state['inter_arrival_in'] = self.inter_arrival_in[:max(in_k - 1, 0)]
+        state['burst_starts'] = self.burst_starts[:numpy.searchsorted(self.burst_starts, k)]
+        return part
+
+
+# the trace shared by the blocks of the extraction in progress in this thread (see shared)
+_scope = threading.local()
+
+
+def trace_of(times, sizes):
+    """
+    derived quantities of the trace given by times and sizes
+    within shared(trace), blocks extracting the trace's own times and sizes lists get that trace;
+    otherwise the quantities are derived afresh, so lists modified in place are never served stale values.
+    times may be None for blocks which only look at packet sizes
+    """
+    trace = getattr(_scope, 'trace', None)
+    if trace is not None and trace.source[1] is sizes and (times is None or trace.source[0] is times):
+        return trace
+    return Trace(times, sizes)
+
+
+@contextmanager
+def shared(trace):
+    """
+    context in which the blocks extracting the (times, sizes) lists of trace share its derived quantities
+    yields the times and sizes lists
+    """
+    previous = getattr(_scope, 'trace', None)
+    _scope.trace = trace
+    try:
+        yield trace.source
+    finally:
+        _scope.trace = previous
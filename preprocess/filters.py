@@ -0,0 +1,61 @@
+# trace filters applied before feature extraction
+# traces which are empty or shorter than util.MIN_PACKETS, and with util.REMOVE_OUTLIERS the per-site
+# outliers by packet count (outside [Q1 - k * IQR, Q3 + k * IQR], k = util.OUTLIER_IQR, as in the CUMUL paper),
+# are dropped before any feature block runs on them
+import numpy as np
+
+import util
+
+
+def short_traces(counts, min_packets=None):
+    """
+    mask of the traces with fewer than min_packets (util.MIN_PACKETS if None) packets
+    empty traces are always short
+    """
+    if min_packets is None:
+        min_packets = util.MIN_PACKETS
+    counts = np.asarray(counts)
+    return counts < max(min_packets, 1)
+
+
+def site_outliers(sites, counts, k=None):
+    """
+    mask of the traces whose packet count lies outside [Q1 - k * IQR, Q3 + k * IQR] of their site
+    k is util.OUTLIER_IQR if None
+    """
+    if k is None:
+        k = util.OUTLIER_IQR
+    sites = np.asarray(sites)
+    counts = np.asarray(counts, dtype=np.float64)
+    outliers = np.zeros(len(counts), dtype=bool)
+    if len(counts) == 0:
+        return outliers
+    # sort by (site, count) so that every site is one sorted segment
+    order = np.lexsort((counts, sites))
+    ordered_sites = sites[order]
+    bounds = np.flatnonzero(np.r_[True, ordered_sites[1:] != ordered_sites[:-1], True])
+    ordered = counts[order]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        segment = ordered[start:end]
+        q1, q3 = np.percentile(segment, [25, 75])
+        # the segment is sorted: the inliers are one contiguous run
+        a = np.searchsorted(segment, q1 - k * (q3 - q1), side='left')
+        b = np.searchsorted(segment, q3 + k * (q3 - q1), side='right')
+        outliers[order[start:start + a]] = True
+        outliers[order[start + b:end]] = True
+    return outliers
+
+
+def keep_traces(sites, counts, min_packets=None, remove_outliers=None, k=None):
+    """
+    mask of the traces which pass the configured filters
+    outliers are computed among the traces which are long enough
+    """
+    if remove_outliers is None:
+        remove_outliers = util.REMOVE_OUTLIERS
+    keep = ~short_traces(counts, min_packets)
+    if remove_outliers:
+        sites = np.asarray(sites)[keep]
+        kept = np.flatnonzero(keep)
+        keep[kept[site_outliers(sites, np.asarray(counts)[keep], k)]] = False
+    return keep
@@ -0,0 +1,106 @@
+# extraction manifest
+# records, per trace, where it was read from, its size, its mtime (or content hash)
+# and the hash of the util.py feature settings it was extracted with,
+# so that re-running extract.py only processes new or changed traces
+import os
+import json
+import hashlib
+
+import util
+import traces
+import trace_store
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def feature_config():
+    """
+    collect the active util.py feature flags and parameters
+    """
+    return {name: value for name, value in sorted(vars(util).items())
+            if not name.startswith('_') and isinstance(value, (bool, int, float, str, list, tuple))}
+
+
+def config_hash():
+    """
+    hash of the active util.py feature flags and parameters
+    """
+    return hashlib.sha1(json.dumps(feature_config(), sort_keys=True).encode()).hexdigest()
+
+
+def trace_entry(source, content_hash=False, stat=None):
+    """
+    describe the current state of a trace source
+    source is a trace file path, a (store path, trace index) pair or an archive member
+    stat is the (size, mtime) of a trace file if already known, e.g. from the trace catalog
+    """
+    if isinstance(source, traces.ArchiveMember):
+        entry = {'path': os.path.join(os.path.abspath(source.archive), source.name),
+                 'size': len(source.data), 'mtime': source.mtime}
+        if content_hash:
+            entry['hash'] = hashlib.sha1(source.data).hexdigest()
+        return entry
+
+    if isinstance(source, tuple):
+        store_path, i = source
+        store = trace_store.open_store(store_path)
+        path = os.path.join(os.path.abspath(store_path), str(store.names[i]))
+        entry = {'path': path,
+                 'size': int(store.offsets[i + 1] - store.offsets[i]),
+                 'mtime': os.stat(os.path.join(store_path, trace_store.STORE_META)).st_mtime_ns}
+        if content_hash:
+            times, sizes = store[i]
+            entry['hash'] = hashlib.sha1(times.tobytes() + sizes.tobytes()).hexdigest()
+        return entry
+
+    if stat is None:
+        stat = os.stat(source)
+        stat = stat.st_size, stat.st_mtime_ns
+    entry = {'path': os.path.abspath(source), 'size': stat[0], 'mtime': stat[1]}
+    if content_hash:
+        with open(source, 'rb') as f:
+            entry['hash'] = hashlib.sha1(f.read()).hexdigest()
+    return entry
+
+
+class Manifest(object):
+    """
+    Per-trace extraction records of an output directory
+    """
+    def __init__(self, out_path):
+        self.path = os.path.join(out_path, MANIFEST_FILE)
+        self.config = config_hash()
+        self.traces = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as fd:
+                self.traces = json.load(fd)['traces']
+
+    def is_current(self, entry):
+        """
+        check whether a trace was already extracted in this state and with the active feature settings
+        """
+        old = self.traces.get(entry['path'])
+        if old is None or old['config'] != self.config:
+            return False
+        return all(old.get(key) == value for key, value in entry.items())
+
+    def update(self, entry):
+        """
+        record that a trace has been extracted
+        """
+        record = dict(entry)
+        record['config'] = self.config
+        self.traces[entry['path']] = record
+
+    def retain(self, entries):
+        """
+        forget traces which are no longer part of the dataset
+        """
+        paths = set(entry['path'] for entry in entries)
+        self.traces = {path: record for path, record in self.traces.items() if path in paths}
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fd:
+            json.dump({'config': self.config, 'traces': self.traces}, fd)
+        os.replace(tmp, self.path)
@@ -0,0 +1,214 @@
+# online feature extraction for live traffic
+# an OnlineTrace takes the packets of a connection in progress one at a time (or in small batches)
+# and keeps O(1)-updatable state for the feature blocks which allow it: packet numbers (PktNum),
+# unique packet lengths (PktLen), cumulated sizes (Cumul), packets per second (PktSec), bursts (Burst),
+# the first packets (First20) and the k-FP burst timing statistics (KFingerprint), kept per closed burst.
+# snapshot() returns the features of the packets seen so far in the layout of extract.extract().
+# the timing statistics (Time) are extracted once per snapshot from the packets seen so far and shared by
+# k-FP, DF-Tok and RF; blocks without online state (Tik-Tok, packet distributions, intervals) are extracted
+# from the packets seen so far
+import numpy as np
+
+import util
+import extract
+from features import Burst, Cumul, HeadTail, KFingerprint, PktNum, PktSec, Time, derived
+
+
+class OnlineTrace(object):
+    """
+    Incrementally updated feature state of a trace in progress
+    """
+    def __init__(self):
+        self.times, self.sizes = [], []
+        self.out_count = 0
+        self.in_count = 0
+        # unique packet lengths in [-1500, 1500]
+        self.lengths = np.zeros(3001, dtype=int)
+        # packets per second of the first util.howlong seconds
+        self.seconds = [0] * util.howlong
+        self.too_early = False
+        # cumulated sizes over the non-empty packets
+        self.total, self.pos, self.neg = 0, 0, 0
+        self.total_sums, self.pos_sums, self.neg_sums = [], [], []
+        # bursts: outgoing bytes since the last burst ended, length of the current incoming run
+        self.pending, self.in_run = 0, 0
+        self.burst_count, self.burst_max, self.burst_total = 0, 0, 0
+        self.burst_counts = [0, 0, 0]
+        self.burst_head = []
+        # k-FP bursts (runs of outgoing / other packets): start of the open burst, start times of the last
+        # (incoming, outgoing) bursts, and the statistics of the closed bursts
+        self.kfp_start = 0
+        self.kfp_last = [None, None, None]
+        self.kfp_first_first, self.kfp_in_first_first, self.kfp_out_first_first = [], [], []
+        self.kfp_medians, self.kfp_variances, self.kfp_durations = [], [], []
+        # timing features of the last snapshot and its packet count
+        self.time_features = (None, [])
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def add(self, time, size):
+        """
+        account for the next packet of the trace
+        """
+        n = len(self.sizes)
+        self.times.append(time)
+        self.sizes.append(size)
+        if size > 0:
+            self.out_count += 1
+        elif size < 0:
+            self.in_count += 1
+        if -1500 <= size <= 1500 and size == int(size):
+            self.lengths[int(size) + 1500] = 1
+
+        second = int(np.floor(time))
+        if second < -util.howlong:
+            self.too_early = True
+        elif second < util.howlong:
+            # (negative seconds count from the end, like list indices)
+            self.seconds[second] += 1
+
+        if size != 0:
+            self.total += abs(size)
+            if size > 0:
+                self.neg += size
+            else:
+                self.pos -= size
+            self.total_sums.append(self.total)
+            self.pos_sums.append(self.pos)
+            self.neg_sums.append(self.neg)
+
+            # a burst sums the outgoing packets up to two consecutive incoming ones
+            if size > 0:
+                self.pending += size
+                self.in_run = 0
+            else:
+                self.in_run += 1
+                if self.in_run == 2:
+                    self._end_burst()
+
+        if n == 0 or (size > 0) != (self.sizes[n - 1] > 0):
+            if n:
+                self._end_kfp_burst(n)
+            self._start_kfp_burst(n, time, size)
+
+    def _end_burst(self):
+        burst, self.pending = self.pending, 0
+        if burst == 0:
+            return
+        self.burst_max = burst if self.burst_count == 0 else max(self.burst_max, burst)
+        self.burst_count += 1
+        self.burst_total += burst
+        for i, threshold in enumerate((5, 10, 15)):
+            if burst > threshold:
+                self.burst_counts[i] += 1
+        if len(self.burst_head) < 5:
+            self.burst_head.append(burst)
+
+    def _start_kfp_burst(self, n, time, size):
+        self.kfp_start = n
+        for i, (gaps, starts) in enumerate(((self.kfp_first_first, True), (self.kfp_in_first_first, size < 0),
+                                            (self.kfp_out_first_first, size > 0))):
+            if not starts:
+                continue
+            if self.kfp_last[i] is not None:
+                gaps.append(time - self.kfp_last[i])
+            self.kfp_last[i] = time
+
+    def _kfp_burst_stats(self, end):
+        # median and variance of the delays and duration of the burst [kfp_start, end), None if a single packet
+        if end - self.kfp_start < 2:
+            return None
+        delays = np.diff(np.asarray(self.times[self.kfp_start:end]))
+        return np.median(delays), np.var(delays), self.times[end - 1] - self.times[self.kfp_start]
+
+    def _end_kfp_burst(self, end):
+        stats = self._kfp_burst_stats(end)
+        if stats is not None:
+            self.kfp_medians.append(stats[0])
+            self.kfp_variances.append(stats[1])
+            self.kfp_durations.append(stats[2])
+
+    def extend(self, times, sizes):
+        """
+        account for the next packets of the trace
+        """
+        for time, size in zip(times, sizes):
+            self.add(time, size)
+
+    # feature blocks from the online state, as extracted from the packets seen so far
+
+    def packet_number(self, features):
+        PktNum.PacketNumCounts(len(self.sizes), self.out_count, features)
+
+    def packet_length(self, features):
+        features.extend(self.lengths.tolist())
+
+    def first20(self, features):
+        HeadTail.First20(None, self.sizes[:20], features)
+
+    def burst(self, features):
+        Burst.BurstSummary(self.burst_count, self.burst_max, self.burst_total, self.burst_counts,
+                           self.burst_head, features)
+
+    def cumul(self, features):
+        features.extend(Cumul.CumulFromSums(np.asarray(self.total_sums), np.asarray(self.pos_sums),
+                                            np.asarray(self.neg_sums), self.in_count, self.out_count,
+                                            util.featureCount))
+
+    def packets_per_second(self, features):
+        if self.too_early:
+            raise IndexError("list index out of range")
+        PktSec.PktSecCounts(self.seconds, features)
+
+    def time(self, features):
+        if self.time_features[0] != len(self.sizes):
+            self.time_features = len(self.sizes), []
+            Time.TimeFeature(self.times, self.sizes, self.time_features[1])
+        features.extend(self.time_features[1])
+
+    def kfp_bursts(self, features):
+        medians, variances, durations = self.kfp_medians, self.kfp_variances, self.kfp_durations
+        stats = self._kfp_burst_stats(len(self.sizes))
+        if stats is not None:
+            medians, variances, durations = medians + [stats[0]], variances + [stats[1]], durations + [stats[2]]
+        KFingerprint.BurstTimingStats(medians, variances, self.kfp_first_first, self.kfp_in_first_first,
+                                      self.kfp_out_first_first, durations, features)
+
+    def snapshot(self, blocks=None):
+        """
+        features of the packets seen so far, in the layout of extract.extract()
+        blocks lists the feature blocks to extract (all enabled blocks if None)
+        """
+        if blocks is None:
+            blocks = extract.enabled_blocks()
+        features = []
+        # the blocks of a snapshot share the derived quantities of the packets seen so far
+        with derived.shared(derived.Trace(self.times, self.sizes)):
+            for name, _, handler, _ in extract.FEATURE_BLOCKS:
+                if name not in blocks:
+                    continue
+                for part in ONLINE_BLOCKS.get(name, [handler]):
+                    if isinstance(part, str):
+                        getattr(self, part)(features)
+                    else:
+                        part(self.times, self.sizes, features)
+        return features
+
+
+# feature blocks with online state: the parts making up the block, in output order,
+# either OnlineTrace methods or feature blocks run on the packets seen so far
+ONLINE_BLOCKS = {
+    'PACKET_NUMBER': ['packet_number'],
+    'PKT_TIME': ['time'],
+    'UNIQUE_PACKET_LENGTH': ['packet_length'],
+    'BURST': ['burst'],
+    'FIRST20': ['first20'],
+    'CUMUL': ['cumul'],
+    'CUMUL_ATTACK': ['cumul'],
+    'KNN_ATTACK': ['first20', 'burst', extract.PktDistribution.PktDistFeature, extract._interval_knn],
+    'KFINGERPRINT': ['time', 'packets_per_second', 'kfp_bursts'],
+    'DF_ATTACK': ['packet_number', 'packet_length'],
+    'DFTOK_ATTACK': ['packet_number', 'packet_length', 'time'],
+    'RF_ATTACK': ['packet_number', 'time'],
+}
@@ -0,0 +1,308 @@
+# pure-python pcap / pcapng reader
+# turns raw packet captures into traces of (times, signed sizes), one per TCP/UDP connection,
+# so that captures can be extracted without converting them to Wang-format files first.
+# packets sent by the client endpoint of a connection are positive (outgoing), the rest negative.
+# sizes are IP packet lengths, times are seconds since the first packet of the connection.
+import os
+import struct
+import socket
+
+PCAP_MAGIC = {b'\xd4\xc3\xb2\xa1': ('<', 1e-6), b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+              b'\x4d\x3c\xb2\xa1': ('<', 1e-9), b'\xa1\xb2\x3c\x4d': ('>', 1e-9)}
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+CAPTURE_EXTENSIONS = ('.pcap', '.pcapng')
+
+# link-layer header types
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 14, 101)
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+# IPv6 extension headers skipped on the way to the transport header
+IPV6_EXTENSIONS = (0, 43, 60)
+IPV6_FRAGMENT = 44
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+
+def is_capture(name):
+    """
+    check whether a (possibly compressed) file name is a packet capture
+    """
+    name = os.path.basename(name)
+    if '.' not in name:
+        return False
+    return '.' + name.split('.')[1] in CAPTURE_EXTENSIONS
+
+
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) < n:
+        return None
+    return data
+
+
+def _pcap_packets(f, magic):
+    """
+    yield (timestamp, link type, frame) for the records of a classic pcap file
+    """
+    order, resolution = PCAP_MAGIC[magic]
+    header = _read_exact(f, 20)
+    if header is None:
+        return
+    linktype = struct.unpack(order + 'HHiIII', header)[5] & 0xFFFF
+    record = struct.Struct(order + 'IIII')
+    while True:
+        data = _read_exact(f, 16)
+        if data is None:
+            return
+        seconds, fraction, captured, _ = record.unpack(data)
+        frame = _read_exact(f, captured)
+        if frame is None:
+            return
+        yield seconds + fraction * resolution, linktype, frame
+
+
+def _tsresol(options, order):
+    """
+    timestamp resolution of an interface from its description block options
+    """
+    pos = 0
+    while pos + 4 <= len(options):
+        code, length = struct.unpack_from(order + 'HH', options, pos)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = options[pos + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        pos += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def _pcapng_packets(f, first):
+    """
+    yield (timestamp, link type, frame) for the packet blocks of a pcapng file
+    """
+    order = '<'
+    interfaces = []
+    head = first
+    while head is not None:
+        block_type = struct.unpack(order + 'I', head[:4])[0]
+        if block_type == PCAPNG_SHB:
+            # every section starts with its own byte order and interface list
+            rest = _read_exact(f, 8)
+            if rest is None:
+                return
+            order = '<' if struct.unpack('<I', rest[4:])[0] == PCAPNG_BYTE_ORDER else '>'
+            length = struct.unpack(order + 'I', rest[:4])[0]
+            if length < 12:
+                raise ValueError("corrupt pcapng block")
+            body = _read_exact(f, length - 12)
+            interfaces = []
+        else:
+            rest = _read_exact(f, 4)
+            if rest is None:
+                return
+            length = struct.unpack(order + 'I', rest)[0]
+            if length < 12:
+                raise ValueError("corrupt pcapng block")
+            body = _read_exact(f, length - 8)
+        if body is None:
+            return
+
+        if block_type == 1:
+            # interface description block
+            linktype = struct.unpack_from(order + 'H', body)[0]
+            interfaces.append((linktype, _tsresol(body[8:-4], order)))
+        elif block_type in (2, 6):
+            # (obsolete) enhanced packet block
+            if block_type == 6:
+                interface, high, low, captured = struct.unpack_from(order + 'IIII', body)
+            else:
+                interface, _, high, low, captured = struct.unpack_from(order + 'HHIII', body)
+            if interface < len(interfaces):
+                linktype, resolution = interfaces[interface]
+                yield ((high << 32) | low) * resolution, linktype, body[20:20 + captured]
+        head = _read_exact(f, 4)
+
+
+def _checked(packets):
+    # records too short for their own fields make struct fail: report them as a corrupt capture
+    try:
+        for packet in packets:
+            yield packet
+    except struct.error as e:
+        raise ValueError("corrupt capture: {}".format(e))
+
+
+def iter_packets(f):
+    """
+    stream (timestamp, link type, frame) tuples from a binary pcap or pcapng file object
+    truncated captures end with their last complete record; corrupt ones raise ValueError
+    """
+    magic = _read_exact(f, 4)
+    if magic is None:
+        return iter(())
+    if magic in PCAP_MAGIC:
+        return _checked(_pcap_packets(f, magic))
+    if struct.unpack('<I', magic)[0] == PCAPNG_SHB:
+        return _checked(_pcapng_packets(f, magic))
+    raise ValueError("not a pcap or pcapng capture")
+
+
+def _network_header(linktype, frame):
+    """
+    offset of the IP header within a frame, or None for non-IP frames
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 14
+        ethertype = struct.unpack_from('>H', frame, 12)[0] if len(frame) >= 14 else None
+        while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 4:
+            ethertype = struct.unpack_from('>H', frame, offset + 2)[0]
+            offset += 4
+        return offset if ethertype in (ETHERTYPE_IPV4, ETHERTYPE_IPV6) else None
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16:
+            return None
+        return 16 if struct.unpack_from('>H', frame, 14)[0] in (ETHERTYPE_IPV4, ETHERTYPE_IPV6) else None
+    if linktype == LINKTYPE_LINUX_SLL2:
+        if len(frame) < 20:
+            return None
+        return 20 if struct.unpack_from('>H', frame, 0)[0] in (ETHERTYPE_IPV4, ETHERTYPE_IPV6) else None
+    if linktype == LINKTYPE_NULL:
+        return 4
+    if linktype in LINKTYPE_RAW or linktype in (LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return 0
+    return None
+
+
+def parse_frame(linktype, frame):
+    """
+    parse a captured frame into (protocol, source, source port, destination, destination port, IP length, TCP flags)
+    returns None for frames which are not TCP/UDP over IP, or are not the first fragment of a packet
+    """
+    offset = _network_header(linktype, frame)
+    if offset is None or len(frame) < offset + 20:
+        return None
+    version = frame[offset] >> 4
+    if version == 4:
+        header_length = (frame[offset] & 0x0F) * 4
+        length, fragment, proto = struct.unpack_from('>H2xH1xB', frame, offset + 2)
+        if fragment & 0x1FFF:
+            return None
+        src, dst = frame[offset + 12:offset + 16], frame[offset + 16:offset + 20]
+        transport = offset + header_length
+    elif version == 6:
+        if len(frame) < offset + 40:
+            return None
+        payload, proto = struct.unpack_from('>HB', frame, offset + 4)
+        length = payload + 40
+        src, dst = frame[offset + 8:offset + 24], frame[offset + 24:offset + 40]
+        transport = offset + 40
+        while proto in IPV6_EXTENSIONS and len(frame) >= transport + 2:
+            proto, ext_length = frame[transport], frame[transport + 1]
+            transport += (ext_length + 1) * 8
+        if proto == IPV6_FRAGMENT:
+            return None
+    else:
+        return None
+
+    if proto not in (PROTO_TCP, PROTO_UDP) or len(frame) < transport + 4:
+        return None
+    sport, dport = struct.unpack_from('>HH', frame, transport)
+    flags = 0
+    if proto == PROTO_TCP:
+        if len(frame) < transport + 14:
+            return None
+        flags = frame[transport + 13]
+    return proto, src, sport, dst, dport, length, flags
+
+
+def _address(raw):
+    return socket.inet_ntop(socket.AF_INET if len(raw) == 4 else socket.AF_INET6, raw)
+
+
+class _Connection(object):
+    """
+    Packets of one connection collected so far
+    """
+    __slots__ = ('key', 'client', 'times', 'sizes', 'fins', 'start')
+
+    def __init__(self, key, client, start):
+        self.key, self.client, self.start = key, client, start
+        self.times, self.sizes = [], []
+        self.fins = set()
+
+
+def iter_connections(f, clients=None):
+    """
+    stream the connections of a binary pcap or pcapng file object
+    yields (key, times, sizes) with key = (protocol, client address, client port, server address, server port),
+    TCP connections as soon as they are closed, all others when the capture ends
+    clients optionally lists the client IP addresses; otherwise the sender of a connection's SYN
+    (or, lacking one, of its first captured packet) is the client
+    """
+    clients = set(clients or ())
+    open_connections = {}
+    # closed TCP connections, whose trailing ACKs are dropped
+    closed = set()
+    for timestamp, linktype, frame in iter_packets(f):
+        parsed = parse_frame(linktype, frame)
+        if parsed is None:
+            continue
+        proto, src, sport, dst, dport, length, flags = parsed
+        a, b = (src, sport), (dst, dport)
+        flow = (proto,) + (a + b if a < b else b + a)
+        syn = flags & (TCP_SYN | TCP_ACK) == TCP_SYN
+
+        connection = open_connections.get(flow)
+        if connection is None:
+            if flow in closed and not syn:
+                continue
+            closed.discard(flow)
+            if clients:
+                client = a if _address(src) in clients or _address(dst) not in clients else b
+            else:
+                # a SYN/ACK seen first is sent by the server
+                client = b if flags & (TCP_SYN | TCP_ACK) == TCP_SYN | TCP_ACK else a
+            server = b if client == a else a
+            key = (proto, _address(client[0]), client[1], _address(server[0]), server[1])
+            connection = open_connections[flow] = _Connection(key, client, timestamp)
+
+        connection.times.append(timestamp - connection.start)
+        connection.sizes.append(length if a == connection.client else -length)
+
+        if flags & TCP_FIN:
+            connection.fins.add(a)
+        if flags & TCP_RST or len(connection.fins) == 2:
+            del open_connections[flow]
+            closed.add(flow)
+            yield connection.key, connection.times, connection.sizes
+
+    for connection in open_connections.values():
+        yield connection.key, connection.times, connection.sizes
+
+
+def read_capture(f, clients=None):
+    """
+    read the trace of a capture from a binary file object
+    the trace is the capture's largest connection, e.g. the Tor guard connection of a page load
+    """
+    times, sizes = [], []
+    for key, conn_times, conn_sizes in iter_connections(f, clients):
+        if len(conn_times) > len(times):
+            times, sizes = conn_times, conn_sizes
+    return times, sizes
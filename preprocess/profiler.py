@@ -0,0 +1,190 @@
+# opt-in extraction profiler (extract.py --profile)
+# every process times each feature block and the parse (read, decode and normalize), defense (see defenses.py)
+# and write phases of every trace it handles; pool workers save their statistics to a dump directory when they
+# exit, and the main process merges them with its own into a JSON report with, per block and phase:
+# totals, percentiles of the time per trace (merged with sketch.QuantileSketch) and the mean time per trace
+# by trace length (packet counts binned by powers of two), with the fitted exponent of time ~ length ** k.
+# while the profiler is off, timed() is a shared no-op context and nothing is recorded
+import os
+import glob
+import json
+import pickle
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import util as mp_util
+
+import numpy as np
+
+from sketch import QuantileSketch
+
+REPORT_FILE = 'Profile.json'
+PERCENTILES = [50, 90, 99]
+
+enabled = False
+_stats = {}
+_lock = threading.Lock()
+
+
+class Stats(object):
+    """
+    Time statistics of one feature block or phase
+    """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.sketch = QuantileSketch(capacity=4096)
+        # log2 of the packet count -> [traces, seconds, packets]
+        self.scaling = {}
+
+    def add(self, seconds, packets=None):
+        """
+        account for the times of traces, with their packet counts if known
+        """
+        seconds = np.atleast_1d(np.asarray(seconds, dtype=np.float64))
+        self.count += len(seconds)
+        self.seconds += float(seconds.sum())
+        self.max = max(self.max, float(seconds.max()))
+        self.sketch.update(seconds)
+        if packets is None:
+            return
+        packets = np.atleast_1d(np.asarray(packets, dtype=np.int64))
+        buckets = np.floor(np.log2(np.maximum(packets, 1))).astype(np.int64)
+        for bucket in np.unique(buckets).tolist():
+            sel = buckets == bucket
+            entry = self.scaling.setdefault(bucket, [0, 0.0, 0])
+            entry[0] += int(sel.sum())
+            entry[1] += float(seconds[sel].sum())
+            entry[2] += int(packets[sel].sum())
+
+    def merge(self, other):
+        self.count += other.count
+        self.seconds += other.seconds
+        self.max = max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+        for bucket, (count, seconds, packets) in other.scaling.items():
+            entry = self.scaling.setdefault(bucket, [0, 0.0, 0])
+            entry[0] += count
+            entry[1] += seconds
+            entry[2] += packets
+
+    def summary(self):
+        """
+        report entry of the statistics
+        """
+        summary = OrderedDict([('traces', self.count), ('seconds', self.seconds),
+                               ('mean', self.seconds / self.count if self.count else 0.0)])
+        if self.count:
+            summary['percentiles'] = OrderedDict((str(q), float(value)) for q, value in
+                                                 zip(PERCENTILES, self.sketch.percentile(PERCENTILES)))
+            summary['percentiles']['max'] = self.max
+        if self.scaling:
+            buckets = sorted(self.scaling)
+            summary['by_length'] = [OrderedDict([('packets', [2 ** bucket, 2 ** (bucket + 1) - 1]),
+                                                 ('traces', self.scaling[bucket][0]),
+                                                 ('mean', self.scaling[bucket][1] / self.scaling[bucket][0])])
+                                    for bucket in buckets]
+            # least-squares slope of log(mean time) over log(mean length) of the buckets
+            lengths = np.array([self.scaling[b][2] / self.scaling[b][0] for b in buckets])
+            means = np.array([self.scaling[b][1] / self.scaling[b][0] for b in buckets])
+            if len(buckets) > 1 and (means > 0).all():
+                summary['exponent'] = float(np.polyfit(np.log(lengths), np.log(means), 1)[0])
+        return summary
+
+
+class _Timer(object):
+    def __init__(self, name, packets):
+        self.name = name
+        self.packets = packets
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start, self.packets)
+
+
+class _NoTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+def timed(name, packets=None):
+    """
+    context timing a block or phase of one trace with packets packets
+    """
+    if not enabled:
+        return _NO_TIMER
+    return _Timer(name, packets)
+
+
+def record(name, seconds, packets=None):
+    """
+    account for the time of a block or phase on one or more traces (seconds and packets may be arrays)
+    """
+    if not enabled:
+        return
+    with _lock:
+        if name not in _stats:
+            _stats[name] = Stats()
+        _stats[name].add(seconds, packets)
+
+
+def _dump(dump_dir):
+    if _stats:
+        with open(os.path.join(dump_dir, 'worker-{}.pkl'.format(os.getpid())), 'wb') as fd:
+            pickle.dump(_stats, fd)
+
+
+def enable(dump_dir=None):
+    """
+    start profiling this process
+    with dump_dir (for pool workers), the statistics are saved there when the process exits
+    """
+    global enabled, _stats
+    enabled = True
+    _stats = {}
+    if dump_dir is not None:
+        mp_util.Finalize(None, _dump, args=(dump_dir,), exitpriority=10)
+
+
+def write_report(out_path, dump_dir, wall_seconds, phases=('parse', 'defense', 'write')):
+    """
+    merge the statistics of this process and of the workers saved in dump_dir (removed afterwards)
+    into out_path/Profile.json; feature blocks are listed by total time, largest first
+    """
+    merged = {}
+    parts = [_stats]
+    for path in sorted(glob.glob(os.path.join(dump_dir, 'worker-*.pkl'))):
+        with open(path, 'rb') as fd:
+            parts.append(pickle.load(fd))
+    for stats in parts:
+        for name, entry in stats.items():
+            if name not in merged:
+                merged[name] = Stats()
+            merged[name].merge(entry)
+    shutil.rmtree(dump_dir, ignore_errors=True)
+
+    blocks = sorted((name for name in merged if name not in phases), key=lambda name: -merged[name].seconds)
+    block_seconds = sum(merged[name].seconds for name in blocks)
+    report = OrderedDict()
+    report['processes'] = len(parts)
+    report['wall_seconds'] = wall_seconds
+    report['phases'] = OrderedDict((name, merged[name].summary()) for name in phases if name in merged)
+    report['blocks'] = OrderedDict()
+    for name in blocks:
+        summary = merged[name].summary()
+        summary['share'] = merged[name].seconds / block_seconds if block_seconds else 0.0
+        report['blocks'][name] = summary
+    with open(os.path.join(out_path, REPORT_FILE), 'w') as fd:
+        json.dump(report, fd, indent=2)
+    return report
@@ -0,0 +1,134 @@
+# fixed-length packet sequences for DF and Tik-Tok style classifiers
+# every trace of a packed trace store (see trace_store.py) is truncated to its first L packets
+# or padded with zeros to L packets, and written into one memory-mapped .npy tensor:
+#   direction         -- (N, L) packet directions, +1 outgoing and -1 incoming (DF)
+#   tiktok            -- (N, L) directional timing, direction * timestamp (Tik-Tok)
+#   direction_timing  -- (N, L, 2) direction and timestamp channels
+# rows follow the store order, with the labels in sites.npy and instances.npy next to sequences.npy.
+# analysis/data_utils.load_data and classifier/rf.py load the tensor through load_sequences, one row per trace
+# (flattened to (N, 2L) for direction_timing).
+# pool workers fill disjoint row ranges of the tensor in place, straight from the memory-mapped store columns
+import os
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+import dataset
+import trace_store
+
+SEQUENCES_FILE = 'sequences.npy'
+KINDS = ('direction', 'tiktok', 'direction_timing')
+# traces per worker task
+CHUNK_ROWS = 1024
+
+
+def sequences(times, sizes, offsets, length, kind='direction', dtype='float32'):
+    """
+    padded/truncated sequences of a batch of traces, trace i spanning [offsets[i], offsets[i + 1])
+    of times and sizes (the layout of a trace store)
+    returns an (n, length) array, or (n, length, 2) for direction_timing
+    """
+    if kind not in KINDS:
+        raise ValueError("unknown sequence kind {}, expected one of {}".format(kind, ', '.join(KINDS)))
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.minimum(np.diff(offsets), length)
+    # row, position and store index of every packet kept
+    ids = np.repeat(np.arange(len(lengths)), lengths)
+    ranks = np.arange(len(ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    packets = np.repeat(offsets[:-1], lengths) + ranks
+
+    direction = np.sign(np.asarray(sizes[packets], dtype=np.float64))
+    shape = (len(lengths), length) + ((2,) if kind == 'direction_timing' else ())
+    out = np.zeros(shape, dtype=dtype)
+    if kind == 'direction':
+        out[ids, ranks] = direction
+    elif kind == 'tiktok':
+        out[ids, ranks] = direction * times[packets]
+    else:
+        out[ids, ranks, 0] = direction
+        out[ids, ranks, 1] = times[packets]
+    return out
+
+
+def _fill_chunk(args):
+    """
+    write the sequences of store traces [start, end) into their rows of the tensor
+    """
+    store_path, tensor_path, start, end, kind = args
+    store = trace_store.open_store(store_path)
+    tensor = np.load(tensor_path, mmap_mode='r+')
+    offsets = store.offsets[start:end + 1]
+    tensor[start:end] = sequences(store.times, store.sizes, offsets, tensor.shape[1], kind, tensor.dtype)
+    tensor.flush()
+    return end - start
+
+
+def build(store_path, out_path, length=5000, kind='direction', dtype='float32', workers=None):
+    """
+    write the sequences of all traces of a store into out_path/sequences.npy
+    the tensor is allocated on disk up front and filled in parallel by workers processes
+    (the number of CPUs if None)
+    """
+    if kind not in KINDS:
+        raise ValueError("unknown sequence kind {}, expected one of {}".format(kind, ', '.join(KINDS)))
+    if kind != 'direction' and not np.issubdtype(np.dtype(dtype), np.floating):
+        raise ValueError("{} sequences hold timestamps and need a floating point dtype".format(kind))
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+    store = trace_store.open_store(store_path)
+    shape = (len(store), length) + ((2,) if kind == 'direction_timing' else ())
+    tensor_path = os.path.join(out_path, SEQUENCES_FILE)
+    if len(store):
+        tensor = np.lib.format.open_memmap(tensor_path, mode='w+', dtype=dtype, shape=shape)
+        del tensor
+    else:
+        np.save(tensor_path, np.zeros(shape, dtype=dtype))
+
+    tasks = [(store_path, tensor_path, start, min(start + CHUNK_ROWS, len(store)), kind)
+             for start in range(0, len(store), CHUNK_ROWS)]
+    pool = Pool(workers)
+    progress = tqdm(total=len(store))
+    for rows in pool.imap_unordered(_fill_chunk, tasks):
+        progress.update(rows)
+    progress.close()
+    pool.close()
+    pool.join()
+
+    np.save(os.path.join(out_path, dataset.SITES_FILE), store.sites)
+    np.save(os.path.join(out_path, dataset.INSTANCES_FILE), store.instances)
+
+
+def load_sequences(path, mmap_mode='r', flat=False):
+    """
+    load the sequence tensor and label arrays written by build
+    with flat, (N, L, 2) tensors are flattened to (N, 2L) rows, each packet's direction and timestamp side by side
+    """
+    X = np.load(os.path.join(path, SEQUENCES_FILE), mmap_mode=mmap_mode)
+    if flat:
+        X = X.reshape(X.shape[0], -1)
+    sites = np.load(os.path.join(path, dataset.SITES_FILE))
+    instances = np.load(os.path.join(path, dataset.INSTANCES_FILE))
+    return X, sites, instances
+
+
+def parse_args():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser("Build a fixed-length packet sequence tensor from a packed trace store.")
+    parser.add_argument("-t", "--traces", required=True, help="Packed trace store (see trace_store.py).")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("-l", "--length", default=5000, type=int,
+                        help="Number of packets per sequence; longer traces are truncated, shorter ones padded.")
+    parser.add_argument("-k", "--kind", default='direction', choices=KINDS)
+    parser.add_argument("--dtype", default='float32', help="Numpy dtype of the tensor, e.g. int8 for directions.")
+    parser.add_argument("-w", "--workers", default=None, type=int,
+                        help="Number of worker processes (default: the number of CPUs).")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    build(args.traces, args.output, length=args.length, kind=args.kind, dtype=args.dtype, workers=args.workers)
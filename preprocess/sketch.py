@@ -0,0 +1,73 @@
+# mergeable quantile sketch
+# a deterministic KLL-style compactor stack: level i holds values standing for 2 ** i values each,
+# and a level growing beyond the capacity is sorted and every other value is promoted to the next level.
+# sketches of parts of a dataset (e.g. computed by pool workers) merge into the sketch of the whole,
+# with memory bounded by capacity * log2(n / capacity) values.
+# while no level has been compacted the sketch holds every value and its quantiles equal numpy.percentile
+import numpy as np
+
+
+class QuantileSketch(object):
+    """
+    Mergeable, bounded-memory summary of a stream of values for quantile queries
+    """
+    def __init__(self, capacity=16384):
+        self.capacity = capacity
+        self.levels = [np.empty(0)]
+        # alternating offset of the values promoted out of every level
+        self.offsets = [0]
+
+    def __len__(self):
+        """
+        number of values summarized
+        """
+        return sum(len(level) << i for i, level in enumerate(self.levels))
+
+    def update(self, values):
+        """
+        add values to the sketch
+        """
+        self.levels[0] = np.concatenate((self.levels[0], np.asarray(values, dtype=np.float64).ravel()))
+        self._compact()
+
+    def merge(self, other):
+        """
+        add the values summarized by another sketch
+        """
+        for i, level in enumerate(other.levels):
+            if i == len(self.levels):
+                self.levels.append(np.empty(0))
+                self.offsets.append(0)
+            self.levels[i] = np.concatenate((self.levels[i], level))
+        self._compact()
+
+    def _compact(self):
+        i = 0
+        while i < len(self.levels):
+            level = self.levels[i]
+            if len(level) > self.capacity:
+                level = np.sort(level)
+                # an odd value out stays on this level
+                keep = level[len(level) - len(level) % 2:]
+                promoted = level[self.offsets[i]:len(level) - len(level) % 2:2]
+                self.offsets[i] ^= 1
+                self.levels[i] = keep
+                if i + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                    self.offsets.append(0)
+                self.levels[i + 1] = np.concatenate((self.levels[i + 1], promoted))
+            i += 1
+
+    def percentile(self, q):
+        """
+        estimate the q-th percentiles of the summarized values, interpolating linearly like numpy.percentile
+        """
+        if len(self.levels) == 1 or not any(len(level) for level in self.levels[1:]):
+            return np.percentile(self.levels[0], q)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** i) for i, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values, weights = values[order], weights[order]
+        # rank of the middle of the values each stored value stands for
+        ranks = np.cumsum(weights) - (weights + 1) / 2
+        return np.interp(np.asarray(q, dtype=np.float64) / 100 * (weights.sum() - 1), ranks, values)
@@ -0,0 +1,156 @@
+# packed trace store
+# one-time conversion of a directory (or tar archive) of Wang-format trace files into a columnar binary store:
+#   times.bin     -- packet timestamps of all traces, concatenated (float64 or float32)
+#   sizes.bin     -- signed packet sizes of all traces, concatenated (int16)
+#   offsets.npy   -- trace i spans [offsets[i], offsets[i+1]) of times.bin/sizes.bin
+#   sites.npy, instances.npy, names.npy -- per-trace labels and original file names
+#   store.json    -- dtypes and counts needed to memory-map the binary columns
+import os
+import json
+import argparse
+import threading
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+from traces import ArchiveMember, bounded, enumerate_files, is_archive, iter_archive, parse_name, read_member, read_trace
+
+STORE_META = 'store.json'
+SIZE_DTYPE = 'int16'
+# maximum number of archive members read ahead of the parsing workers
+MAX_PENDING = 1024
+
+# stores opened by this process, reused across tasks by pool workers
+_open_stores = {}
+
+
+def is_store(path):
+    """
+    check whether a path points to a packed trace store
+    """
+    return os.path.isfile(os.path.join(path, STORE_META))
+
+
+def _load_file(source):
+    name = source.name if isinstance(source, ArchiveMember) else os.path.basename(source)
+    try:
+        if isinstance(source, ArchiveMember):
+            return name, read_member(source)
+        return name, read_trace(source)
+    except (ValueError, IndexError):
+        return name, None
+
+
+def pack(trace_path, store_path, time_dtype='float64', extension='.cell'):
+    """
+    pack all trace files found under trace_path into a store at store_path
+    trace_path may also be a (compressed) tar archive, whose traces are stored in archive order
+    """
+    semaphore = threading.Semaphore(MAX_PENDING)
+    if is_archive(trace_path):
+        file_list, total = bounded(iter_archive(trace_path, extension=extension), semaphore), None
+    else:
+        file_list = enumerate_files(trace_path, extension=extension)
+        file_list.sort(key=parse_name)
+        total = len(file_list)
+    if not os.path.exists(store_path):
+        os.makedirs(store_path)
+
+    offsets = [0]
+    sites, instances, names = [], [], []
+    size_max = np.iinfo(SIZE_DTYPE).max
+    pool = Pool()
+    with open(os.path.join(store_path, 'times.bin'), 'wb') as ft, \
+            open(os.path.join(store_path, 'sizes.bin'), 'wb') as fs:
+        for name, trace in tqdm(pool.imap(_load_file, file_list, chunksize=16), total=total):
+            semaphore.release()
+            # skip unreadable trace files, like extract.py does
+            if trace is None:
+                continue
+            times, sizes = trace
+            sizes = np.asarray(sizes)
+            if sizes.size and np.abs(sizes).max() > size_max:
+                raise ValueError("{}: packet size does not fit in {}".format(name, SIZE_DTYPE))
+            ft.write(np.asarray(times, dtype=time_dtype).tobytes())
+            fs.write(sizes.astype(SIZE_DTYPE).tobytes())
+            offsets.append(offsets[-1] + len(times))
+            site, instance = parse_name(name)
+            sites.append(site)
+            instances.append(instance)
+            names.append(name)
+    pool.close()
+    pool.join()
+
+    np.save(os.path.join(store_path, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(store_path, 'sites.npy'), np.array(sites, dtype=np.int32))
+    np.save(os.path.join(store_path, 'instances.npy'), np.array(instances, dtype=np.int32))
+    np.save(os.path.join(store_path, 'names.npy'), np.array(names, dtype=str))
+    with open(os.path.join(store_path, STORE_META), 'w') as fd:
+        json.dump({'time_dtype': np.dtype(time_dtype).name, 'size_dtype': SIZE_DTYPE,
+                   'traces': len(names), 'packets': offsets[-1]}, fd)
+
+
+class TraceStore(object):
+    """
+    Read-only, memory-mapped view of a packed trace store
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, STORE_META), 'r') as fd:
+            meta = json.load(fd)
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.sites = np.load(os.path.join(path, 'sites.npy'))
+        self.instances = np.load(os.path.join(path, 'instances.npy'))
+        self.names = np.load(os.path.join(path, 'names.npy'))
+        self._index = {(s, i): n for n, (s, i) in enumerate(zip(self.sites.tolist(), self.instances.tolist()))}
+        self.times = self._map('times.bin', meta['time_dtype'], meta['packets'])
+        self.sizes = self._map('sizes.bin', meta['size_dtype'], meta['packets'])
+
+    def _map(self, filename, dtype, length):
+        # np.memmap refuses zero-length files
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, filename), dtype=dtype, mode='r', shape=(length,))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        """
+        return (times, sizes) of trace i as views into the memory-mapped columns
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.times[start:end], self.sizes[start:end]
+
+    def find(self, site, instance):
+        """
+        return the store index of a site-instance pair
+        """
+        return self._index[(site, instance)]
+
+
+def open_store(path):
+    """
+    open a trace store, reusing a store already opened by this process
+    """
+    if path not in _open_stores:
+        _open_stores[path] = TraceStore(path)
+    return _open_stores[path]
+
+
+def parse_args():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser("Pack a directory or tar archive of trace files into a binary trace store.")
+    parser.add_argument("-t", "--traces", required=True)
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("-e", "--extension", default='.cell')
+    parser.add_argument("--time_dtype", default='float64', choices=['float64', 'float32'])
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    pack(args.traces, args.output, time_dtype=args.time_dtype, extension=args.extension)
@@ -0,0 +1,121 @@
+# trace enumeration and parsing helpers shared by the extraction scripts
+# traces may be plain or compressed (.gz, .bz2, .xz) files, or members of tar archives,
+# which are streamed without unpacking them to disk.
+# raw pcap/pcapng captures are read in place of Wang-format files (see pcap.py)
+import io
+import os
+import re
+import bz2
+import gzip
+import lzma
+import tarfile
+from collections import namedtuple
+
+import pcap
+
+# compressed single-trace files are read transparently
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+DECOMPRESSORS = {'.gz': gzip.decompress, '.bz2': bz2.decompress, '.xz': lzma.decompress}
+COMPRESSED_SUFFIX = '(?:\\.gz|\\.bz2|\\.xz)?'
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# a trace file read out of a tar archive
+ArchiveMember = namedtuple('ArchiveMember', ['archive', 'name', 'mtime', 'data'])
+
+
+def trace_pattern(splitter='-', extension=''):
+    """
+    regular expression matching trace file names or packet captures, optionally compressed
+    """
+    suffixes = '|'.join(re.escape(suffix) for suffix in (extension,) + pcap.CAPTURE_EXTENSIONS)
+    return re.compile('(\\d+){}(\\d+)(?:{}){}'.format(re.escape(splitter), suffixes, COMPRESSED_SUFFIX))
+
+
+def enumerate_files(dir, splitter='-', extension=''):
+    """
+    recursively enumerate files in a directory root
+    """
+    pattern = trace_pattern(splitter, extension)
+    file_list = []
+    for dirname, dirnames, filenames in os.walk(dir):
+        # filter out invalid file names
+        filenames = [filename for filename in filenames if pattern.fullmatch(filename)]
+        for filename in filenames:
+            file_list.append(os.path.join(dirname, filename))
+    return file_list
+
+
+def parse_name(name, splitter='-'):
+    """
+    split a trace file name of form 'site-instance[.ext]' into its integer labels
+    """
+    site, instance = os.path.basename(name).split(splitter)[:2]
+    return int(site), int(instance.split('.')[0])
+
+
+def parse_lines(lines):
+    """
+    parse the lines of a trace in Wang's 'time<tab>size' format
+    """
+    times = []
+    sizes = []
+    for x in lines:
+        x = x.split("\t")
+        times.append(float(x[0]))
+        sizes.append(int(x[1]))
+    return times, sizes
+
+
+def read_trace(filepath):
+    """
+    parse a trace file in Wang's 'time<tab>size' format, or the trace of a packet capture
+    """
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(filepath)[1], open)
+    if pcap.is_capture(filepath):
+        with opener(filepath, "rb") as f:
+            return pcap.read_capture(f)
+    with opener(filepath, "rt") as f:
+        return parse_lines(f)
+
+
+def read_member(member):
+    """
+    parse a trace file read out of an archive
+    """
+    data = member.data
+    suffix = os.path.splitext(member.name)[1]
+    if suffix in DECOMPRESSORS:
+        data = DECOMPRESSORS[suffix](data)
+    if pcap.is_capture(member.name):
+        return pcap.read_capture(io.BytesIO(data))
+    return parse_lines(data.decode().splitlines())
+
+
+def is_archive(path):
+    """
+    check whether a path points to a (possibly compressed) tar archive
+    """
+    return os.path.isfile(path) and path.endswith(ARCHIVE_SUFFIXES)
+
+
+def iter_archive(path, splitter='-', extension=''):
+    """
+    stream the trace files of a tar archive in archive order,
+    decompressing it on the fly in a single pass
+    """
+    pattern = trace_pattern(splitter, extension)
+    with tarfile.open(path, 'r|*') as tar:
+        for member in tar:
+            name = os.path.basename(member.name)
+            if member.isfile() and pattern.fullmatch(name):
+                yield ArchiveMember(path, name, int(member.mtime), tar.extractfile(member).read())
+
+
+def bounded(iterable, semaphore):
+    """
+    yield from iterable, taking the semaphore before every item
+    the consumer of the results releases it, so that a pool does not read ahead without limit
+    """
+    for item in iterable:
+        semaphore.acquire()
+        yield item
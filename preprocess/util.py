@@ -1,4 +1,6 @@
 
+import numpy as np
+
 # extract params
 FEATURE_EXT = ".features"
 NORMALIZE_TRAFFIC = 0
@@ -8,7 +10,7 @@ NORMALIZE_TRAFFIC = 0
 PACKET_NUMBER = False
 PKT_TIME = False
 UNIQUE_PACKET_LENGTH = False
-NGRAM_ENABLE = False   # removed from extract (not in table)
+NGRAM_ENABLE = False   # n-gram counts of the direction sequence (not in table)
 TRANS_POSITION = False  # removed from extract (not in table)
 PACKET_DISTRIBUTION = False
 BURSTS = False
@@ -35,12 +37,26 @@ RF_ATTACK = True       # RF (direction, timing)
 # packet number per second, how many seconds to count?
 howlong = 100
 
-# n-gram feature
+# n-gram feature: n, or a list of n (up to about 8) extracted together
 NGRAM = 3
 
 # CUMUL feature number
 featureCount = 100
 
+# trace filters applied before extraction (see filters.py)
+# traces with fewer packets are dropped; 1 drops empty traces only
+MIN_PACKETS = 1
+# drop traces whose packet count is an outlier within their site
+REMOVE_OUTLIERS = False
+# outliers lie more than OUTLIER_IQR interquartile ranges outside the quartiles
+OUTLIER_IQR = 1.5
+
+# defenses simulated on every trace before extraction (see defenses.py): (name, {parameter: value}) steps
+# applied in order, e.g. [('jitter', {'scale': 0.005}), ('dummy', {'rate_out': 20.0, 'rate_in': 50.0})]
+DEFENSES = []
+# seed of the defenses' random draws
+DEFENSE_SEED = 0
+
 
 # Python3 conversion of python2 cmp function
 def cmp(a, b):
@@ -49,33 +65,22 @@ def cmp(a, b):
 
 # normalize traffic
 def normalize_traffic(times, sizes):
-    # sort
-    tmp = sorted(zip(times, sizes))
-
-    times = [x for x, _ in tmp]
-    sizes = [x for _, x in tmp]
-
-    TimeStart = times[0]
+    """
+    sort a trace by time, start it at time 0 and split every packet into PktSize-byte cells
+    each cell is a +1 / -1 packet at the time of the packet it comes from
+    """
+    if len(times) == 0:
+        return [], []
+    times = np.asarray(times)
+    sizes = np.asarray(sizes)
     PktSize = 500
 
-    # normalize time
-    for i in range(len(times)):
-        times[i] = times[i] - TimeStart
-
-    # normalize size
-    for i in range(len(sizes)):
-        sizes[i] = (abs(sizes[i]) / PktSize) * cmp(sizes[i], 0)
-
-    # flat it
-    newtimes = list()
-    newsizes = list()
-
-    for t, s in zip(times, sizes):
-        numCell = abs(s)
-        oneCell = cmp(s, 0)
-        for r in range(numCell):
-            newtimes.append(t)
-            newsizes.append(oneCell)
+    # sort by time, then size
+    order = np.lexsort((sizes, times))
+    times = times[order] - times[order[0]]
+    sizes = sizes[order]
 
-    return newtimes, newsizes
+    # flat it: whole cells per packet
+    cells = (np.abs(sizes) // PktSize).astype(np.int64)
+    return np.repeat(times, cells).tolist(), np.repeat(np.sign(sizes), cells).astype(np.int64).tolist()
 